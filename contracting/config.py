@@ -27,5 +27,14 @@ WRITE_COST_PER_BYTE = 25
 
 STAMPS_PER_TAU = 20
 
+# Bytes contract code may allocate in one transaction
+TX_MEMORY_LIMIT = 500 * 1000 * 1000
+
 BLOCK_NUM_DEFAULT = -1
 FILENAME_LEN_MAX = 255
+FILE_POOL_SIZE = 64
+LMDB_MAP_SIZE = 64 * 1024 ** 3
+VALUE_CACHE_BYTES = 64 * 1024 * 1024
+PARALLEL_MIN_TXS = 8
+CODE_CACHE_BYTES = 32 * 1024 * 1024
+CONTRACT_INDEX_MISSING_MAX = 10000
@@ -20,9 +20,7 @@ class Contract:
 
         code_obj = c.parse_to_code(code, lint=True)
 
-        scope = env.gather()
-        scope.update({'__contract__': True})
-        scope.update(rt.env)
+        scope = {**env.SCOPE, '__contract__': True, '__name__': name, **rt.env}
 
         exec(code_obj, scope)
 
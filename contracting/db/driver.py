@@ -1,5 +1,6 @@
-from contracting.db.encoder import encode, decode, encode_kv
+from contracting.db.encoder import encode, decode, encode_kv, ENCODERS, Encoded
 from contracting.execution.runtime import rt
+from contracting.execution.stats import STATS
 from contracting.stdlib.bridge.time import Datetime
 from contracting.stdlib.bridge.decimal import ContractingDecimal
 from contracting import config
@@ -9,10 +10,14 @@ import marshal
 import decimal
 import requests
 import pymongo
+import lmdb
 import os
 from pathlib import Path
 import shutil
 import hashlib
+import threading
+from collections import OrderedDict
+from copy import deepcopy
 
 import motor.motor_asyncio
 import asyncio
@@ -21,6 +26,7 @@ from contracting.db.hdf5 import h5c
 
 FILE_EXT = '.d'
 HASH_EXT = '.x'
+LOCK_EXT = '-lock'
 
 STORAGE_HOME = Path().home().joinpath('.lamden')
 
@@ -33,11 +39,13 @@ OWNER_KEY = '__owner__'
 TIME_KEY = '__submitted__'
 COMPILED_KEY = '__compiled__'
 DEVELOPER_KEY = '__developer__'
+METADATA_KEYS = (CODE_KEY, OWNER_KEY, TIME_KEY, DEVELOPER_KEY)
 
 class Driver:
-    def __init__(self, db='lamden', collection='state'):
+    def __init__(self, db='lamden', collection='state', codec='json'):
         self.client = pymongo.MongoClient()
         self.db = self.client[db][collection]
+        self.encode = ENCODERS[codec]
 
     def get(self, item: str):
         v = self.db.find_one({'_id': item})
@@ -47,13 +55,30 @@ class Driver:
 
         return decode(v['v'])
 
+    def get_many(self, keys):
+        values = {k: None for k in keys}
+        for entry in self.db.find({'_id': {'$in': list(values)}}):
+            values[entry['_id']] = decode(entry['v'])
+        return values
+
     def set(self, key, value, block_num=None):
         if value is None:
             self.__delitem__(key)
         else:
-            v = encode(value)
+            v = self.encode(value)
             self.db.update_one({'_id': key}, {'$set': {'v': v}}, upsert=True, )
 
+    def set_many(self, items, block_num=None):
+        ops = []
+        for key, value in dict(items).items():
+            if value is None:
+                ops.append(pymongo.DeleteOne({'_id': key}))
+            else:
+                ops.append(pymongo.UpdateOne({'_id': key}, {'$set': {'v': self.encode(value)}}, upsert=True))
+
+        if ops:
+            self.db.bulk_write(ops, ordered=False)
+
     def flush(self):
         self.db.drop()
 
@@ -105,6 +130,12 @@ class AsyncDriver:
 
         return decode(v['v'])
 
+    async def get_many(self, keys):
+        values = {k: None for k in keys}
+        async for entry in self.db.find({'_id': {'$in': list(values)}}):
+            values[entry['_id']] = decode(entry['v'])
+        return values
+
     async def set(self, key, value, block_num=None):
         if value is None:
             await self.db.delete_one({'_id': key})
@@ -153,8 +184,8 @@ class AsyncDriver:
 
 
 class InMemDriver(Driver):
-    def __init__(self):
-        super().__init__()
+    def __init__(self, codec='json'):
+        super().__init__(codec=codec)
         self.db = {}
 
     def _set_state(self, key, value, block_num):
@@ -162,8 +193,8 @@ class InMemDriver(Driver):
         if value is None:
             self.__delitem__(key)
         else:
-            v = encode(value).encode()
-            self.db[k] = {'value': v, 'block_num': str(block_num)}
+            v = self.encode(value)
+            self.db[k] = {'value': v.encode() if isinstance(v, str) else v, 'block_num': str(block_num)}
 
     def get(self, item: str):
         key = item.encode()
@@ -172,12 +203,19 @@ class InMemDriver(Driver):
             return None
         return decode(res.get('value'))
 
+    def get_many(self, keys):
+        return {k: self.get(k) for k in keys}
+
     def set(self, key: str, value, block_num=None):
         if block_num is None:
             self._set_state(key=key, value=value, block_num=None)
         else:
             self.safe_set(key=key, value=value, block_num=block_num)
 
+    def set_many(self, items, block_num=None):
+        for key, value in dict(items).items():
+            self.set(key=key, value=value, block_num=block_num)
+
     def safe_set(self, key: str, value, block_num):
         current_block = self.get_block(key=key)
 
@@ -237,11 +275,269 @@ class InMemDriver(Driver):
         except KeyError:
             pass
 
+class FilePool:
+    # LRU pool of open HDF5 file handles keyed by path. h5c checks each handle under the file lock and reopens it if
+    # another process has written the file since, so pooled handles never read stale state.
+    def __init__(self, size=config.FILE_POOL_SIZE):
+        self.size = size
+        self.handles = OrderedDict()
+        self.pid = os.getpid()
+
+    def get(self, path, create=False):
+        if self.pid != os.getpid():
+            # Handles inherited across a fork share their file locks with the parent, so a child opens its own
+            self.handles = OrderedDict()
+            self.pid = os.getpid()
+
+        handle = self.handles.get(path)
+        if handle is not None:
+            self.handles.move_to_end(path)
+            return handle
+
+        if not create and not os.path.isfile(path):
+            return None
+
+        handle = h5c.open(path, create)
+        if handle is None:
+            return None
+
+        self.handles[path] = handle
+
+        while len(self.handles) > self.size:
+            _, evicted = self.handles.popitem(last=False)
+            h5c.close(evicted)
+
+        return handle
+
+    def close(self, path):
+        handle = self.handles.pop(path, None)
+        if handle is not None:
+            h5c.close(handle)
+
+    def close_all(self):
+        for handle in self.handles.values():
+            h5c.close(handle)
+        self.handles.clear()
+
+    def __len__(self):
+        return len(self.handles)
+
+
+class ValueCache:
+    # LRU of decoded driver values bounded by their encoded size. Dicts and lists are kept encoded and decoded on every
+    # hit, so a contract mutating what it read can never change what the next reader sees.
+    def __init__(self, size=config.VALUE_CACHE_BYTES):
+        self.size = size
+        self.used = 0
+        self.entries = OrderedDict()
+
+    def get(self, key, default=None):
+        entry = self.lookup(key)
+        return default if entry is None else entry[0]
+
+    def lookup(self, key):
+        # Returns the value with its metered size, or None when the key is not cached
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+
+        self.entries.move_to_end(key)
+        value, encoded, nbytes = entry
+
+        return decode(value) if encoded else value, nbytes
+
+    def set(self, key, value):
+        # Returns the metered size of the value, which is what encode_kv would measure
+        self.pop(key)
+
+        encoded = isinstance(value, (dict, list))
+        data = encode(value)
+        nbytes = len(key.encode()) + len(data.encode())
+        if nbytes > self.size:
+            return nbytes
+
+        self.entries[key] = (data if encoded else value, encoded, nbytes)
+        self.used += nbytes
+
+        while self.used > self.size:
+            _, (_, _, evicted) = self.entries.popitem(last=False)
+            self.used -= evicted
+
+        return nbytes
+
+    def pop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.used -= entry[2]
+
+    def clear(self):
+        self.entries.clear()
+        self.used = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class CodeEntry:
+    def __init__(self, code, digest, size):
+        self.code = code
+        self.hash = digest
+        self.size = size
+        self.instance = None                 # Module the loader executed from this code, when it can be reused
+        self.reads_state = None              # Whether the module body depends on state, once it has been executed
+
+
+class CodeCache:
+    # LRU of unmarshalled contract code, bounded by the size of the marshalled code. Keyed by the contract's name and
+    # the hash of its source, as given by ContractDriver.code_key, so drivers holding different code under one name
+    # never share an entry. Entries of a name are dropped when the contract is set, deleted or rolled back, unless it
+    # was set again with code of the same hash. Shared by every thread running contracts, so changes to the LRU order
+    # and size are made under a lock.
+    def __init__(self, size=config.CODE_CACHE_BYTES):
+        self.size = size
+        self.used = 0
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.RLock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry
+
+    def peek(self, key):
+        return self.entries.get(key)
+
+    def set(self, key, blob):
+        # Code without a key is handed back without being kept
+        entry = CodeEntry(marshal.loads(blob), hashlib.sha256(blob).hexdigest(), len(blob))
+
+        with self.lock:
+            self.pop(key)
+
+            if key is None or entry.size > self.size:
+                return entry
+
+            self.entries[key] = entry
+            self.used += entry.size
+
+            while self.used > self.size:
+                _, evicted = self.entries.popitem(last=False)
+                self.used -= evicted.size
+
+        return entry
+
+    def invalidate(self, name, blob=None):
+        digest = hashlib.sha256(blob).hexdigest() if blob is not None else None
+
+        with self.lock:
+            for key in [key for key, entry in self.entries.items() if key[0] == name and entry.hash != digest]:
+                self.pop(key)
+
+    def pop(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.used -= entry.size
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.used = 0
+
+    def __contains__(self, name):
+        return any(key[0] == name for key in self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+CODE_CACHE = CodeCache()
+
+
+class ContractIndex:
+    # Deployed contracts by name, with the hash of their source and their metadata, so imports and owner checks resolve
+    # without reading contract storage. Names looked up and found not to be contracts are remembered too, up to a limit.
+    # Each ContractDriver keeps its own, since it holds what that driver's pending writes make of the contracts.
+    def __init__(self, missing_max=config.CONTRACT_INDEX_MISSING_MAX):
+        self.contracts = {}
+        self.missing = OrderedDict()
+        self.missing_max = missing_max
+
+    def get(self, name):
+        # Returns the metadata of a contract keyed by variable, plus 'hash' for its source, and None otherwise
+        return self.contracts.get(name)
+
+    def set(self, name, code, owner=None):
+        self.pop(name)
+
+        if code is None:
+            self.missing[name] = None
+            while len(self.missing) > self.missing_max:
+                self.missing.popitem(last=False)
+        else:
+            self.contracts[name] = {'hash': hashlib.sha256(code.encode()).hexdigest(), OWNER_KEY: owner}
+
+    def pop(self, name):
+        self.contracts.pop(name, None)
+        self.missing.pop(name, None)
+
+    def clear(self):
+        self.contracts.clear()
+        self.missing.clear()
+
+    def __contains__(self, name):
+        return name in self.contracts or name in self.missing
+
+    def __len__(self):
+        return len(self.contracts)
+
+
+class WriteAheadLog:
+    # Hard applied writes are appended and synced here before the driver sees them, and the log is only truncated once
+    # the driver has synced them too. A crash part way through writing a block, which may span many contract files,
+    # is then repaired on startup by replaying the log. The price is commit latency: every hard apply waits for an
+    # fsync of the log and then for the driver's files to be synced, where without a log it waits for neither.
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(exist_ok=True, parents=True)
+        self.file = open(self.path, 'ab')
+
+    def append(self, records):
+        # One sequential write and one fsync for every HLC in the batch
+        data = ''.join(encode({'hlc': hlc, 'writes': writes}) + '\n' for hlc, writes in records)
+        self.file.write(data.encode())
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def records(self):
+        with open(self.path, 'rb') as f:
+            for line in f:
+                record = decode(line)
+                if record is None:
+                    # A torn last line was never synced, so its block was never acknowledged
+                    break
+                yield record['hlc'], record['writes']
+
+    def truncate(self):
+        self.file.truncate(0)
+
+
 class FSDriver:
-    def __init__(self, root=None):
+    def __init__(self, root=None, pool_size=config.FILE_POOL_SIZE, codec='json'):
         self.root = Path(root) if root is not None else STORAGE_HOME
         self.contract_state = self.root.joinpath('contract_state')
         self.run_state = self.root.joinpath('run_state')
+        self.pool = FilePool(size=pool_size)
+        self.encode = ENCODERS[codec]
+        self.unsynced = set()                # Files written since the last sync
 
         self.__build_directories()
 
@@ -262,11 +558,30 @@ class FSDriver:
     def __filename_to_path(self, filename):
         return str(self.run_state.joinpath(filename)) if filename.startswith('__') else str(self.contract_state.joinpath(filename))
 
+    def __list_dir(self, path):
+        return [f for f in os.listdir(path) if not f.endswith(LOCK_EXT)]
+
     def __get_files(self):
-        return sorted(os.listdir(self.contract_state) + os.listdir(self.run_state))
+        return sorted(self.__list_dir(self.contract_state) + self.__list_dir(self.run_state))
 
-    def __get_keys_from_file(self, filename):
-        return [filename + config.INDEX_SEPARATOR + g.replace(config.HDF5_GROUP_SEPARATOR, config.DELIMITER) for g in h5c.get_groups(self.__filename_to_path(filename))]
+    def __get_keys_from_file(self, filename, variable='', length=0):
+        handle = self.__handle(filename)
+        if handle is None:
+            return []
+        return [filename + config.INDEX_SEPARATOR + g.replace(config.HDF5_GROUP_SEPARATOR, config.DELIMITER) for g in h5c.get_groups(handle, variable, length) or []]
+
+    def __handle(self, filename, create=False):
+        return self.pool.get(self.__filename_to_path(filename), create=create)
+
+    def __write(self, filename, variable, value, block_num):
+        path = self.__filename_to_path(filename)
+        self.unsynced.add(path)
+        h5c.set(
+            self.pool.get(path, create=True),
+            variable,
+            self.encode(value) if value is not None else None,
+            block_num
+        )
 
     def __getitem__(self, key):
         return self.get(key)
@@ -279,12 +594,38 @@ class FSDriver:
 
     def get(self, item: str):
         filename, variable = self.__parse_key(item)
+        if len(filename) >= config.FILENAME_LEN_MAX:
+            return None
+
+        handle = self.__handle(filename)
+        return decode(h5c.get_value(handle, variable)) if handle is not None else None
+
+    def get_many(self, keys):
+        values = {}
+        files = {}
+        for key in keys:
+            values[key] = None
+            filename, variable = self.__parse_key(key)
+            if len(filename) < config.FILENAME_LEN_MAX:
+                files.setdefault(filename, []).append((key, variable))
+
+        for filename, pairs in files.items():
+            handle = self.__handle(filename)
+            if handle is None:
+                continue
+
+            for (key, _), value in zip(pairs, h5c.get_many(handle, [variable for _, variable in pairs])):
+                values[key] = decode(value)
 
-        return decode(h5c.get_value(self.__filename_to_path(filename), variable)) if len(filename) < config.FILENAME_LEN_MAX else None
+        return values
+
+    def __get_block(self, filename, variable):
+        handle = self.__handle(filename)
+        return h5c.get_block(handle, variable) if handle is not None else None
 
     def get_block(self, item: str):
         filename, variable = self.__parse_key(item)
-        block_num = h5c.get_block(self.__filename_to_path(filename), variable) if len(filename) < config.FILENAME_LEN_MAX else None
+        block_num = self.__get_block(filename, variable) if len(filename) < config.FILENAME_LEN_MAX else None
 
         return config.BLOCK_NUM_DEFAULT if block_num is None else int(block_num)
 
@@ -296,31 +637,48 @@ class FSDriver:
         filename, variable = self.__parse_key(key)
 
         if len(filename) < config.FILENAME_LEN_MAX:
-            h5c.set(
-                self.__filename_to_path(filename),
-                variable,
-                encode(value) if value is not None else None,
-                None
-            )
+            self.__write(filename, variable, value, None)
 
     def safe_set(self,  key: str, value: any, block_num: str):
         filename, variable = self.__parse_key(key)
 
         if len(filename) < config.FILENAME_LEN_MAX:
-            current_block = h5c.get_block(
-                self.__filename_to_path(filename),
-                variable
-            ) or "-1"
+            current_block = self.__get_block(filename, variable) or "-1"
 
             if int(block_num) >= int(current_block):
-                h5c.set(
-                    self.__filename_to_path(filename),
-                    variable,
-                    encode(value) if value is not None else None,
-                    str(block_num)
-                )
+                self.__write(filename, variable, value, str(block_num))
+
+    def set_many(self, items, block_num=None):
+        # Group writes by contract file so each file is opened and locked once for the whole batch
+        files = {}
+        for key, value in dict(items).items():
+            filename, variable = self.__parse_key(key)
+            if len(filename) < config.FILENAME_LEN_MAX:
+                files.setdefault(filename, []).append((variable, self.encode(value) if value is not None else None))
+
+        for filename, groups in files.items():
+            path = self.__filename_to_path(filename)
+            self.unsynced.add(path)
+            h5c.set_many(self.pool.get(path, create=True), groups, str(block_num) if block_num else None)
+
+    def sync(self):
+        # Files are closed after every write, so what HDF5 wrote is already with the OS and only needs to reach disk
+        paths, self.unsynced = self.unsynced, set()
+        for path in paths:
+            try:
+                fd = os.open(path, os.O_RDONLY)
+            except FileNotFoundError:
+                continue
+
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
 
     def flush(self):
+        self.pool.close_all()
+        self.unsynced.clear()
+
         if self.run_state.is_dir():
             shutil.rmtree(self.run_state)
         if self.contract_state.is_dir():
@@ -333,53 +691,203 @@ class FSDriver:
         return file_path.is_file()
 
     def flush_file(self, filename):
-        file = Path(self.__filename_to_path(filename))
-        if file.is_file():
-            file.unlink()
+        path = self.__filename_to_path(filename)
+        self.pool.close(path)
+
+        if Path(path).is_file():
+            h5c.remove(path)
 
     def delete(self, key):
         filename, variable = self.__parse_key(key)
         if len(filename) < config.FILENAME_LEN_MAX:
-            h5c.delete(self.__filename_to_path(filename), variable)
+            handle = self.__handle(filename)
+            if handle is not None:
+                h5c.delete(handle, variable)
 
     def iter(self, prefix='', length=0):
-        try:
-            filename, _ = self.__parse_key(prefix)
-        except Exception:
-            return self.keys(prefix=prefix, length=length)
-            raise ValueError('Must provide "contract.variable" at minimum as prefix to iter.')
+        filename, variable = self.__parse_key(prefix)
 
-        if not self.is_file(filename=filename):
-            return []
+        # Keys come back sorted and cut to length from a scan that only visits the groups under the prefix
+        if prefix.startswith(filename + config.INDEX_SEPARATOR):
+            return self.__get_keys_from_file(filename, variable, length)
 
-        keys_from_file = self.__get_keys_from_file(filename)
-
-        keys = [key for key in keys_from_file if key.startswith(prefix)]
-        keys.sort()
+        keys = [key for key in self.__get_keys_from_file(filename) if key.startswith(prefix)]
 
         return keys if length == 0 else keys[:length]
 
     def keys(self, prefix=None, length=0):
-        keys = set()
-        try:
-            for filename in self.__get_files():
-                for key in self.__get_keys_from_file(filename):
-                    if prefix and key.startswith(prefix):
-                        keys.add(key)
-                    elif not prefix:
-                        keys.add(key)
-
-                    if length > 0 and len(keys) >= length:
-                        raise AssertionError('Length threshold has been hit. Continuing.')
-        except AssertionError:
-            pass
+        if prefix and config.INDEX_SEPARATOR in prefix:
+            return self.iter(prefix=prefix, length=length)
+
+        keys = []
+        for filename in self.__get_files():
+            if not prefix or filename.startswith(prefix):
+                keys.extend(self.__get_keys_from_file(filename, length=length))
 
-        keys = list(keys)
         keys.sort()
+        return keys if length == 0 else keys[:length]
+
+    def get_contracts(self):
+        return sorted(self.__list_dir(self.contract_state))
+
+class LMDBDriver:
+    def __init__(self, root=None, map_size=config.LMDB_MAP_SIZE, codec='json'):
+        self.root = Path(root) if root is not None else STORAGE_HOME
+        self.path = self.root.joinpath('lmdb')
+        self.path.mkdir(exist_ok=True, parents=True)
+
+        # Values and block numbers live in two sub-databases of one environment so a batch updates both atomically
+        self.env = lmdb.open(str(self.path), map_size=map_size, max_dbs=2)
+        self.state_db = self.env.open_db(b'state')
+        self.block_db = self.env.open_db(b'blocks')
+        self.max_key_size = self.env.max_key_size()
+        self.encode = ENCODERS[codec]
+
+    def __key(self, key):
+        # Keys past the store's size limit are ignored, like FSDriver does for over-long contract names
+        key = key.encode()
+        return key if len(key) <= self.max_key_size else None
+
+    def __put(self, txn, key, value, block_num):
+        if value is None:
+            txn.delete(key, db=self.state_db)
+        else:
+            data = self.encode(value)
+            txn.put(key, data.encode() if isinstance(data, str) else data, db=self.state_db)
+
+        if block_num is None:
+            txn.delete(key, db=self.block_db)
+        else:
+            txn.put(key, str(block_num).encode(), db=self.block_db)
+
+    def __has_later_block(self, txn, key, block_num):
+        current = txn.get(key, db=self.block_db)
+        return current is not None and int(current) > int(block_num)
+
+    def __getitem__(self, key):
+        return self.get(key)
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __delitem__(self, key):
+        self.delete(key)
+
+    def get(self, item: str):
+        key = self.__key(item)
+        if key is None:
+            return None
+
+        with self.env.begin(db=self.state_db) as txn:
+            return decode(txn.get(key))
+
+    def get_many(self, keys):
+        values = {}
+        with self.env.begin(db=self.state_db) as txn:
+            for item in keys:
+                key = self.__key(item)
+                values[item] = decode(txn.get(key)) if key is not None else None
+
+        return values
+
+    def get_block(self, item: str):
+        key = self.__key(item)
+        if key is None:
+            return config.BLOCK_NUM_DEFAULT
+
+        with self.env.begin(db=self.block_db) as txn:
+            block_num = txn.get(key)
+
+        return config.BLOCK_NUM_DEFAULT if block_num is None else int(block_num)
+
+    def set(self, key, value, block_num=None):
+        if block_num:
+            self.safe_set(key, value, block_num)
+            return
+
+        key = self.__key(key)
+        if key is not None:
+            with self.env.begin(write=True) as txn:
+                self.__put(txn, key, value, None)
+
+    def safe_set(self, key: str, value: any, block_num: str):
+        key = self.__key(key)
+        if key is None:
+            return
+
+        with self.env.begin(write=True) as txn:
+            if not self.__has_later_block(txn, key, block_num):
+                self.__put(txn, key, value, block_num)
+
+    def set_many(self, items, block_num=None):
+        # The whole batch is one write transaction, so a block's writes land together or not at all
+        with self.env.begin(write=True) as txn:
+            for item, value in dict(items).items():
+                key = self.__key(item)
+                if key is None or (block_num and self.__has_later_block(txn, key, block_num)):
+                    continue
+
+                self.__put(txn, key, value, str(block_num) if block_num else None)
+
+    def delete(self, key):
+        self.set(key, None)
+
+    def iter(self, prefix='', length=0):
+        # Keys are stored sorted, so a prefix is one seek followed by a walk that stops at the first key past it
+        seek = prefix.encode()
+        keys = []
+
+        with self.env.begin(db=self.state_db) as txn:
+            cursor = txn.cursor()
+            if not cursor.set_range(seek):
+                return keys
+
+            for key in cursor.iternext(keys=True, values=False):
+                if not key.startswith(seek):
+                    break
+
+                keys.append(key.decode())
+                if len(keys) == length:
+                    break
+
         return keys
 
+    def keys(self, prefix=None, length=0):
+        return self.iter(prefix=prefix or '', length=length)
+
+    def flush(self):
+        with self.env.begin(write=True) as txn:
+            txn.drop(self.state_db, delete=False)
+            txn.drop(self.block_db, delete=False)
+
+    def flush_file(self, filename):
+        keys = self.iter(filename + config.INDEX_SEPARATOR)
+        with self.env.begin(write=True) as txn:
+            for key in keys:
+                self.__put(txn, key.encode(), None, None)
+
     def get_contracts(self):
-        return sorted(os.listdir(self.contract_state))
+        separator = config.INDEX_SEPARATOR.encode()
+        contracts = []
+
+        with self.env.begin(db=self.state_db) as txn:
+            cursor = txn.cursor()
+            found = cursor.first()
+            while found:
+                key = cursor.key()
+                if separator not in key:
+                    found = cursor.next()
+                    continue
+
+                name = key.split(separator, 1)[0]
+                if not name.startswith(b'__'):
+                    contracts.append(name.decode())
+
+                # All keys of a contract sit together, so skip past them with one seek to the byte after the separator
+                found = cursor.set_range(name + bytes([separator[0] + 1]))
+
+        return sorted(contracts)
+
 
 class WebDriver(InMemDriver):
     def __init__(self, masternode='http://masternode-01.lamden.io'):
@@ -399,16 +907,25 @@ class WebDriver(InMemDriver):
         return decode(r.json()['value'])
 
 class CacheDriver:
-    def __init__(self, driver=None):
+    def __init__(self, driver=None, wal_path=None):
         self.pending_writes = {}             # L2 cache
         self.cache = {}                      # L1 cache
         self.driver = driver or FSDriver()   # L0 cache
+        self.read_cache = ValueCache()       # Decoded L0 values, kept for the transactions of one block
+        self.encoded = {}                    # Key -> (value, encoding, metered size) of values set and not yet written
         self.hlc = HLC()
 
         self.pending_reads = {}
+        self.pending_scans = set()           # Key prefixes depended on without reading each key, since the last apply
+        self.pending_copies = {}             # Key -> (pending container, the copy of it the transaction was given)
 
         self.pending_deltas = {}
 
+        # Hard applied deltas are logged before they reach the L0 driver, and anything left in the log is replayed here
+        self.wal = WriteAheadLog(wal_path) if wal_path is not None else None
+        if self.wal is not None:
+            self.replay_wal()
+
     def get_nanos(self, timestamp):
         # Convert timestamp to HLC clock then to nanoseconds
         temp_hlc = self.hlc.from_str(timestamp)
@@ -416,41 +933,133 @@ class CacheDriver:
         return timestamp_nanoseconds
 
     def find(self, key: str):
+        return self.__find(key)[0]
+
+    def __find(self, key: str):
+        # Returns the value and its metered size when that is already known
         value = self.pending_writes.get(key)
-        if value is not None:
-            return value
+        if value is None:
+            value = self.cache.get(key)
 
-        value = self.cache.get(key)
         if value is not None:
-            return value
+            if STATS.enabled:
+                STATS.incr('pending_hits')
+            return self.pending_copy(key, value), self.__known_size(key, value)
+
+        entry = self.read_cache.lookup(key)
+        if entry is not None:
+            if STATS.enabled:
+                STATS.incr('value_cache_hits')
+            return entry
+
+        if STATS.enabled:
+            STATS.incr('value_cache_misses')
+            STATS.incr('driver_gets')
 
         value = self.driver.get(key)
-        if value is not None:
+        return value, self.read_cache.set(key, value)
+
+    def pending_copy(self, key, value):
+        # Set values are shared with the outputs of the transactions that wrote them instead of being copied there, so
+        # a transaction reading a container gets its own copy. It is made on the first read and handed out again after
+        # that, so a contract reading a container in a loop copies it once, and sees what it changed in place.
+        if not isinstance(value, (dict, list, tuple)):
             return value
 
-        return None
+        entry = self.pending_copies.get(key)
+        if entry is not None and (entry[0] is value or entry[1] is value):
+            return entry[1]
+
+        copy = deepcopy(value)
+        self.pending_copies[key] = (value, copy)
+        return copy
+
+    def new_transaction(self):
+        # Copies handed to one transaction are never handed to the next
+        self.pending_copies = {}
+
+    def __known_size(self, key, value):
+        entry = self.encoded.get(key)
+        return entry[2] if entry is not None and entry[0] is value else None
+
+    def __deduct_read(self, key, value, nbytes):
+        if value is not None and rt.tracer.is_started():
+            if nbytes is None:
+                k, v = encode_kv(key, value)
+                nbytes = len(k) + len(v)
+            rt.deduct_read_size(nbytes)
 
     def get(self, key: str, save: bool = True):
 
-        value = self.find(key)
+        value, nbytes = self.__find(key)
 
         if save:
             if self.pending_reads.get(key) is None:
                 self.pending_reads[key] = value
 
-            if value is not None:
-                rt.deduct_read(*encode_kv(key, value))
+            self.__deduct_read(key, value, nbytes)
 
         return value
 
+    def get_many(self, keys, save: bool = True):
+        values = {}
+        sizes = {}
+        missing = []
+        pending = 0
+        for key in keys:
+            value = self.pending_writes.get(key)
+            if value is None:
+                value = self.cache.get(key)
+
+            if value is not None:
+                sizes[key] = self.__known_size(key, value)
+                value = self.pending_copy(key, value)
+                pending += 1
+            else:
+                entry = self.read_cache.lookup(key)
+                if entry is None:
+                    missing.append(key)
+                else:
+                    value, sizes[key] = entry
+            values[key] = value
+
+        if STATS.enabled:
+            STATS.incr('pending_hits', pending)
+            STATS.incr('value_cache_hits', len(values) - pending - len(missing))
+            STATS.incr('value_cache_misses', len(missing))
+
+        if missing:
+            if STATS.enabled:
+                STATS.incr('driver_get_manys')
+            for key, value in self.driver.get_many(missing).items():
+                values[key] = value
+                sizes[key] = self.read_cache.set(key, value)
+
+        if save:
+            for key, value in values.items():
+                if self.pending_reads.get(key) is None:
+                    self.pending_reads[key] = value
+
+                self.__deduct_read(key, value, sizes.get(key))
+
+        return values
+
     def set(self, key, value):
-        rt.deduct_write(*encode_kv(key, value))
+        data = encode(value)
+        k, v = key.encode(), data.encode()
+        rt.deduct_write(k, v)
 
         if self.pending_reads.get(key) is None:
             self.get(key)
 
         if type(value) == decimal.Decimal or type(value) == float:
             value = ContractingDecimal(str(value))
+            self.encoded.pop(key, None)
+        elif value is None or isinstance(value, (dict, list, tuple)):
+            # Containers can be mutated after being set, so they are encoded again when written
+            self.encoded.pop(key, None)
+        else:
+            self.encoded[key] = (value, Encoded(data), len(k) + len(v))
 
         self.pending_writes[key] = value
 
@@ -474,6 +1083,8 @@ class CacheDriver:
 
         # Clear the top cache
         self.pending_reads = {}
+        self.pending_scans = set()
+        self.pending_copies = {}
         self.pending_writes.clear()
 
     def soft_apply_rewards(self, hcl: str):
@@ -489,6 +1100,8 @@ class CacheDriver:
 
         # Clear the top cache
         self.pending_reads = {}
+        self.pending_scans = set()
+        self.pending_copies = {}
         self.pending_writes.clear()
 
     def hard_apply(self, hlc):
@@ -497,28 +1110,23 @@ class CacheDriver:
             return
 
         # Run through the sorted HCLs from oldest to newest applying each one until the hcl committed is
-
-        to_delete = []
+        to_apply = []
         for _hlc, _deltas in sorted(self.pending_deltas.items()):
-            # Run through all state changes, taking the second value, which is the post delta
-            for key, delta in _deltas['writes'].items():
-                try:
-                    _block_num = self.get_nanos(_hlc)
-                    self.driver.set(key=key, value=delta[1], block_num=str(_block_num))
-                except (TypeError, ValueError):
-                    # Safe set not supported on selected driver
-                    self.driver.set(key=key, value=delta[1])
+            # Take the second value of every state change, which is the post delta
+            to_apply.append((_hlc, {key: delta[1] for key, delta in _deltas['writes'].items()}))
+            if _hlc == hlc:
+                break
 
+        self.log_writes(to_apply)
 
-                # self.cache[key] = delta[1]
+        for _hlc, writes in to_apply:
+            self.apply_writes(writes, hlc=_hlc)
 
-            # Add the key (
-            to_delete.append(_hlc)
-            if _hlc == hlc:
-                break
+        self.clear_wal()
+        self.end_block()
 
         # Remove the deltas from the set
-        [self.pending_deltas.pop(key) for key in to_delete]
+        [self.pending_deltas.pop(_hlc) for _hlc, _ in to_apply]
 
     def hard_apply_one(self, hlc: str) -> dict:
         pending_delta = self.pending_deltas.pop(hlc)
@@ -528,22 +1136,79 @@ class CacheDriver:
             return
 
         # Run through all state changes, taking the second value, which is the post delta
-        for key, delta in pending_delta['writes'].items():
-            try:
-                block_num = self.get_nanos(hlc)
-                self.driver.set(key=key, value=delta[1], block_num=block_num)
-            except (TypeError, ValueError):
-                # Safe set not supported on selected driver
-                self.driver.set(key=key, value=delta[1])
+        writes = {key: delta[1] for key, delta in pending_delta['writes'].items()}
+
+        self.log_writes([(hlc, writes)])
+        self.apply_writes(writes, hlc=hlc)
+        self.clear_wal()
+        self.end_block()
 
         return pending_delta
 
+    def end_block(self):
+        # Values read from the L0 driver are only trusted for one block, since other processes and writes made straight
+        # to the driver change it without going through this cache
+        self.read_cache.clear()
+
+    def log_writes(self, records):
+        if self.wal is not None:
+            self.wal.append(records)
+
+    def clear_wal(self):
+        # Replaying an applied record again is harmless, so the log only needs clearing once the driver has the writes
+        # on disk. Drivers without sync either have nothing to lose or sync every write themselves.
+        if self.wal is not None:
+            if hasattr(self.driver, 'sync'):
+                self.driver.sync()
+            self.wal.truncate()
+
+    def replay_wal(self):
+        for hlc, writes in self.wal.records():
+            self.apply_writes(writes, hlc=hlc)
+
+        self.clear_wal()
+
+    def encoded_writes(self, writes: dict):
+        # JSON drivers get the encoding made when each value was set instead of encoding it again
+        reuse = getattr(self.driver, 'encode', None) is encode
+
+        items = {}
+        for key, value in writes.items():
+            self.read_cache.pop(key)
+
+            entry = self.encoded.pop(key, None)
+            items[key] = entry[1] if reuse and entry is not None and entry[0] is value else value
+
+        return items
+
+    def apply_writes(self, writes: dict, hlc: str):
+        writes = self.encoded_writes(writes)
+
+        try:
+            block_num = str(self.get_nanos(hlc))
+        except (TypeError, ValueError):
+            # Not a valid HLC, so write without block protection
+            block_num = None
+
+        if hasattr(self.driver, 'set_many'):
+            self.driver.set_many(writes, block_num=block_num)
+        else:
+            # Batched writes not supported on selected driver
+            for key, value in writes.items():
+                try:
+                    self.driver.set(key=key, value=value, block_num=block_num)
+                except (TypeError, ValueError):
+                    # Safe set not supported on selected driver
+                    self.driver.set(key=key, value=value)
+
 
     def bust_cache(self, writes: dict):
         if not writes:
             return
 
         for key in writes.keys():
+            self.read_cache.pop(key)
+
             should_clear = True
             for pd in self.pending_deltas.values():
                 should_clear = key not in list(pd['writes'].keys())
@@ -555,26 +1220,39 @@ class CacheDriver:
 
     def reset_cache(self):
         self.cache = {}
+        self.read_cache.clear()
 
     # Same as hard apply but for only the most recent changes and the cache
     def commit(self):
         self.cache.update(self.pending_writes)
 
-        for k, v in self.cache.items():
-            if v is None:
-                self.driver.delete(k)
-            else:
-                self.driver.set(k, v)
+        writes = self.encoded_writes(self.cache)
+
+        if hasattr(self.driver, 'set_many'):
+            self.driver.set_many(writes)
+        else:
+            for k, v in self.cache.items():
+                if v is None:
+                    self.driver.delete(k)
+                else:
+                    self.driver.set(k, v)
 
         self.cache.clear()
         self.pending_writes.clear()
         self.pending_reads = {}
+        self.pending_scans = set()
+        self.pending_copies = {}
+        self.end_block()
 
     def rollback(self, hlc=None):
         if hlc is None:
             # Returns to disk state which should be whatever it was prior to any write sessions
             self.cache.clear()
+            self.read_cache.clear()
+            self.encoded.clear()
             self.pending_reads = {}
+            self.pending_scans = set()
+            self.pending_copies = {}
             self.pending_writes.clear()
             self.pending_deltas.clear()
         else:
@@ -583,6 +1261,8 @@ class CacheDriver:
                 # Clears the current reads/writes, and the reads/writes that get made when rolling back from the
                 # last HLC
                 self.pending_reads = {}
+                self.pending_scans = set()
+                self.pending_copies = {}
                 self.pending_writes.clear()
 
 
@@ -596,41 +1276,49 @@ class CacheDriver:
                     for key, delta in _deltas['writes'].items():
                         # self.set(key, delta[0])
                         self.cache[key] = delta[0]
+                        self.read_cache.pop(key)
+                        self.encoded.pop(key, None)
 
             # Remove the deltas from the set
             [self.pending_deltas.pop(key) for key in to_delete]
 
     def clear_pending_state(self):
         self.rollback()
+        self.end_block()
 
 
 class ContractDriver(CacheDriver):
     def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
+        # Set first, since replaying the write-ahead log applies writes
         self.delimiter = '.'
+        self.contract_index = ContractIndex()
+
+        super().__init__(*args, **kwargs)
         self.log = logging.getLogger('Driver')
 
     def items(self, prefix=''):
+        # Writes under the prefix by other transactions change the listing even when no key read here does
+        self.pending_scans.add(prefix)
+
         # Get all of the items in the cache currently
         _items = {}
         keys = set()
 
         for k, v in self.pending_writes.items():
             if k.startswith(prefix) and v is not None:
-                _items[k] = v
+                _items[k] = self.pending_copy(k, v)
                 keys.add(k)
 
         for k, v in self.cache.items():
             if k.startswith(prefix) and v is not None:
-                _items[k] = v
+                _items[k] = self.pending_copy(k, v)
                 keys.add(k)
 
         # Get all of the keys we need
         db_keys = set(self.driver.iter(prefix=prefix))
 
-        # Subtract the already gotten keys
-        for k in db_keys - keys:
-            _items[k] = self.get(k) # Cache get will add the keys to the cache
+        # Subtract the already gotten keys and fetch the rest in one batch
+        _items.update(self.get_many(sorted(db_keys - keys)))
 
         return _items
 
@@ -638,7 +1326,6 @@ class ContractDriver(CacheDriver):
         return list(self.items(prefix).keys())
 
     def values(self, prefix=''):
-        l = list(self.items(prefix).values())
         return list(self.items(prefix).values())
 
     def make_key(self, contract, variable, args=[]):
@@ -651,6 +1338,15 @@ class ContractDriver(CacheDriver):
         key = self.make_key(contract, variable, arguments)
         return self.get(key)
 
+    def set(self, key, value):
+        super().set(key, value)
+        self.forget_contracts((key,), {key: value})
+
+    def apply_writes(self, writes: dict, hlc: str):
+        # Contract keys can reach the driver without having been set here, as when syncing blocks
+        self.forget_contracts(writes, writes)
+        super().apply_writes(writes, hlc)
+
     def set_var(self, contract, variable, arguments=[], value=None, mark=True):
         key = self.make_key(contract, variable, arguments)
         self.set(key, value)
@@ -659,17 +1355,55 @@ class ContractDriver(CacheDriver):
         return self.get_var(name, CODE_KEY)
 
     def get_owner(self, name):
-        owner = self.get_var(name, OWNER_KEY)
+        owner = self.get_metadata(name, OWNER_KEY)
         if owner == '':
             owner = None
         return owner
 
     def get_time_submitted(self, name):
-        return self.get_var(name, TIME_KEY)
+        return self.get_metadata(name, TIME_KEY)
+
+    def get_developer(self, name):
+        return self.get_metadata(name, DEVELOPER_KEY)
+
+    def get_metadata(self, name, variable):
+        # Contract metadata is read once into the contract index and not metered, like is_contract, so owner checks on
+        # every call cost nothing and the same each time
+        key = self.make_key(name, variable)
+        self.pending_scans.add(key)
+
+        if not self.is_contract(name):
+            return self.get(key, save=False)
+
+        metadata = self.contract_index.get(name)
+        if variable not in metadata:
+            metadata[variable] = self.get(key, save=False)
+
+        return metadata[variable]
 
     def get_compiled(self, name):
         return self.get_var(name, COMPILED_KEY)
 
+    def code_key(self, name):
+        # The key of the contract's code in CODE_CACHE, taken from the contract index so it costs no metered read
+        if not self.is_contract(name):
+            return None
+        return name, self.contract_index.get(name)['hash']
+
+    def is_contract(self, name):
+        # Answered from the contract index after the first lookup of a name, and never metered, so it costs the same
+        # each time
+        code_key = self.make_key(name, CODE_KEY)
+
+        # A transaction submitting this contract changes the answer, so the lookup depends on the code key
+        self.pending_scans.add(code_key)
+
+        index = self.contract_index
+        if name not in index:
+            index.set(name, self.get(code_key, save=False), self.get(self.make_key(name, OWNER_KEY), save=False))
+
+        return index.get(name) is not None
+
     def set_contract(self, name, code, owner=None, overwrite=False, timestamp=Datetime._from_datetime(datetime.now()), developer=None):
         if self.get_contract(name) is None:
             code_obj = compile(code, '', 'exec')
@@ -681,19 +1415,54 @@ class ContractDriver(CacheDriver):
             self.set_var(name, TIME_KEY, value=timestamp)
             self.set_var(name, DEVELOPER_KEY, value=developer)
 
+            CODE_CACHE.invalidate(name, code_blob)
+            self.contract_index.set(name, code, owner)
+
     def delete_contract(self, name):
-        for key in self.keys(name):
+        # Only this contract's keys: a bare name prefix also matches other contracts, and FSDriver files it under __misc
+        for key in self.keys(name + self.delimiter):
             if self.cache.get(key) is not None:
                 del self.cache[key]
 
             if self.pending_writes.get(key) is not None:
                 del self.pending_writes[key]
 
+            self.read_cache.pop(key)
             self.driver.delete(key)
 
+        CODE_CACHE.invalidate(name)
+        self.contract_index.pop(name)
+
     def flush(self):
         self.driver.flush()
         self.clear_pending_state()
+        CODE_CACHE.clear()
+        self.contract_index.clear()
+
+    def rollback(self, hlc=None):
+        self.forget_contracts(self.rolled_back_keys(hlc))
+        super().rollback(hlc)
+
+    def rolled_back_keys(self, hlc=None):
+        rolled_back = [self.pending_writes] + [deltas['writes'] for _hlc, deltas in self.pending_deltas.items()
+                                              if hlc is None or _hlc >= hlc]
+        if hlc is None:
+            rolled_back.append(self.cache)
+
+        for writes in rolled_back:
+            yield from writes
+
+    def forget_contracts(self, keys, values=None):
+        # Drops the cached code and index entries of contracts whose keys changed. Cached code is kept when values has
+        # the key being set to the same compiled code.
+        for key in keys:
+            name, _, variable = key.partition(self.delimiter)
+            if variable == COMPILED_KEY:
+                blob = values.get(key) if values is not None else None
+                CODE_CACHE.invalidate(name, blob if isinstance(blob, bytes) else None)
+                self.contract_index.pop(name)
+            elif variable in METADATA_KEYS:
+                self.contract_index.pop(name)
 
     def get_contract_keys(self, name):
         return self.keys(name)
@@ -703,9 +1472,12 @@ class ContractDriver(CacheDriver):
         self.log.debug(f"Length of Pending Deltas BEFORE {len(self.driver.pending_deltas.keys())}")
         self.log.debug(f"rollback to hlc_timestamp: {hlc_timestamp}")
 
+        self.forget_contracts(self.rolled_back_keys(hlc_timestamp))
+
         if hlc_timestamp is None:
             # Returns to disk state which should be whatever it was prior to any write sessions
             self.cache.clear()
+            self.read_cache.clear()
             self.reads = set()
             self.pending_writes.clear()
             self.pending_deltas.clear()
@@ -809,18 +1581,31 @@ class BlockserviceDriver(Driver):
         if v is None:
             return None
 
-        if isinstance(v['value'], dict):
-            return decode(encode(v['value']))
+        return self.__decode_value(v['value'])
+
+    def get_many(self, keys):
+        values = {k: None for k in keys}
+        for entry in self.db.find({'rawKey': {'$in': list(values)}}):
+            values[entry['rawKey']] = self.__decode_value(entry['value'])
+        return values
+
+    def __decode_value(self, value):
+        if isinstance(value, dict):
+            return decode(encode(value))
 
-        if decode(v['value']) is None:
-           return v['value']
+        if decode(value) is None:
+           return value
 
-        return decode(v['value'])
+        return decode(value)
 
     def set(self, key, value, block_num=None):
         # Do nothing to keep readonly.
         pass
 
+    def set_many(self, items, block_num=None):
+        # Do nothing to keep readonly.
+        pass
+
     def iter(self, prefix: str, length=0):
         cur = self.db.find({'rawKey': {'$regex': f'^{prefix}'}})
 
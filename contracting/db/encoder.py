@@ -1,5 +1,6 @@
 import json
 import decimal
+import msgpack
 from contracting.stdlib.bridge.time import Datetime, Timedelta
 from contracting.stdlib.bridge.decimal import ContractingDecimal, MAX_LOWER_PRECISION, fix_precision
 from contracting.config import INDEX_SEPARATOR, DELIMITER
@@ -7,6 +8,16 @@ from contracting.config import INDEX_SEPARATOR, DELIMITER
 MONGO_MIN_INT = -(2 ** 63)
 MONGO_MAX_INT = 2 ** 63 - 1
 
+# Binary values start with a NUL byte, which JSON text never does, followed by the format version
+BINARY_MAGIC = b'\x00'
+BINARY_VERSION = 1
+BINARY_PREFIX = BINARY_MAGIC + bytes([BINARY_VERSION])
+
+EXT_FIXED = 1
+EXT_TIME = 2
+EXT_DELTA = 3
+EXT_BIG_INT = 4
+
 ##
 # ENCODER CLASS
 # Add to this to encode Python types for storage.
@@ -82,6 +93,11 @@ def encode_ints_in_dict(data: dict):
 
     return d
 
+class Encoded(str):
+    # Output of encode() handed back to a driver, which stores it as is instead of encoding it again
+    pass
+
+
 # JSON library from Python 3 doesn't let you instantiate your custom Encoder. You have to pass it as an obj to json
 def encode(data: str):
     """ NOTE:
@@ -91,7 +107,9 @@ def encode(data: str):
     
     Due to MongoDB integer limitation (8 bytes), we need to preprocess 'big' integers.
     """
-    if isinstance(data, int):
+    if isinstance(data, Encoded):
+        return data
+    elif isinstance(data, int):
         data = encode_int(data)
     elif isinstance(data, dict):
         data = encode_ints_in_dict(data)
@@ -119,6 +137,8 @@ def decode(data):
         return None
 
     if isinstance(data, bytes):
+        if data[:1] == BINARY_MAGIC:
+            return decode_binary(data)
         data = data.decode()
 
     try:
@@ -127,6 +147,89 @@ def decode(data):
         return None
 
 
+##
+# BINARY CODEC
+# msgpack with extension types for the values the JSON encoder wraps in tagged dicts. It decodes to exactly what a JSON
+# round trip would give, including stringified dict keys and tagged dicts turning into objects, so contract behaviour
+# does not depend on the codec a node stores state with.
+##
+
+def pack_default(o):
+    if isinstance(o, Datetime) or o.__class__.__name__ == Datetime.__name__:
+        return msgpack.ExtType(EXT_TIME, msgpack.packb(
+            [o.year, o.month, o.day, o.hour, o.minute, o.second, o.microsecond]
+        ))
+    elif isinstance(o, Timedelta) or o.__class__.__name__ == Timedelta.__name__:
+        return msgpack.ExtType(EXT_DELTA, msgpack.packb([o._timedelta.days, o._timedelta.seconds]))
+    elif isinstance(o, decimal.Decimal) or o.__class__.__name__ == decimal.Decimal.__name__:
+        return msgpack.ExtType(EXT_FIXED, str(fix_precision(o)).encode())
+    elif isinstance(o, ContractingDecimal) or o.__class__.__name__ == ContractingDecimal.__name__:
+        return msgpack.ExtType(EXT_FIXED, str(fix_precision(o._d)).encode())
+    elif isinstance(o, int):
+        return msgpack.ExtType(EXT_BIG_INT, str(o).encode())
+    raise TypeError(f'Object of type {o.__class__.__name__} is not serializable')
+
+
+def tag_big_ints(data):
+    # msgpack only packs 64 bit ints natively and raises rather than calling the default hook for larger ones
+    if isinstance(data, bool):
+        return data
+    if isinstance(data, int):
+        return data if MONGO_MIN_INT < data < MONGO_MAX_INT else msgpack.ExtType(EXT_BIG_INT, str(data).encode())
+    if isinstance(data, dict):
+        return {k: tag_big_ints(v) for k, v in data.items()}
+    if isinstance(data, (list, tuple)):
+        return [tag_big_ints(v) for v in data]
+    return data
+
+
+def unpack_ext(code, data):
+    if code == EXT_FIXED:
+        return ContractingDecimal(data.decode())
+    elif code == EXT_TIME:
+        return Datetime(*msgpack.unpackb(data))
+    elif code == EXT_DELTA:
+        days, seconds = msgpack.unpackb(data)
+        return Timedelta(days=days, seconds=seconds)
+    elif code == EXT_BIG_INT:
+        return int(data.decode())
+    return msgpack.ExtType(code, data)
+
+
+def json_key(k):
+    if isinstance(k, str):
+        return k
+    return json.dumps(k)
+
+
+def unpack_map(pairs):
+    return as_object({json_key(k): v for k, v in pairs})
+
+
+def encode_binary(data):
+    try:
+        packed = msgpack.packb(data, default=pack_default)
+    except OverflowError:
+        packed = msgpack.packb(tag_big_ints(data), default=pack_default)
+
+    return BINARY_PREFIX + packed
+
+
+def decode_binary(data: bytes):
+    version = data[1]
+    if version != BINARY_VERSION:
+        raise ValueError(f'Unsupported binary encoding version {version}')
+
+    return msgpack.unpackb(memoryview(data)[2:], ext_hook=unpack_ext, object_pairs_hook=unpack_map,
+                           strict_map_key=False, raw=False)
+
+
+ENCODERS = {
+    'json': encode,
+    'binary': encode_binary
+}
+
+
 def make_key(contract, variable, args=[]):
     contract_variable = INDEX_SEPARATOR.join((contract, variable))
     if args:
@@ -1,8 +1,13 @@
 #define PY_SSIZE_T_CLEAN
 #include <Python.h>
 #include <hdf5.h>
+#include <errno.h>
+#include <fcntl.h>
+#include <stdint.h>
 #include <string.h>
+#include <sys/file.h>
 #include <sys/stat.h>
+#include <time.h>
 #include <unistd.h>
 
 // HDF5 Reference Manual: https://support.hdfgroup.org/HDF5/doc/RM/RM_H5Front.html
@@ -10,27 +15,265 @@
 #define ATTR_LEN_MAX 64000 // http://davis.lbl.gov/Manuals/HDF5-1.8.7/UG/13_Attributes.html#SpecIssues
 #define ATTR_VALUE "value"
 #define ATTR_BLOCK "block"
+#define BLOCK_LEN_MAX 32
+#define GROUP_LEN_MAX 4096
 #define LOCK_SUFFIX "-lock"
+#define LOCK_BACKOFF_MIN_NS 50000L
+#define LOCK_BACKOFF_MAX_NS 10000000L
 
-static char dirname_buf[PATH_MAX + 1];
+// Every data file has a companion "<file>-lock" file. Readers take a shared flock on it and writers an exclusive one,
+// so concurrent readers in different processes do not serialize. The kernel drops flocks when a process dies, so a
+// crashed holder never leaves a stale lock behind. The lock file also stores a generation counter that writers bump,
+// which lets open handles notice that another process has changed the file since they last read it.
 
+static long lock_timeout_ms = 10000;
+
+static int
+lock_open(const char *filepath)
+{
+    char lockpath[PATH_MAX + sizeof(LOCK_SUFFIX)];
+    snprintf(lockpath, sizeof(lockpath), "%s%s", filepath, LOCK_SUFFIX);
+
+    int fd = open(lockpath, O_RDWR | O_CREAT | O_CLOEXEC, S_IRUSR | S_IWUSR);
+    if(fd < 0 && errno == EISDIR)
+    {
+        // Left behind by the old mkdir based lock. Nothing can hold it any more, so remove it and retry.
+        rmdir(lockpath);
+        fd = open(lockpath, O_RDWR | O_CREAT | O_CLOEXEC, S_IRUSR | S_IWUSR);
+    }
+
+    if(fd < 0)
+        PyErr_SetFromErrnoWithFilename(PyExc_OSError, lockpath);
+
+    return fd;
+}
+
+static int
+lock_acquire(int fd, int exclusive, const char *filepath)
+{
+    int op = (exclusive ? LOCK_EX : LOCK_SH) | LOCK_NB;
+    if(flock(fd, op) == 0)
+        return 0;
+
+    // Back off exponentially while someone else holds the lock, without keeping the GIL
+    struct timespec now, deadline, pause = {0, LOCK_BACKOFF_MIN_NS};
+    clock_gettime(CLOCK_MONOTONIC, &deadline);
+    deadline.tv_sec += lock_timeout_ms / 1000;
+    deadline.tv_nsec += (lock_timeout_ms % 1000) * 1000000L;
+
+    int acquired = 0, failed = 0;
+    Py_BEGIN_ALLOW_THREADS
+    while(1)
+    {
+        if(flock(fd, op) == 0)
+        {
+            acquired = 1;
+            break;
+        }
+        if(errno != EWOULDBLOCK && errno != EINTR)
+        {
+            failed = errno;
+            break;
+        }
+
+        clock_gettime(CLOCK_MONOTONIC, &now);
+        if(now.tv_sec + now.tv_nsec / 1e9 >= deadline.tv_sec + deadline.tv_nsec / 1e9)
+            break;
+
+        nanosleep(&pause, NULL);
+        pause.tv_nsec = pause.tv_nsec * 2 > LOCK_BACKOFF_MAX_NS ? LOCK_BACKOFF_MAX_NS : pause.tv_nsec * 2;
+    }
+    Py_END_ALLOW_THREADS
+
+    if(acquired)
+        return 0;
+
+    if(failed)
+    {
+        errno = failed;
+        PyErr_SetFromErrnoWithFilename(PyExc_OSError, filepath);
+    }
+    else
+        PyErr_Format(PyExc_TimeoutError, "timed out waiting for lock on \"%s\"", filepath);
+
+    return -1;
+}
+
+static uint64_t
+lock_generation(int fd)
+{
+    uint64_t gen = 0;
+    if(pread(fd, &gen, sizeof(gen), 0) != sizeof(gen))
+        return 0;
+    return gen;
+}
+
+static uint64_t
+lock_bump_generation(int fd)
+{
+    uint64_t gen = lock_generation(fd) + 1;
+    if(pwrite(fd, &gen, sizeof(gen), 0) != sizeof(gen))
+        return 0;
+    return gen;
+}
+
+static hid_t
+file_access_plist(void)
+{
+    hid_t fapl = H5Pcreate(H5P_FILE_ACCESS);
+#if (H5_VERS_MAJOR == 1 && H5_VERS_MINOR == 10 && H5_VERS_RELEASE >= 7) || \
+    (H5_VERS_MAJOR == 1 && H5_VERS_MINOR >= 12) || H5_VERS_MAJOR > 1
+    // Access is serialized with the lock file, so the library's own lock (held for as long as a handle is open) would
+    // only keep other processes out of files sitting in a handle pool.
+    H5Pset_file_locking(fapl, 0, 1);
+#endif
+    return fapl;
+}
+
+static hid_t
+file_open(char *filepath, unsigned flags, int create)
+{
+    hid_t fapl = file_access_plist();
+    hid_t fid = H5Fopen(filepath, flags, fapl);
+    if(fid < 0 && create)
+        fid = H5Fcreate(filepath, H5F_ACC_EXCL, H5P_DEFAULT, fapl);
+    H5Pclose(fapl);
+    return fid;
+}
+
+// Handles returned by open() index into this table. Each slot keeps its HDF5 file open read-only, with the generation
+// it last saw, and is transparently reopened when another process has written the file since. flock locks belong to
+// the open file description, so a descriptor shared by every thread would let one thread's unlock drop a lock another
+// thread still holds. Each use of a slot opens the lock file for itself instead. Closing a read-write handle writes
+// its view of the file's metadata back, so a handle that outlives other processes' writes must never be one. Writers
+// open the file read-write under the exclusive lock and close it again before letting anyone else in.
+typedef struct {
+    hid_t fid;
+    uint64_t gen;
+    char path[PATH_MAX + 1];
+} handle_slot;
+
+static handle_slot **slots = NULL;
+static Py_ssize_t slots_len = 0;
+
+// HDF5 will not open a file read-write while this process has it open read-only, so pooled handles on the file are
+// closed first and reopened by their next read
 static void
-lock_acquire(char *filepath)
+slots_close_path(const char *path)
 {
-    strcat(dirname_buf, filepath);
-    strcat(dirname_buf, LOCK_SUFFIX);
-    while(mkdir(dirname_buf, S_IRWXU) != 0)
-        ;
-    memset(dirname_buf, 0, sizeof(dirname_buf));
+    for(Py_ssize_t i = 0; i < slots_len; i++)
+    {
+        if(slots[i] != NULL && slots[i]->fid >= 0 && strcmp(slots[i]->path, path) == 0)
+        {
+            H5Fclose(slots[i]->fid);
+            slots[i]->fid = -1;
+        }
+    }
+}
+
+static hid_t
+file_open_writable(char *filepath, int create)
+{
+    slots_close_path(filepath);
+    return file_open(filepath, H5F_ACC_RDWR, create);
+}
+
+static handle_slot *
+slot_get(PyObject *handle)
+{
+    Py_ssize_t i = PyLong_AsSsize_t(handle);
+    if(i == -1 && PyErr_Occurred())
+        return NULL;
+
+    if(i < 0 || i >= slots_len || slots[i] == NULL)
+    {
+        PyErr_SetString(PyExc_ValueError, "invalid file handle");
+        return NULL;
+    }
+
+    return slots[i];
+}
+
+// A file reference is either a path (opened and closed around a single call) or a handle returned by open(), which
+// stays open across calls so hot files are not reopened for every key.
+typedef struct {
+    hid_t fid;
+    int lockfd;
+    int exclusive;
+    handle_slot *slot;
+    char path[PATH_MAX + 1];
+} file_ref;
+
+static int
+file_ref_acquire(PyObject *target, int exclusive, int create, file_ref *ref)
+{
+    ref->exclusive = exclusive;
+
+    if(PyLong_Check(target))
+    {
+        if((ref->slot = slot_get(target)) == NULL)
+            return -1;
+
+        strcpy(ref->path, ref->slot->path);
+        if((ref->lockfd = lock_open(ref->path)) < 0)
+            return -1;
+
+        if(lock_acquire(ref->lockfd, exclusive, ref->path) < 0)
+        {
+            close(ref->lockfd);
+            return -1;
+        }
+
+        if(exclusive)
+        {
+            ref->fid = file_open_writable(ref->path, create);
+            return 0;
+        }
+
+        uint64_t gen = lock_generation(ref->lockfd);
+        if(gen != ref->slot->gen || ref->slot->fid < 0)
+        {
+            if(ref->slot->fid >= 0)
+                H5Fclose(ref->slot->fid);
+            ref->slot->fid = file_open(ref->path, H5F_ACC_RDONLY, 0);
+            ref->slot->gen = gen;
+        }
+
+        ref->fid = ref->slot->fid;
+        return 0;
+    }
+
+    const char *filepath = PyUnicode_AsUTF8(target);
+    if(filepath == NULL)
+        return -1;
+
+    strncpy(ref->path, filepath, PATH_MAX);
+    ref->path[PATH_MAX] = 0;
+    ref->slot = NULL;
+
+    if((ref->lockfd = lock_open(ref->path)) < 0)
+        return -1;
+
+    if(lock_acquire(ref->lockfd, exclusive, ref->path) < 0)
+    {
+        close(ref->lockfd);
+        return -1;
+    }
+
+    ref->fid = exclusive ? file_open_writable(ref->path, create) : file_open(ref->path, H5F_ACC_RDONLY, create);
+    return 0;
 }
 
 static void
-lock_release(char *filepath)
+file_ref_release(file_ref *ref)
 {
-    strcat(dirname_buf, filepath);
-    strcat(dirname_buf, LOCK_SUFFIX);
-    rmdir(dirname_buf);
-    memset(dirname_buf, 0, sizeof(dirname_buf));
+    // A file opened for this call, which is every read-write one, is closed and so written out before other processes
+    // are let in. Closing the lock file descriptor releases the lock.
+    if((ref->slot == NULL || ref->exclusive) && ref->fid >= 0)
+        H5Fclose(ref->fid);
+    if(ref->exclusive)
+        lock_bump_generation(ref->lockfd);
+    close(ref->lockfd);
 }
 
 static void
@@ -41,37 +284,69 @@ write_attr(hid_t gid, char *name, char *value)
     {
         hid_t atype = H5Tcopy(H5T_C_S1);
         H5Tset_size(atype, strlen(value));
-        hid_t aid = H5Acreate(gid, name, atype, H5Screate(H5S_SCALAR), H5P_DEFAULT, H5P_DEFAULT);
+        hid_t sid = H5Screate(H5S_SCALAR);
+        hid_t aid = H5Acreate(gid, name, atype, sid, H5P_DEFAULT, H5P_DEFAULT);
         H5Awrite(aid, atype, value);
         H5Aclose(aid);
+        H5Sclose(sid);
         H5Tclose(atype);
     }
 }
 
-static PyObject *
-set(PyObject *self, PyObject *args)
-{
-#ifndef DEBUG
-    H5Eset_auto2(H5P_DEFAULT, NULL, NULL);
-#endif
+// Values are either text, stored as a string attribute as before, or bytes, stored as an opaque attribute so binary
+// encodings with embedded NULs survive. Readers tell the two apart by the attribute's type class.
+typedef struct {
+    char *data;
+    Py_ssize_t len;
+    int binary;
+} attr_value;
 
-    char *filepath, *group, *value, *blocknum;
-    if(!PyArg_ParseTuple(args, "sszz", &filepath, &group, &value, &blocknum))
-        return NULL;
+static int
+parse_value(PyObject *obj, attr_value *value)
+{
+    value->binary = 0;
+    if(obj == Py_None)
+    {
+        value->data = NULL;
+        return 0;
+    }
+    if(PyBytes_Check(obj))
+    {
+        value->binary = 1;
+        return PyBytes_AsStringAndSize(obj, &value->data, &value->len);
+    }
+    if(PyUnicode_Check(obj))
+    {
+        value->data = (char *) PyUnicode_AsUTF8AndSize(obj, &value->len);
+        return value->data == NULL ? -1 : 0;
+    }
 
-    lock_acquire(filepath);
+    PyErr_SetString(PyExc_TypeError, "value must be str, bytes or None");
+    return -1;
+}
 
-    hid_t fid = H5Fopen(filepath, H5F_ACC_RDWR, H5P_DEFAULT);
-    if(fid < 0)
+static void
+write_value(hid_t gid, attr_value *value)
+{
+    if(!value->binary || value->len == 0)
     {
-        fid = H5Fcreate(filepath, H5F_ACC_EXCL, H5P_DEFAULT, H5P_DEFAULT);
-        if(fid < 0)
-        {
-            lock_release(filepath);
-            return PyErr_Format(PyExc_OSError, "failed to open/create file \"%s\"", filepath);
-        }
+        write_attr(gid, ATTR_VALUE, value->data);
+        return;
     }
 
+    H5Adelete(gid, ATTR_VALUE);
+    hid_t atype = H5Tcreate(H5T_OPAQUE, value->len);
+    hid_t sid = H5Screate(H5S_SCALAR);
+    hid_t aid = H5Acreate(gid, ATTR_VALUE, atype, sid, H5P_DEFAULT, H5P_DEFAULT);
+    H5Awrite(aid, atype, value->data);
+    H5Aclose(aid);
+    H5Sclose(sid);
+    H5Tclose(atype);
+}
+
+static void
+write_group(hid_t fid, char *group, attr_value *value, char *blocknum)
+{
     hid_t gid = H5Gopen(fid, group, H5P_DEFAULT);
     if(gid < 0)
     {
@@ -81,56 +356,178 @@ set(PyObject *self, PyObject *args)
         H5Pclose(lcpl);
     }
 
-    write_attr(gid, ATTR_VALUE, value);
+    write_value(gid, value);
     write_attr(gid, ATTR_BLOCK, blocknum);
 
     H5Gclose(gid);
-    H5Fclose(fid);
+}
+
+static int
+read_attr(hid_t fid, char *group, char *name, char *buf, size_t size)
+{
+    hid_t aid = H5Aopen_by_name(fid, group, name, H5P_DEFAULT, H5P_DEFAULT);
+    if(aid < 0)
+        return -1;
 
-    lock_release(filepath);
+    hid_t atype = H5Tcopy(H5T_C_S1);
+    H5Tset_size(atype, size);
+    memset(buf, 0, size);
+    herr_t status = H5Aread(aid, atype, buf);
+
+    H5Tclose(atype);
+    H5Aclose(aid);
+
+    return status < 0 ? -1 : 0;
+}
+
+// Returns a new reference to the value as str or bytes, None when there is none, or NULL with an exception set
+static PyObject *
+read_value(hid_t fid, const char *group, char *buf, size_t size)
+{
+    hid_t aid = H5Aopen_by_name(fid, group, ATTR_VALUE, H5P_DEFAULT, H5P_DEFAULT);
+    if(aid < 0)
+        Py_RETURN_NONE;
+
+    hid_t ftype = H5Aget_type(aid);
+    PyObject *value;
+    if(H5Tget_class(ftype) == H5T_OPAQUE)
+    {
+        value = PyBytes_FromStringAndSize(NULL, H5Tget_size(ftype));
+        if(value != NULL && H5Aread(aid, ftype, PyBytes_AS_STRING(value)) < 0)
+        {
+            Py_DECREF(value);
+            Py_INCREF(Py_None);
+            value = Py_None;
+        }
+    }
+    else
+    {
+        hid_t atype = H5Tcopy(H5T_C_S1);
+        H5Tset_size(atype, size);
+        memset(buf, 0, size);
+        if(H5Aread(aid, atype, buf) < 0)
+        {
+            Py_INCREF(Py_None);
+            value = Py_None;
+        }
+        else
+            value = PyUnicode_FromString(buf);
+        H5Tclose(atype);
+    }
+
+    H5Tclose(ftype);
+    H5Aclose(aid);
+
+    return value;
+}
+
+static PyObject *
+set(PyObject *self, PyObject *args)
+{
+#ifndef DEBUG
+    H5Eset_auto2(H5P_DEFAULT, NULL, NULL);
+#endif
+
+    PyObject *target, *obj;
+    char *group, *blocknum;
+    attr_value value;
+    if(!PyArg_ParseTuple(args, "OsOz", &target, &group, &obj, &blocknum) || parse_value(obj, &value) < 0)
+        return NULL;
+
+    file_ref ref;
+    if(file_ref_acquire(target, 1, 1, &ref) < 0)
+        return NULL;
+
+    if(ref.fid < 0)
+    {
+        file_ref_release(&ref);
+        return PyErr_Format(PyExc_OSError, "failed to open/create file \"%s\"", ref.path);
+    }
+
+    write_group(ref.fid, group, &value, blocknum);
+
+    file_ref_release(&ref);
 
     Py_RETURN_NONE;
 }
 
 static PyObject *
-get_attr(char *filepath, char *group, char *name)
+set_many(PyObject *self, PyObject *args)
 {
-    static char buf[ATTR_LEN_MAX + 1];
+#ifndef DEBUG
+    H5Eset_auto2(H5P_DEFAULT, NULL, NULL);
+#endif
+
+    static char buf[BLOCK_LEN_MAX + 1];
+
+    PyObject *target, *items;
+    char *blocknum;
+    if(!PyArg_ParseTuple(args, "OOz", &target, &items, &blocknum))
+        return NULL;
 
-    lock_acquire(filepath);
+    PyObject *seq = PySequence_Fast(items, "items must be a sequence of (group, value) tuples");
+    if(seq == NULL)
+        return NULL;
 
-    hid_t fid = H5Fopen(filepath, H5F_ACC_RDONLY, H5P_DEFAULT);
-    if(fid < 0)
+    file_ref ref;
+    if(file_ref_acquire(target, 1, 1, &ref) < 0)
     {
-        lock_release(filepath);
-        Py_RETURN_NONE;
+        Py_DECREF(seq);
+        return NULL;
     }
 
-    hid_t aid = H5Aopen_by_name(fid, group, name, H5P_DEFAULT, H5P_DEFAULT);
-    if(aid < 0)
+    if(ref.fid < 0)
     {
-        H5Fclose(fid);
-        lock_release(filepath);
-        Py_RETURN_NONE;
+        file_ref_release(&ref);
+        Py_DECREF(seq);
+        return PyErr_Format(PyExc_OSError, "failed to open/create file \"%s\"", ref.path);
     }
 
-    hid_t atype = H5Tcopy(H5T_C_S1);
-    H5Tset_size(atype, sizeof(buf));
-    memset(buf, 0, sizeof(buf));
-    if(H5Aread(aid, atype, buf) < 0)
+    long long new_block = blocknum ? strtoll(blocknum, NULL, 10) : 0;
+
+    Py_ssize_t n = PySequence_Fast_GET_SIZE(seq);
+    for(Py_ssize_t i = 0; i < n; i++)
     {
-        H5Tclose(atype);
-        H5Aclose(aid);
-        H5Fclose(fid);
-        lock_release(filepath);
-        Py_RETURN_NONE;
+        PyObject *obj;
+        char *group;
+        attr_value value;
+        if(!PyArg_ParseTuple(PySequence_Fast_GET_ITEM(seq, i), "sO", &group, &obj) || parse_value(obj, &value) < 0)
+        {
+            file_ref_release(&ref);
+            Py_DECREF(seq);
+            return NULL;
+        }
+
+        // Same rule as a single safe set: never overwrite state written at a later block
+        if(blocknum && read_attr(ref.fid, group, ATTR_BLOCK, buf, sizeof(buf)) == 0 &&
+           strtoll(buf, NULL, 10) > new_block)
+            continue;
+
+        write_group(ref.fid, group, &value, blocknum);
     }
 
-    H5Tclose(atype);
-    H5Aclose(aid);
-    H5Fclose(fid);
+    file_ref_release(&ref);
+    Py_DECREF(seq);
+
+    Py_RETURN_NONE;
+}
+
+static PyObject *
+get_attr(PyObject *target, char *group, char *name)
+{
+    static char buf[ATTR_LEN_MAX + 1];
 
-    lock_release(filepath);
+    file_ref ref;
+    if(file_ref_acquire(target, 0, 0, &ref) < 0)
+        return NULL;
+
+    if(ref.fid < 0 || read_attr(ref.fid, group, name, buf, sizeof(buf)) < 0)
+    {
+        file_ref_release(&ref);
+        Py_RETURN_NONE;
+    }
+
+    file_ref_release(&ref);
 
     return PyUnicode_FromString(buf);
 }
@@ -142,11 +539,28 @@ get_value(PyObject *self, PyObject *args)
     H5Eset_auto2(H5P_DEFAULT, NULL, NULL);
 #endif
 
-    char *filepath, *group;
-    if(!PyArg_ParseTuple(args, "ss", &filepath, &group))
+    static char buf[ATTR_LEN_MAX + 1];
+
+    PyObject *target;
+    char *group;
+    if(!PyArg_ParseTuple(args, "Os", &target, &group))
+        return NULL;
+
+    file_ref ref;
+    if(file_ref_acquire(target, 0, 0, &ref) < 0)
         return NULL;
 
-    return get_attr(filepath, group, ATTR_VALUE);
+    if(ref.fid < 0)
+    {
+        file_ref_release(&ref);
+        Py_RETURN_NONE;
+    }
+
+    PyObject *value = read_value(ref.fid, group, buf, sizeof(buf));
+
+    file_ref_release(&ref);
+
+    return value;
 }
 
 static PyObject *
@@ -156,11 +570,79 @@ get_block(PyObject *self, PyObject *args)
     H5Eset_auto2(H5P_DEFAULT, NULL, NULL);
 #endif
 
-    char *filepath, *group;
-    if(!PyArg_ParseTuple(args, "ss", &filepath, &group))
+    PyObject *target;
+    char *group;
+    if(!PyArg_ParseTuple(args, "Os", &target, &group))
         return NULL;
 
-    return get_attr(filepath, group, ATTR_BLOCK);
+    return get_attr(target, group, ATTR_BLOCK);
+}
+
+static PyObject *
+get_many(PyObject *self, PyObject *args)
+{
+#ifndef DEBUG
+    H5Eset_auto2(H5P_DEFAULT, NULL, NULL);
+#endif
+
+    static char buf[ATTR_LEN_MAX + 1];
+
+    PyObject *target, *groups;
+    if(!PyArg_ParseTuple(args, "OO", &target, &groups))
+        return NULL;
+
+    PyObject *seq = PySequence_Fast(groups, "groups must be a sequence of strings");
+    if(seq == NULL)
+        return NULL;
+
+    Py_ssize_t n = PySequence_Fast_GET_SIZE(seq);
+    PyObject *values = PyList_New(n);
+    if(values == NULL)
+    {
+        Py_DECREF(seq);
+        return NULL;
+    }
+
+    file_ref ref;
+    if(file_ref_acquire(target, 0, 0, &ref) < 0)
+    {
+        Py_DECREF(values);
+        Py_DECREF(seq);
+        return NULL;
+    }
+
+    for(Py_ssize_t i = 0; i < n; i++)
+    {
+        const char *group = PyUnicode_AsUTF8(PySequence_Fast_GET_ITEM(seq, i));
+        if(group == NULL)
+        {
+            file_ref_release(&ref);
+            Py_DECREF(values);
+            Py_DECREF(seq);
+            return NULL;
+        }
+
+        PyObject *value;
+        if(ref.fid < 0)
+        {
+            Py_INCREF(Py_None);
+            value = Py_None;
+        }
+        else if((value = read_value(ref.fid, group, buf, sizeof(buf))) == NULL)
+        {
+            file_ref_release(&ref);
+            Py_DECREF(values);
+            Py_DECREF(seq);
+            return NULL;
+        }
+
+        PyList_SET_ITEM(values, i, value);
+    }
+
+    file_ref_release(&ref);
+    Py_DECREF(seq);
+
+    return values;
 }
 
 static PyObject *
@@ -170,31 +652,177 @@ delete(PyObject *self, PyObject *args)
     H5Eset_auto2(H5P_DEFAULT, NULL, NULL);
 #endif
 
-    char *filepath, *group;
-    if(!PyArg_ParseTuple(args, "ss", &filepath, &group))
+    PyObject *target;
+    char *group;
+    if(!PyArg_ParseTuple(args, "Os", &target, &group))
         return NULL;
 
-    lock_acquire(filepath);
+    file_ref ref;
+    if(file_ref_acquire(target, 1, 0, &ref) < 0)
+        return NULL;
 
-    hid_t fid = H5Fopen(filepath, H5F_ACC_RDWR, H5P_DEFAULT);
-    hid_t gid = H5Gopen(fid, group, H5P_DEFAULT);
+    hid_t gid = H5Gopen(ref.fid, group, H5P_DEFAULT);
     H5Adelete(gid, ATTR_VALUE);
     H5Adelete(gid, ATTR_BLOCK);
 
     H5Gclose(gid);
-    H5Fclose(fid);
 
-    lock_release(filepath);
+    file_ref_release(&ref);
 
     Py_RETURN_NONE;
 }
 
+// Group names are handed back in the order Python sorts the keys they map to, where "/" becomes ":" again, so the
+// separator has to compare as ":" here.
+static int
+key_cmp(const char *a, const char *b)
+{
+    for(; *a && *a == *b; a++, b++)
+        ;
+    unsigned char ca = *a == '/' ? ':' : (unsigned char) *a;
+    unsigned char cb = *b == '/' ? ':' : (unsigned char) *b;
+    return ca - cb;
+}
+
+static int
+key_qsort_cmp(const void *a, const void *b)
+{
+    return key_cmp(*(char * const *) a, *(char * const *) b);
+}
+
+#if (H5_VERS_MAJOR == 1 && H5_VERS_MINOR >= 12) || H5_VERS_MAJOR > 1
+typedef H5L_info2_t link_info;
+#else
+typedef H5L_info_t link_info;
+#endif
+
+// A prefix scan walks the group tree in name order starting at the group the prefix points into, so its cost follows
+// the size of the matching subtree rather than the file. With a length limit, once that many keys are held the
+// largest of them becomes a bound: siblings come in name order and every key below a sibling sorts after the sibling
+// itself, so the walk stops at the first sibling past the bound.
+typedef struct {
+    char **keys;
+    size_t len;
+    size_t cap;
+    size_t length;
+    const char *bound;
+    const char *partial;
+    char path[GROUP_LEN_MAX + 1];
+    size_t path_len;
+    int nomem;
+} group_scan;
+
+static void
+scan_trim(group_scan *scan)
+{
+    qsort(scan->keys, scan->len, sizeof(char *), key_qsort_cmp);
+    for(size_t i = scan->length; i < scan->len; i++)
+        PyMem_Free(scan->keys[i]);
+    scan->len = scan->length;
+    scan->bound = scan->keys[scan->len - 1];
+}
+
+static int
+scan_add(group_scan *scan)
+{
+    if(scan->len == scan->cap)
+    {
+        size_t cap = scan->cap ? scan->cap * 2 : 64;
+        char **grown = PyMem_Realloc(scan->keys, cap * sizeof(char *));
+        if(grown == NULL)
+            return -1;
+        scan->keys = grown;
+        scan->cap = cap;
+    }
+
+    char *key = PyMem_Malloc(scan->path_len + 1);
+    if(key == NULL)
+        return -1;
+    memcpy(key, scan->path, scan->path_len + 1);
+    scan->keys[scan->len++] = key;
+
+    // Trimming at twice the limit keeps the sorting amortized; a stale bound is still an upper bound
+    if(scan->length && (scan->len >= 2 * scan->length || (scan->bound == NULL && scan->len == scan->length)))
+        scan_trim(scan);
+
+    return 0;
+}
+
+static void
+scan_free(group_scan *scan)
+{
+    for(size_t i = 0; i < scan->len; i++)
+        PyMem_Free(scan->keys[i]);
+    PyMem_Free(scan->keys);
+}
+
+static herr_t
+scan_link(hid_t gid, const char *name, const link_info *info, void *op_data);
+
+static herr_t
+scan_group(hid_t gid, group_scan *scan)
+{
+    hsize_t idx = 0;
+    return H5Literate(gid, H5_INDEX_NAME, H5_ITER_INC, &idx, scan_link, scan);
+}
+
 static herr_t
-store_group_name(hid_t id, const char *name, const H5O_info_t *object_info, void *op_data)
+scan_link(hid_t gid, const char *name, const link_info *info, void *op_data)
 {
-    if(strcmp(name, ".") == 0 || object_info->num_attrs == 0)
+    group_scan *scan = op_data;
+
+    if(scan->partial[0])
+    {
+        int cmp = strncmp(name, scan->partial, strlen(scan->partial));
+        if(cmp < 0)
+            return 0;
+        if(cmp > 0)
+            return 1;
+    }
+
+    size_t base = scan->path_len;
+    size_t name_len = strlen(name);
+    if(base + name_len + 2 > sizeof(scan->path))
         return 0;
-    return PyList_Append((PyObject *) op_data, PyUnicode_FromString(name));
+
+    memcpy(scan->path + base, name, name_len + 1);
+    scan->path_len = base + name_len;
+
+    herr_t status = 0;
+    if(scan->bound != NULL && key_cmp(scan->path, scan->bound) > 0)
+    {
+        status = 1;
+        goto done;
+    }
+
+    hid_t child = H5Gopen(gid, name, H5P_DEFAULT);
+    if(child < 0)
+        goto done;
+
+    // Deleted keys keep their group but lose both attributes
+    if((H5Aexists(child, ATTR_VALUE) > 0 || H5Aexists(child, ATTR_BLOCK) > 0) && scan_add(scan) < 0)
+    {
+        scan->nomem = 1;
+        H5Gclose(child);
+        status = -1;
+        goto done;
+    }
+
+    scan->path[scan->path_len++] = '/';
+    scan->path[scan->path_len] = '\0';
+
+    const char *partial = scan->partial;
+    scan->partial = "";
+    if(scan_group(child, scan) < 0)
+        status = -1;
+    scan->partial = partial;
+
+    H5Gclose(child);
+
+done:
+    scan->path_len = base;
+    scan->path[base] = '\0';
+    return status;
 }
 
 static PyObject *
@@ -204,44 +832,222 @@ get_groups(PyObject *self, PyObject *args)
     H5Eset_auto2(H5P_DEFAULT, NULL, NULL);
 #endif
 
-    char *filepath;
-    if(!PyArg_ParseTuple(args, "s", &filepath))
+    PyObject *target;
+    const char *prefix = "";
+    Py_ssize_t length = 0;
+    if(!PyArg_ParseTuple(args, "O|sn", &target, &prefix, &length))
         return NULL;
 
-    lock_acquire(filepath);
+    size_t prefix_len = strlen(prefix);
+    if(prefix_len > GROUP_LEN_MAX)
+        return PyList_New(0);
 
-    hid_t fid = H5Fopen(filepath, H5F_ACC_RDONLY, H5P_DEFAULT);
-    if(fid < 0)
+    group_scan scan = {.length = length > 0 ? length : 0};
+
+    // The prefix names a group to start from and a partial name that its children have to start with
+    const char *slash = strrchr(prefix, '/');
+    size_t parent_len = slash ? (size_t) (slash - prefix) + 1 : 0;
+    memcpy(scan.path, prefix, parent_len);
+    scan.path[parent_len] = '\0';
+    scan.path_len = parent_len;
+    scan.partial = prefix + parent_len;
+
+    file_ref ref;
+    if(file_ref_acquire(target, 0, 0, &ref) < 0)
+        return NULL;
+
+    if(ref.fid < 0)
     {
-        lock_release(filepath);
+        file_ref_release(&ref);
         Py_RETURN_NONE;
     }
 
-    PyObject *group_names = PyList_New(0);
-#if (H5_VERS_MAJOR == 1 && H5_VERS_MINOR >= 12) || H5_VERS_MAJOR > 1
-    if(H5Ovisit(fid, H5_INDEX_NAME, H5_ITER_NATIVE, store_group_name, group_names, H5O_INFO_ALL) < 0)
-#else
-    if(H5Ovisit(fid, H5_INDEX_NAME, H5_ITER_NATIVE, store_group_name, group_names) < 0)
-#endif
+    hid_t gid = H5Gopen(ref.fid, parent_len ? scan.path : "/", H5P_DEFAULT);
+    herr_t status = gid < 0 ? 0 : scan_group(gid, &scan);
+    if(gid >= 0)
+        H5Gclose(gid);
+
+    file_ref_release(&ref);
+
+    if(status < 0)
     {
-        H5Fclose(fid);
-        lock_release(filepath);
+        int nomem = scan.nomem;
+        scan_free(&scan);
+        if(nomem)
+            return PyErr_NoMemory();
         Py_RETURN_NONE;
     }
 
-    H5Fclose(fid);
+    if(scan.length && scan.len > scan.length)
+        scan_trim(&scan);
+    else if(scan.len)
+        qsort(scan.keys, scan.len, sizeof(char *), key_qsort_cmp);
+
+    PyObject *group_names = PyList_New(scan.len);
+    for(size_t i = 0; group_names != NULL && i < scan.len; i++)
+    {
+        PyObject *name = PyUnicode_FromString(scan.keys[i]);
+        if(name == NULL)
+        {
+            Py_CLEAR(group_names);
+            break;
+        }
+        PyList_SET_ITEM(group_names, i, name);
+    }
 
-    lock_release(filepath);
+    scan_free(&scan);
 
     return group_names;
 }
 
+static PyObject *
+open_file(PyObject *self, PyObject *args)
+{
+#ifndef DEBUG
+    H5Eset_auto2(H5P_DEFAULT, NULL, NULL);
+#endif
+
+    char *filepath;
+    int create;
+    if(!PyArg_ParseTuple(args, "sp", &filepath, &create))
+        return NULL;
+
+    handle_slot *slot = PyMem_Calloc(1, sizeof(handle_slot));
+    if(slot == NULL)
+        return PyErr_NoMemory();
+
+    strncpy(slot->path, filepath, PATH_MAX);
+
+    file_ref ref = {.exclusive = create, .slot = slot};
+    strcpy(ref.path, slot->path);
+    if((ref.lockfd = lock_open(slot->path)) < 0)
+    {
+        PyMem_Free(slot);
+        return NULL;
+    }
+
+    if(lock_acquire(ref.lockfd, create, slot->path) < 0)
+    {
+        close(ref.lockfd);
+        PyMem_Free(slot);
+        return NULL;
+    }
+
+    // A file that does not exist yet is created read-write and closed, then opened read-only like any other
+    slot->gen = lock_generation(ref.lockfd);
+    slot->fid = file_open(slot->path, H5F_ACC_RDONLY, 0);
+    if(slot->fid < 0 && create && (ref.fid = file_open_writable(slot->path, 1)) >= 0)
+    {
+        H5Fclose(ref.fid);
+        slot->fid = file_open(slot->path, H5F_ACC_RDONLY, 0);
+    }
+
+    ref.fid = -1;
+    ref.exclusive = 0;
+    file_ref_release(&ref);
+
+    if(slot->fid < 0)
+    {
+        PyMem_Free(slot);
+        Py_RETURN_NONE;
+    }
+
+    Py_ssize_t i;
+    for(i = 0; i < slots_len && slots[i] != NULL; i++)
+        ;
+
+    if(i == slots_len)
+    {
+        handle_slot **grown = PyMem_Realloc(slots, (slots_len + 1) * sizeof(handle_slot *));
+        if(grown == NULL)
+        {
+            H5Fclose(slot->fid);
+            PyMem_Free(slot);
+            return PyErr_NoMemory();
+        }
+        slots = grown;
+        slots_len++;
+    }
+
+    slots[i] = slot;
+
+    return PyLong_FromSsize_t(i);
+}
+
+static PyObject *
+close_file(PyObject *self, PyObject *args)
+{
+#ifndef DEBUG
+    H5Eset_auto2(H5P_DEFAULT, NULL, NULL);
+#endif
+
+    PyObject *handle;
+    if(!PyArg_ParseTuple(args, "O", &handle))
+        return NULL;
+
+    handle_slot *slot = slot_get(handle);
+    if(slot == NULL)
+        return NULL;
+
+    if(slot->fid >= 0)
+        H5Fclose(slot->fid);
+
+    slots[PyLong_AsSsize_t(handle)] = NULL;
+    PyMem_Free(slot);
+
+    Py_RETURN_NONE;
+}
+
+static PyObject *
+remove_file(PyObject *self, PyObject *args)
+{
+    char *filepath;
+    if(!PyArg_ParseTuple(args, "s", &filepath))
+        return NULL;
+
+    int fd = lock_open(filepath);
+    if(fd < 0)
+        return NULL;
+
+    if(lock_acquire(fd, 1, filepath) < 0)
+    {
+        close(fd);
+        return NULL;
+    }
+
+    // Bumping the generation makes open handles in other processes drop the removed file
+    unlink(filepath);
+    lock_bump_generation(fd);
+    close(fd);
+
+    Py_RETURN_NONE;
+}
+
+static PyObject *
+set_lock_timeout(PyObject *self, PyObject *args)
+{
+    double seconds;
+    if(!PyArg_ParseTuple(args, "d", &seconds))
+        return NULL;
+
+    lock_timeout_ms = (long) (seconds * 1000);
+
+    Py_RETURN_NONE;
+}
+
 static PyMethodDef methods[] = {
     {"set",         set,        METH_VARARGS, "Set value"},
+    {"set_many",    set_many,   METH_VARARGS, "Set many values in one file open"},
     {"get_value",   get_value,  METH_VARARGS, "Get value"},
+    {"get_many",    get_many,   METH_VARARGS, "Get many values in one file open"},
     {"get_block",   get_block,  METH_VARARGS, "Get block"},
     {"delete",      delete,     METH_VARARGS, "Delete value & block"},
-    {"get_groups",  get_groups, METH_VARARGS, "Get groups"}
+    {"get_groups",  get_groups, METH_VARARGS, "Get groups under a prefix in key order, up to length if given"},
+    {"open",        open_file,  METH_VARARGS, "Open file and return a handle usable in place of a path"},
+    {"close",       close_file, METH_VARARGS, "Close file handle"},
+    {"remove",      remove_file, METH_VARARGS, "Remove file"},
+    {"set_lock_timeout", set_lock_timeout, METH_VARARGS, "Set seconds to wait for a file lock before TimeoutError"},
+    {NULL, NULL, 0, NULL}
 };
 
 static struct PyModuleDef h5cmodule = {
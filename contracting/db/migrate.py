@@ -0,0 +1,53 @@
+import argparse
+from pathlib import Path
+
+from contracting import config
+from contracting.db.driver import FSDriver, LMDBDriver, STORAGE_HOME
+from contracting.db.encoder import ENCODERS
+
+MISC_PREFIX = '__misc' + config.INDEX_SEPARATOR
+BATCH_SIZE = 10000
+
+
+def fs_to_lmdb(source=None, target=None, batch_size=BATCH_SIZE, codec='json'):
+    """Copy every key, value and block number from an FSDriver tree into an LMDBDriver and return the key count."""
+    fs = FSDriver(root=source)
+    db = LMDBDriver(root=target if target is not None else fs.root, codec=codec)
+
+    try:
+        keys = fs.keys()
+        for i in range(0, len(keys), batch_size):
+            batch = keys[i:i + batch_size]
+
+            # set_many takes one block number per call, so each batch is written grouped by block
+            blocks = {}
+            for key, value in fs.get_many(batch).items():
+                if value is not None:
+                    blocks.setdefault(fs.get_block(key), {})[key] = value
+
+            for block_num, items in blocks.items():
+                # FSDriver files keys without a contract under __misc, and lists them with that prefix
+                items = {key[len(MISC_PREFIX):] if key.startswith(MISC_PREFIX) else key: value for key, value in items.items()}
+                db.set_many(items, block_num=None if block_num == config.BLOCK_NUM_DEFAULT else str(block_num))
+    finally:
+        # An LMDB environment may only be open once per process, so give it back for the caller to reopen
+        db.env.close()
+        fs.pool.close_all()
+
+    return len(keys)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Copy an FSDriver state tree into an LMDBDriver store.')
+    parser.add_argument('--source', type=Path, default=STORAGE_HOME, help='FSDriver root (default: %(default)s)')
+    parser.add_argument('--target', type=Path, default=None, help='LMDBDriver root (default: the source root)')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--codec', choices=sorted(ENCODERS), default='json', help='Value encoding for the target store')
+    args = parser.parse_args(args)
+
+    count = fs_to_lmdb(args.source, args.target, args.batch_size, args.codec)
+    print('Migrated {} keys from {} to {}'.format(count, args.source, args.target or args.source))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,10 @@
-import builtins
-import importlib
+from collections import ChainMap
 from contracting.execution import runtime
 from contracting.db.driver import ContractDriver
-from contracting.execution.module import install_database_loader, uninstall_builtins, enable_restricted_imports, disable_restricted_imports
+from contracting.execution.module import install_database_loader, uninstall_builtins, import_contract, reusable_modules
 from contracting.stdlib.bridge.decimal import ContractingDecimal, CONTEXT
-from contracting.stdlib.bridge.random import Seeded
+from contracting.execution.stats import STATS
 from contracting import config
-from copy import deepcopy
 import decimal
 from logging import getLogger
 
@@ -44,7 +42,8 @@ class Executor:
                 driver=None,
                 stamps=DEFAULT_STAMPS,
                 stamp_cost=config.STAMPS_PER_TAU,
-                metering=None) -> dict:
+                metering=None,
+                profile=False) -> dict:
 
         if not self.bypass_privates:
             assert not function_name.startswith(config.PRIVATE_METHOD_PREFIX), 'Private method not callable.'
@@ -61,53 +60,141 @@ class Executor:
 
         install_database_loader(driver=driver)
 
-        balances_key = None
+        output = self.run(sender, contract_name, function_name, kwargs, environment, auto_commit, driver, stamps,
+                          stamp_cost, metering, profile)
+
+        runtime.rt.clean_up()
+        runtime.rt.env.update({'__Driver': driver})
+
+        # Values are shared with the driver, which only hands out copies of containers
+        with STATS.phase('writes'):
+            output['writes'] = dict(driver.pending_writes)
+        output['reads'] = driver.pending_reads
+
+        return output
+
+    def execute_batch(self, txs, environment={}, driver=None, metering=None) -> dict:
+        # Executes txs in order, the same as calling execute() for each. A tx is a dict of sender, contract_name,
+        # function_name and kwargs, with optional stamps, stamp_cost and profile. The loader is installed once and each
+        # output holds only the reads and writes of its own transaction. Unmetered batches keep contract modules
+        # imported between transactions when that is safe. Metered ones import them for every transaction, since that
+        # is part of what a transaction pays, but a module that can be reused is not executed again: the transaction is
+        # charged what executing its body cost.
+        if metering is None:
+            metering = self.metering
+
+        driver = driver or self.driver
+        install_database_loader(driver=driver)
+
+        batch_writes = driver.pending_writes
+        batch_reads = driver.pending_reads
+        outputs = []
+
         try:
-            if metering:
-                balances_key = '{}{}{}{}{}'.format(self.currency_contract,
-                                                   config.INDEX_SEPARATOR,
-                                                   self.balances_hash,
-                                                   config.DELIMITER,
-                                                   sender)
+            for tx in txs:
+                if not self.bypass_privates:
+                    assert not tx['function_name'].startswith(config.PRIVATE_METHOD_PREFIX), 'Private method not callable.'
+
+                runtime.rt.env.update({'__Driver': driver})
+
+                # The transaction writes into its own dict while still reading everything written before it, and
+                # records every key it reads, as it would running on its own
+                tx_writes = {}
+                tx_reads = {}
+                driver.pending_writes = ChainMap(tx_writes, batch_writes)
+                driver.pending_reads = tx_reads
+
+                try:
+                    output = self.run(tx['sender'], tx['contract_name'], tx['function_name'], tx['kwargs'],
+                                      environment=environment,
+                                      driver=driver,
+                                      stamps=tx.get('stamps', DEFAULT_STAMPS),
+                                      stamp_cost=tx.get('stamp_cost', config.STAMPS_PER_TAU),
+                                      metering=metering,
+                                      profile=tx.get('profile', False))
+                finally:
+                    batch_writes.update(tx_writes)
+                    for key, value in tx_reads.items():
+                        if batch_reads.get(key) is None:
+                            batch_reads[key] = value
+                    driver.pending_writes = batch_writes
+                    driver.pending_reads = batch_reads
+
+                runtime.rt.clean_up(keep=() if metering else reusable_modules(runtime.rt.loaded_modules))
+
+                with STATS.phase('writes'):
+                    output['writes'] = tx_writes
+                output['reads'] = tx_reads
+                outputs.append(output)
+        finally:
+            runtime.rt.clean_up()
+            runtime.rt.env.update({'__Driver': driver})
 
-                balance = driver.get(balances_key)
+        return {
+            'outputs': outputs,
+            'writes': dict(batch_writes)
+        }
+
+    def get_balance(self, driver, balances_key):
+        balance = driver.get(balances_key)
 
-                if type(balance) == dict:
-                    balance = ContractingDecimal(balance.get('__fixed__'))
+        if type(balance) == dict:
+            balance = ContractingDecimal(balance.get('__fixed__'))
 
-                if balance is None:
-                    balance = 0
+        if balance is None:
+            balance = 0
 
-                log.debug({
-                    'balance': balance,
-                    'stamp_cost': stamp_cost,
-                    'stamps': stamps
-                })
+        return balance
 
-                assert balance * stamp_cost >= stamps, 'Sender does not have enough stamps for the transaction. \
+    def run(self, sender, contract_name, function_name, kwargs, environment={}, auto_commit=False, driver=None,
+            stamps=DEFAULT_STAMPS, stamp_cost=config.STAMPS_PER_TAU, metering=True, profile=False) -> dict:
+        # Runs one transaction and deducts its stamps, leaving the runtime for the caller to clean up
+        STATS.incr('transactions')
+        driver.new_transaction()
+        balances_key = None
+        try:
+            if metering:
+                with STATS.phase('balance'):
+                    balances_key = '{}{}{}{}{}'.format(self.currency_contract,
+                                                       config.INDEX_SEPARATOR,
+                                                       self.balances_hash,
+                                                       config.DELIMITER,
+                                                       sender)
+
+                    balance = self.get_balance(driver, balances_key)
+
+                    log.debug({
+                        'balance': balance,
+                        'stamp_cost': stamp_cost,
+                        'stamps': stamps
+                    })
+
+                    assert balance * stamp_cost >= stamps, 'Sender does not have enough stamps for the transaction. \
                                                                Balance at key {} is {}'.format(balances_key,
                                                                                                balance)
 
             runtime.rt.env.update(environment)
             status_code = 0
-            runtime.rt.set_up(stmps=stamps * 1000, meter=metering) # Multiply stamps by 1000 because we divide by it later
+            runtime.rt.set_up(stmps=stamps * 1000, meter=metering, profile=profile) # Multiply stamps by 1000 because we divide by it later
 
-            runtime.rt.context._base_state = {
-                'signer': sender,
-                'caller': sender,
-                'this': contract_name,
-                'entry': (contract_name, function_name),
-                'owner': driver.get_owner(contract_name),
-                'submission_name': None
-            }
+            with STATS.phase('owner'):
+                runtime.rt.context._base_state = {
+                    'signer': sender,
+                    'caller': sender,
+                    'this': contract_name,
+                    'entry': (contract_name, function_name),
+                    'owner': driver.get_owner(contract_name),
+                    'submission_name': None
+                }
 
-            if runtime.rt.context.owner is not None and runtime.rt.context.owner != runtime.rt.context.caller:
-                raise Exception(f'Caller {runtime.rt.context.caller} is not the owner {runtime.rt.context.owner}!')
+                if runtime.rt.context.owner is not None and runtime.rt.context.owner != runtime.rt.context.caller:
+                    raise Exception(f'Caller {runtime.rt.context.caller} is not the owner {runtime.rt.context.owner}!')
 
             decimal.setcontext(CONTEXT)
 
-            module = importlib.import_module(contract_name)
-            func = getattr(module, function_name)
+            with STATS.phase('import'):
+                module = import_contract(contract_name)
+                func = getattr(module, function_name)
 
             ## add the contract name to the context on a submission call
             if contract_name == config.SUBMISSION_CONTRACT_NAME:
@@ -117,14 +204,14 @@ class Executor:
                 if type(v) == float:
                     kwargs[k] = ContractingDecimal(str(v))
 
-            enable_restricted_imports()
-            result = func(**kwargs)
-            disable_restricted_imports()
+            with STATS.phase('run'):
+                result = func(**kwargs)
 
             if auto_commit:
                 driver.commit()
 
         except Exception as e:
+            STATS.incr('failed_transactions')
             result = e
             tb = traceback.format_exc()
             log.error(str(e))
@@ -146,38 +233,35 @@ class Executor:
             stamps_used = stamps
 
         if metering:
-            assert balances_key is not None, 'Balance key was not set properly. Cannot deduct stamps.'
+            with STATS.phase('deduct'):
+                assert balances_key is not None, 'Balance key was not set properly. Cannot deduct stamps.'
 
-            to_deduct = stamps_used
+                to_deduct = stamps_used
 
-            to_deduct /= stamp_cost
+                to_deduct /= stamp_cost
 
-            to_deduct = ContractingDecimal(to_deduct)
+                to_deduct = ContractingDecimal(to_deduct)
 
-            balance = driver.get(balances_key)
-            if balance is None:
-                balance = 0
+                balance = self.get_balance(driver, balances_key)
 
-            balance = max(balance - to_deduct, 0)
+                balance = max(balance - to_deduct, 0)
 
-            driver.set(balances_key, balance)
-                       #mark=False)  # This makes sure that the key isnt modified every time in the block
-            if auto_commit:
-                driver.commit()
+                driver.set(balances_key, balance)
+                           #mark=False)  # This makes sure that the key isnt modified every time in the block
+                if auto_commit:
+                    driver.commit()
 
-        Seeded.s = False
-        runtime.rt.clean_up()
-        runtime.rt.env.update({'__Driver': driver})
+        runtime.rt.seeded = False
 
         output = {
             'status_code': status_code,
             'result': result,
-            'stamps_used': stamps_used,
-            'writes': deepcopy(driver.pending_writes),
-            'reads': driver.pending_reads
+            'stamps_used': stamps_used
         }
 
-        disable_restricted_imports()
+        # Where the stamps went, by contract, function and line; None when not metered
+        if profile:
+            output['profile'] = runtime.rt.profile()
 
         return output
 
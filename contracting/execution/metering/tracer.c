@@ -6,9 +6,6 @@
 #include "structmember.h"
 #include "frameobject.h"
 
-#include <sys/resource.h>
-
-
 #include <stdio.h>          /* For reading CU cu_costs */
 #include <stdlib.h>
 #include <string.h>
@@ -33,15 +30,43 @@
 #define RET_OK      0
 #define RET_ERROR   -1
 
-unsigned long long cu_costs[] = {2, 4, 5, 2, 4, 1000, 1000, 1000, 2, 2, 3, 2, 1000, 1000, 4, 1000, 1000, 1000, 30, 3,
-                                1000, 4, 3, 3, 3, 4, 4, 4, 5, 1000, 1000, 1000, 1000, 6, 30, 7, 12, 1000, 1610, 4, 7,
-                                1000, 6, 6, 6, 6, 6, 2, 15, 15, 2, 126, 1000, 4, 4, 4, 4, 2, 2, 8, 8, 2, 6, 6, 4, 4,
-                                1000, 2, 2, 2, 5, 8, 7, 4, 4, 38, 126, 4, 4, 4, 4, 4, 4, 3, 1000, 1000, 2, 4, 2, 3,
-                                1000, 2, 2, 2, 1000, 1000, 1000, 5, 9, 7, 12, 1000, 7, 2, 2, 2, 1000, 1000, 12, 12, 15,
-                                2, 8, 8, 5, 2, 5, 7, 9, 2, 8, 15, 30, 7, 8, 4};
+/* Cost of each opcode, indexed by opcode, from cu_costs.const. Opcodes it does not list cost 1000. */
+unsigned long long cu_costs[] = {1000, 2, 4, 5, 2, 4, 1000, 1000, 1000, 2, 2, 3, 2, 1000, 1000, 4, 1000, 1000, 1000,
+                                30, 3, 1000, 4, 3, 3, 3, 4, 4, 4, 5, 1000, 1000, 1000, 1000, 1000, 1000, 1000, 1000,
+                                1000, 1000, 1000, 1000, 1000, 1000, 1000, 1000, 1000, 1000, 1000, 1000, 7, 12, 15,
+                                1000, 1000, 5, 5, 4, 1000, 4, 4, 4, 6, 6, 6, 6, 6, 30, 7, 12, 1000, 1610, 4, 7, 1000,
+                                6, 6, 6, 6, 6, 2, 15, 15, 2, 126, 1000, 4, 4, 4, 4, 2, 2, 8, 8, 2, 6, 6, 4, 4, 1000, 2,
+                                2, 2, 5, 8, 7, 4, 4, 38, 126, 4, 4, 4, 4, 4, 4, 3, 1000, 1000, 2, 4, 2, 3, 1000, 2, 2,
+                                2, 1000, 1000, 1000, 5, 9, 7, 12, 1000, 7, 2, 2, 2, 1000, 1000, 12, 12, 15, 2, 8, 8, 5,
+                                2, 5, 7, 9, 2, 8, 15, 30, 7, 8, 4, 1000, 4, 9};
 
 unsigned long long MAX_STAMPS = 6500000;
 
+/* Bytes contract code may allocate in one transaction, unless set_mem_limit says otherwise */
+#define DEFAULT_MEM_LIMIT 500000000
+
+/* Requests up to this size may be served from an object free list or a reused frame, so whether they reach the
+   allocator depends on what the process ran before. Only larger requests are counted. */
+#define SMALL_ALLOC 512
+
+/* Counted allocations since the last opcode, so the frame of a call can be taken back out */
+#define RECENT_ALLOCS 4
+
+
+/* Sizes of the blocks counted in a transaction by address, so a block that is reallocated is charged only for what it
+   grows by. An open addressing table, kept outside the allocators it is used from. */
+
+typedef struct {
+    void *ptr;
+    size_t size;
+} Block;
+
+typedef struct {
+    Block *blocks;
+    size_t capacity;
+    size_t len;
+} BlockTable;
+
 
 /* The Tracer type. */
 
@@ -51,9 +76,21 @@ typedef struct {
     /* Variables to keep track of metering */
     unsigned long long cost;
     unsigned long long stamp_supplied;
-    long last_frame_mem_usage;
-    long total_mem_usage;
+    long long total_mem_usage;
+    long long mem_limit;
     int started;
+
+    /* Whether the innermost Python frame is contract code */
+    int in_contract;
+
+    void *recent[RECENT_ALLOCS];
+    size_t recent_size[RECENT_ALLOCS];
+    int recent_len;
+
+    BlockTable counted;
+
+    /* When profiling, cost by (contract, function, line, kind) */
+    PyObject *profile;
     char *cu_cost_fname;
 
 } Tracer;
@@ -67,19 +104,278 @@ Tracer_init(Tracer *self, PyObject *args, PyObject *kwds)
 
     self->started = 0;
     self->cost = 0;
-    self->last_frame_mem_usage = 0;
     self->total_mem_usage = 0;
+    self->mem_limit = DEFAULT_MEM_LIMIT;
+    self->in_contract = 0;
+    self->recent_len = 0;
+    self->counted.blocks = NULL;
+    self->counted.capacity = 0;
+    self->counted.len = 0;
+    self->profile = NULL;
 
     return RET_OK;
 }
 
+/*
+ * Memory accounting
+ *
+ * While the tracer runs, the object and mem allocators are wrapped so that the bytes of every request larger than
+ * SMALL_ALLOC made while a contract frame is the innermost frame are added to total_mem_usage. A block counted earlier
+ * in the transaction that is reallocated is charged only for what it grows by; any other reallocated block is charged
+ * its whole new size. Frames are not counted, since a function's frame is only allocated the first time it runs.
+ * Nothing depends on the state of the process, so every node counts the same total for a transaction.
+ *
+ * Tracers may run on several threads at once. The hooks stay installed while any of them is started, and charge each
+ * request to the tracer of the thread making it, which is the trace object set on that thread.
+ */
+
+typedef struct {
+    PyMemAllocatorEx orig;
+} MemHook;
+
+static MemHook obj_hook = { { NULL, NULL, NULL, NULL, NULL } };
+static MemHook mem_hook = { { NULL, NULL, NULL, NULL, NULL } };
+
+/* Started tracers, which the hooks are installed for */
+static int hook_users = 0;
+
+static int Tracer_trace(Tracer *self, PyFrameObject *frame, int what, PyObject *arg);
+
+static size_t
+block_home(BlockTable *table, void *ptr)
+{
+    return (size_t)(((uintptr_t)ptr >> 3) * 2654435761u) & (table->capacity - 1);
+}
+
+static size_t
+block_slot(BlockTable *table, void *ptr)
+{
+    size_t i = block_home(table, ptr);
+
+    while (table->blocks[i].ptr != NULL && table->blocks[i].ptr != ptr) {
+        i = (i + 1) & (table->capacity - 1);
+    }
+    return i;
+}
+
+static int
+blocks_grow(BlockTable *table)
+{
+    Block *old = table->blocks;
+    size_t old_capacity = table->capacity, capacity = old_capacity ? old_capacity * 2 : 1024, i;
+    Block *blocks = PyMem_RawCalloc(capacity, sizeof(Block));
+
+    if (blocks == NULL) return -1;
+
+    table->blocks = blocks;
+    table->capacity = capacity;
+    for (i = 0; i < old_capacity; i++) {
+        if (old[i].ptr != NULL) {
+            table->blocks[block_slot(table, old[i].ptr)] = old[i];
+        }
+    }
+    PyMem_RawFree(old);
+    return 0;
+}
+
+static void
+blocks_add(BlockTable *table, void *ptr, size_t size)
+{
+    size_t i;
+
+    // A block that cannot be recorded is charged in full if it is reallocated
+    if ((table->len + 1) * 2 > table->capacity && blocks_grow(table) < 0) return;
+
+    i = block_slot(table, ptr);
+    if (table->blocks[i].ptr == NULL) table->len++;
+    table->blocks[i].ptr = ptr;
+    table->blocks[i].size = size;
+}
+
+static int
+blocks_pop(BlockTable *table, void *ptr, size_t *size)
+{
+    size_t i, j, home, mask = table->capacity - 1;
+
+    if (table->len == 0) return 0;
+
+    i = block_slot(table, ptr);
+    if (table->blocks[i].ptr == NULL) return 0;
+
+    *size = table->blocks[i].size;
+    table->blocks[i].ptr = NULL;
+    table->len--;
+
+    // Move later blocks of the run back into the gap, so lookups never stop short of them
+    for (j = (i + 1) & mask; table->blocks[j].ptr != NULL; j = (j + 1) & mask) {
+        home = block_home(table, table->blocks[j].ptr);
+        if ((j > i && (home <= i || home > j)) || (j < i && home <= i && home > j)) {
+            table->blocks[i] = table->blocks[j];
+            table->blocks[j].ptr = NULL;
+            i = j;
+        }
+    }
+    return 1;
+}
+
+static void
+blocks_clear(BlockTable *table)
+{
+    if (table->blocks != NULL) {
+        memset(table->blocks, 0, table->capacity * sizeof(Block));
+    }
+    table->len = 0;
+}
+
+static Tracer *
+alloc_tracer(void)
+{
+    PyThreadState *tstate = _PyThreadState_UncheckedGet();
+
+    if (tstate == NULL || tstate->c_tracefunc != (Py_tracefunc)Tracer_trace) return NULL;
+    return (Tracer *)tstate->c_traceobj;
+}
+
+static void
+count_alloc(void *old_ptr, void *ptr, size_t size)
+{
+    Tracer *tracer;
+    size_t old_size = 0, charged = size;
+    int known;
+
+    if (ptr == NULL || (tracer = alloc_tracer()) == NULL) return;
+
+    known = old_ptr != NULL && blocks_pop(&tracer->counted, old_ptr, &old_size);
+    if (size <= SMALL_ALLOC) return;
+
+    if (known) {
+        charged = size > old_size ? size - old_size : 0;
+    }
+
+    if (!tracer->in_contract) {
+        // Still followed, so that growing it from contract code is charged like any other counted block
+        if (known) blocks_add(&tracer->counted, ptr, size);
+        return;
+    }
+
+    blocks_add(&tracer->counted, ptr, size);
+    tracer->total_mem_usage += charged;
+
+    if (tracer->recent_len < RECENT_ALLOCS) {
+        tracer->recent[tracer->recent_len] = ptr;
+        tracer->recent_size[tracer->recent_len] = charged;
+        tracer->recent_len++;
+    }
+}
+
+static void
+uncount_free(void *ptr)
+{
+    Tracer *tracer;
+    size_t size;
+
+    if (ptr != NULL && (tracer = alloc_tracer()) != NULL) {
+        blocks_pop(&tracer->counted, ptr, &size);
+    }
+}
+
+static void
+uncount_frame(Tracer *tracer, PyFrameObject *frame)
+{
+    // Frames are allocated with their GC header in front
+    void *ptr = (char *)frame - sizeof(PyGC_Head);
+    int i;
+
+    for (i = 0; i < tracer->recent_len; i++) {
+        if (tracer->recent[i] == ptr) {
+            tracer->total_mem_usage -= tracer->recent_size[i];
+            tracer->recent[i] = NULL;
+            return;
+        }
+    }
+}
+
+static void *
+hook_malloc(void *ctx, size_t size)
+{
+    MemHook *hook = (MemHook *)ctx;
+    void *ptr = hook->orig.malloc(hook->orig.ctx, size);
+    count_alloc(NULL, ptr, size);
+    return ptr;
+}
+
+static void *
+hook_calloc(void *ctx, size_t nelem, size_t elsize)
+{
+    MemHook *hook = (MemHook *)ctx;
+    void *ptr = hook->orig.calloc(hook->orig.ctx, nelem, elsize);
+    count_alloc(NULL, ptr, nelem * elsize);
+    return ptr;
+}
+
+static void *
+hook_realloc(void *ctx, void *ptr, size_t new_size)
+{
+    MemHook *hook = (MemHook *)ctx;
+    void *new_ptr = hook->orig.realloc(hook->orig.ctx, ptr, new_size);
+    count_alloc(ptr, new_ptr, new_size);
+    return new_ptr;
+}
+
+static void
+hook_free(void *ctx, void *ptr)
+{
+    MemHook *hook = (MemHook *)ctx;
+    uncount_free(ptr);
+    hook->orig.free(hook->orig.ctx, ptr);
+}
+
+static void
+install_hook(PyMemAllocatorDomain domain, MemHook *hook)
+{
+    PyMemAllocatorEx alloc = { hook, hook_malloc, hook_calloc, hook_realloc, hook_free };
+
+    if (hook->orig.malloc == NULL) {
+        PyMem_GetAllocator(domain, &hook->orig);
+        PyMem_SetAllocator(domain, &alloc);
+    }
+}
+
+static void
+remove_hook(PyMemAllocatorDomain domain, MemHook *hook)
+{
+    PyMemAllocatorEx current;
+
+    // Blocks allocated through the hook are freed by the allocator it wraps, so it can go at any time. If another
+    // allocator (tracemalloc) was installed over it, the hook stays in place, counting for tracers started later.
+    PyMem_GetAllocator(domain, &current);
+    if (current.ctx == hook) {
+        PyMem_SetAllocator(domain, &hook->orig);
+        hook->orig.malloc = NULL;
+    }
+}
+
+static void
+Tracer_disable(Tracer *self)
+{
+    PyEval_SetTrace(NULL, NULL);
+    if (--hook_users == 0) {
+        remove_hook(PYMEM_DOMAIN_OBJ, &obj_hook);
+        remove_hook(PYMEM_DOMAIN_MEM, &mem_hook);
+    }
+    self->in_contract = 0;
+    self->started = 0;
+}
+
 static void
 Tracer_dealloc(Tracer *self)
 {
     if (self->started) {
-        PyEval_SetTrace(NULL, NULL);
+        Tracer_disable(self);
     }
 
+    Py_CLEAR(self->profile);
+    PyMem_RawFree(self->counted.blocks);
     Py_TYPE(self)->tp_free((PyObject*)self);
 }
 
@@ -88,86 +384,133 @@ Tracer_dealloc(Tracer *self)
  * The Trace Function
  */
 
- static long get_memory_usage() {
-    struct rusage r_usage;
-    getrusage(RUSAGE_SELF,&r_usage);
+ /* Interned once in PyInit_tracer, so checking a frame allocates nothing */
+ static PyObject *contract_key = NULL;
+ static PyObject *name_key = NULL;
+ static PyObject *execution_kind = NULL;
 
-//    printf("%ld\n", r_usage.ru_maxrss);
+ #define CU_COSTS_LEN (sizeof(cu_costs) / sizeof(cu_costs[0]))
 
-    return r_usage.ru_maxrss;
+ static int
+ is_contract_frame(PyFrameObject *frame)
+ {
+    return PyDict_GetItem(frame->f_globals, contract_key) != NULL;
+ }
+
+ static unsigned long long
+ opcode_cost(PyFrameObject *frame)
+ {
+    const unsigned char *str = (const unsigned char *)PyBytes_AS_STRING(frame->f_code->co_code);
+    unsigned char opcode = str[frame->f_lasti];
+
+    if (opcode >= CU_COSTS_LEN) return 1000;
+
+    return cu_costs[opcode];
  }
 
  static int
- Tracer_trace(Tracer *self, PyFrameObject *frame, int what, PyObject *arg)
+ profile_cost(Tracer *self, PyFrameObject *frame, PyObject *kind, unsigned long long cost)
  {
-    unsigned long long estimate = 0;
-    unsigned long long factor = 1000;
-    const char *str;
-     // IF, Frame object globals contains __contract__ and it is true, continue
+    // Charged to the line of the innermost contract frame, or to no contract if there is none
+    PyObject *key, *total;
+    PyObject *name = Py_None, *function = Py_None;
+    int line = 0, result = RET_ERROR;
+    int in_contract = self->in_contract;
+
+    while (frame != NULL && !is_contract_frame(frame)) {
+        frame = frame->f_back;
+    }
 
-     PyObject *kv = PyUnicode_FromString("__contract__");
-     int t = PyDict_Contains(frame->f_globals, kv);
-     Py_DECREF(kv);
+    if (frame != NULL) {
+        name = PyDict_GetItem(frame->f_globals, name_key);
+        if (name == NULL) name = Py_None;
+        function = frame->f_code->co_name;
+        line = frame->f_lineno;
+    }
 
-     if (t != 1) {
-        return RET_OK;
-     }
+    // What the profile allocates is not the contract's
+    self->in_contract = 0;
 
-     if (self->last_frame_mem_usage == 0) {
-        self->last_frame_mem_usage = get_memory_usage();
-     }
+    key = Py_BuildValue("(OOiO)", name, function, line, kind);
+    if (key == NULL) goto done;
 
-     int opcode;
+    total = PyDict_GetItem(self->profile, key);
+    total = PyLong_FromUnsignedLongLong((total == NULL ? 0 : PyLong_AsUnsignedLongLong(total)) + cost);
 
-     switch (what) {
-         case PyTrace_LINE:      /* 2 */
-             // printf("LINE\n");
-             str = PyBytes_AS_STRING(frame->f_code->co_code);
-             opcode = str[frame->f_lasti];
+    if (total != NULL) {
+        result = PyDict_SetItem(self->profile, key, total);
+        Py_DECREF(total);
+    }
+    Py_DECREF(key);
 
-             if (opcode < 0) opcode = -opcode;
+ done:
+    self->in_contract = in_contract;
+    return result;
+ }
 
-             estimate = (self->cost + cu_costs[opcode]) / factor;
-             estimate = estimate + 1;
+ static int
+ Tracer_trace(Tracer *self, PyFrameObject *frame, int what, PyObject *arg)
+ {
+     unsigned long long cost;
+
+     switch (what) {
+         case PyTrace_CALL:      /* 0 */
+             // Contract frames report every opcode, and no other frame reports anything but calls and returns
+             if (self->in_contract) {
+                uncount_frame(self, frame);
+             }
 
-             long new_memory_usage = get_memory_usage();
+             if (is_contract_frame(frame)) {
+                frame->f_trace_opcodes = 1;
+                self->in_contract = 1;
+             }
+             else {
+                frame->f_trace_lines = 0;
+                self->in_contract = 0;
+             }
+             break;
+
+         case PyTrace_RETURN:    /* 3 */
+             self->in_contract = frame->f_back != NULL && is_contract_frame(frame->f_back);
+             break;
 
-             if (new_memory_usage > self->last_frame_mem_usage) {
-                self->total_mem_usage += (new_memory_usage - self->last_frame_mem_usage);
-                printf("[TRACER] TX total memory usage: %ld\n", self->total_mem_usage);
+         case PyTrace_LINE:      /* 2 */
+             // Only frames already running when the tracer started get here without a call event, so they are
+             // checked on each line and report opcodes once they are contract frames
+             if (is_contract_frame(frame)) {
+                frame->f_trace_opcodes = 1;
              }
+             break;
 
-             self->last_frame_mem_usage = new_memory_usage;
+         case PyTrace_OPCODE:    /* 7 */
+             self->in_contract = 1;
+             self->recent_len = 0;
 
-             //estimate = estimate * factor;
              if ((self->cost > self->stamp_supplied) || self->cost > MAX_STAMPS) {
                  PyErr_SetString(PyExc_AssertionError, "The cost has exceeded the stamp supplied!");
-                 PyEval_SetTrace(NULL, NULL);
-                 self->started = 0;
+                 Tracer_disable(self);
                  return RET_ERROR;
              }
 
-#ifdef unix
-             if (self->total_mem_usage > 500000) {
-                 PyErr_Format(PyExc_AssertionError, "Transaction exceeded memory usage! Total usage: %ld kilobytes", self->total_mem_usage);
-#else
-             if (self->total_mem_usage > 500000000) {
-                 PyErr_Format(PyExc_AssertionError, "Transaction exceeded memory usage! Total usage: %ld bytes", self->total_mem_usage);
-#endif
-                 PyEval_SetTrace(NULL, NULL);
-                 self->started = 0;
+             if (self->total_mem_usage > self->mem_limit) {
+                 PyErr_Format(PyExc_AssertionError, "Transaction exceeded memory usage! Total usage: %lld bytes", self->total_mem_usage);
+                 Tracer_disable(self);
                  return RET_ERROR;
              }
 
-             self->cost += cu_costs[opcode];
+             cost = opcode_cost(frame);
+             self->cost += cost;
+
+             if (self->profile != NULL && profile_cost(self, frame, execution_kind, cost) < 0) {
+                 Tracer_disable(self);
+                 return RET_ERROR;
+             }
              break;
 
          default:
              break;
      }
 
-
-
      return RET_OK;
  }
 
@@ -177,6 +520,14 @@ Tracer_start(Tracer *self, PyObject *args)
     PyEval_SetTrace((Py_tracefunc)Tracer_trace, (PyObject*)self);
     self->cost = 0;
 
+    self->in_contract = 0;
+    self->recent_len = 0;
+    blocks_clear(&self->counted);
+    if (!self->started && hook_users++ == 0) {
+        install_hook(PYMEM_DOMAIN_OBJ, &obj_hook);
+        install_hook(PYMEM_DOMAIN_MEM, &mem_hook);
+    }
+
     self->started = 1;
     return Py_BuildValue("");
 }
@@ -185,8 +536,7 @@ static PyObject *
 Tracer_stop(Tracer *self, PyObject *args)
 {
     if (self->started) {
-        PyEval_SetTrace(NULL, NULL);
-        self->started = 0;
+        Tracer_disable(self);
     }
 
     return Py_BuildValue("");
@@ -199,13 +549,41 @@ Tracer_set_stamp(Tracer *self, PyObject *args, PyObject *kwds)
     return Py_BuildValue("");
 }
 
+static PyObject *
+Tracer_set_mem_limit(Tracer *self, PyObject *args, PyObject *kwds)
+{
+    if (!PyArg_ParseTuple(args, "L", &self->mem_limit)) {
+        return NULL;
+    }
+    return Py_BuildValue("");
+}
+
+static PyObject *
+Tracer_enable_profile(Tracer *self, PyObject *args)
+{
+    Py_XSETREF(self->profile, PyDict_New());
+    if (self->profile == NULL) {
+        return NULL;
+    }
+    return Py_BuildValue("");
+}
+
+static PyObject *
+Tracer_get_profile(Tracer *self, PyObject *args)
+{
+    if (self->profile == NULL) {
+        return Py_BuildValue("");
+    }
+    return PyDict_Copy(self->profile);
+}
+
 static PyObject *
 Tracer_reset(Tracer *self)
 {
+    Py_CLEAR(self->profile);
     self->cost = 0;
     self->stamp_supplied = 0;
     self->started = 0;
-    self->last_frame_mem_usage = 0;
     self->total_mem_usage = 0;
 
     return Py_BuildValue("");
@@ -217,13 +595,19 @@ Tracer_add_cost(Tracer *self, PyObject *args, PyObject *kwds)
     // This allows you to arbitrarily add to the cost variable from Python
     // Implemented for adding costs to database read / write operations
     unsigned long long new_cost;
-    PyArg_ParseTuple(args, "L", &new_cost);
+    PyObject *kind = Py_None;
+    if (!PyArg_ParseTuple(args, "L|O", &new_cost, &kind)) {
+        return NULL;
+    }
     self->cost += new_cost;
 
+    if (self->profile != NULL && profile_cost(self, PyEval_GetFrame(), kind, new_cost) < 0) {
+        return NULL;
+    }
+
     if (self->cost > self->stamp_supplied) {
          PyErr_SetString(PyExc_AssertionError, "The cost has exceeded the stamp supplied!\n");
-         PyEval_SetTrace(NULL, NULL);
-         self->started = 0;
+         Tracer_disable(self);
          return NULL;
      }
 
@@ -237,12 +621,6 @@ Tracer_get_stamp_used(Tracer *self, PyObject *args, PyObject *kwds)
 }
 
 
-static PyObject *
-Tracer_get_last_frame_mem_usage(Tracer *self, PyObject *args, PyObject *kwds)
-{
-    return Py_BuildValue("L", self->last_frame_mem_usage);
-}
-
 static PyObject *
 Tracer_get_total_mem_usage(Tracer *self, PyObject *args, PyObject *kwds)
 {
@@ -269,11 +647,20 @@ Tracer_methods[] = {
     { "stop",       (PyCFunction) Tracer_stop,          METH_VARARGS,
             PyDoc_STR("Stop the tracer") },
 
+    { "set_mem_limit",  (PyCFunction) Tracer_set_mem_limit,     METH_VARARGS,
+            PyDoc_STR("Set the bytes contract code may allocate before the tracer raises AssertionError") },
+
     { "reset",       (PyCFunction) Tracer_reset,          METH_VARARGS,
             PyDoc_STR("Resets the tracer") },
 
     { "add_cost",       (PyCFunction) Tracer_add_cost,          METH_VARARGS,
-            PyDoc_STR("Add to the cost. Throws AssertionError if cost exceeds stamps supplied.") },
+            PyDoc_STR("Add to the cost, with an optional kind for the profile. Throws AssertionError if cost exceeds stamps supplied.") },
+
+    { "enable_profile",  (PyCFunction) Tracer_enable_profile,     METH_VARARGS,
+            PyDoc_STR("Attribute costs to contract, function and line until the next reset") },
+
+    { "get_profile",  (PyCFunction) Tracer_get_profile,     METH_VARARGS,
+            PyDoc_STR("Get the profile as {(contract, function, line, kind): cost}, or None when not profiling") },
 
     { "set_stamp",  (PyCFunction) Tracer_set_stamp,     METH_VARARGS,
             PyDoc_STR("Set the stamp before starting the tracer") },
@@ -281,11 +668,8 @@ Tracer_methods[] = {
     { "get_stamp_used",  (PyCFunction) Tracer_get_stamp_used,     METH_VARARGS,
             PyDoc_STR("Get the stamp usage after it's been completed") },
 
-    { "get_last_frame_mem_usage",  (PyCFunction) Tracer_get_last_frame_mem_usage,     METH_VARARGS,
-            PyDoc_STR("Get the memory usage of the last Python frame processed.") },
-
     { "get_total_mem_usage",  (PyCFunction) Tracer_get_total_mem_usage,     METH_VARARGS,
-            PyDoc_STR("Get the total memory usage after it's been completed") },
+            PyDoc_STR("Get the bytes allocated by contract code after it's been completed") },
 
     { "is_started",  (PyCFunction) Tracer_is_started,     METH_VARARGS,
             PyDoc_STR("Returns 1 if tracer is started, 0 if not.") },
@@ -375,6 +759,14 @@ PyInit_tracer(void)
         return NULL;
     }
 
+    contract_key = PyUnicode_InternFromString("__contract__");
+    name_key = PyUnicode_InternFromString("__name__");
+    execution_kind = PyUnicode_InternFromString("execution");
+    if (contract_key == NULL || name_key == NULL || execution_kind == NULL) {
+        Py_DECREF(mod);
+        return NULL;
+    }
+
     PyModule_AddObject(mod, "Tracer", (PyObject *)&TracerType);
     return mod;
 }
@@ -1,19 +1,26 @@
 import sys
 
+import importlib
 import importlib.util
 from importlib.abc import Loader, MetaPathFinder, PathEntryFinder
-from importlib import invalidate_caches, __import__
+from importlib import invalidate_caches
 from importlib.machinery import ModuleSpec
-from contracting.db.driver import ContractDriver
+from contracting.db.driver import ContractDriver, CODE_CACHE
+from contracting.db.orm import Datum
 from contracting.stdlib import env
-from contracting.execution.runtime import rt
-from types import ModuleType
-import marshal
+from contracting.stdlib.bridge.decimal import ContractingDecimal
+from contracting.stdlib.bridge.time import Datetime, Timedelta
+from contracting.execution.runtime import rt, current
+from contracting.execution.stats import STATS
+from types import ModuleType, FunctionType, CodeType
 import builtins
+import dis
+import weakref
 
 # This function overrides the __import__ function, which is the builtin function that is called whenever Python runs
 # an 'import' statement. If the globals dictionary contains {'__contract__': True}, then this function will make sure
-# that the module being imported comes from the database and not from builtins or site packages.
+# that the module being imported comes from the database and not from builtins or site packages. It is installed once
+# and left in place, since other threads may be running contracts at any time.
 #
 # For all exec statements, we add the {'__contract__': True} _key to the globals to protect against unwanted imports.
 #
@@ -26,13 +33,14 @@ def is_valid_import(name):
         raise ImportError("module {} cannot be imported in a smart contract.".format(name))
 
 
+builtin_import = builtins.__import__
+
+
 def restricted_import(name, globals=None, locals=None, fromlist=(), level=0):
     if globals is not None and globals.get('__contract__') is True:
-        spec = importlib.util.find_spec(name)
-        if spec is None or not isinstance(spec.loader, DatabaseLoader):
-            raise ImportError("module {} cannot be imported in a smart contract.".format(name))
+        return import_contract(name)
 
-    return __import__(name, globals, locals, fromlist, level)
+    return builtin_import(name, globals, locals, fromlist, level)
 
 
 def enable_restricted_imports():
@@ -40,8 +48,30 @@ def enable_restricted_imports():
 #    builtins.float = ContractingDecimal
 
 
-def disable_restricted_imports():
-    builtins.__import__ = __import__
+def import_contract(name):
+    # Contract modules are kept by the runtime importing them rather than in sys.modules, so runtimes on other threads,
+    # with drivers and environments of their own, never share one
+    runtime = current()
+
+    module = runtime.modules.get(name)
+    if module is not None:
+        return module
+
+    # A contract cannot stand in for a module the process has already imported
+    loaded = sys.modules.get(name)
+    spec = None if loaded is not None and not is_contract_module(loaded) else DatabaseFinder.find_spec(name, None)
+    if spec is None:
+        raise ImportError("module {} cannot be imported in a smart contract.".format(name))
+
+    module = importlib.util.module_from_spec(spec)
+    runtime.modules[name] = module
+    try:
+        spec.loader.exec_module(module)
+    except BaseException:
+        runtime.modules.pop(name, None)
+        raise
+
+    return module
 
 
 def uninstall_builtins():
@@ -53,9 +83,10 @@ def uninstall_builtins():
 
 
 def install_database_loader(driver=ContractDriver()):
-    DatabaseFinder.driver = driver
+    rt.driver = driver
     if DatabaseFinder not in sys.meta_path:
         sys.meta_path.insert(0, DatabaseFinder)
+    enable_restricted_imports()
 
 
 def uninstall_database_loader():
@@ -75,30 +106,107 @@ def install_system_contracts(directory=''):
 
 
 class DatabaseFinder:
+    # Used until install_database_loader gives the runtime a driver
     driver = ContractDriver()
 
     def find_spec(self, fullname, path=None, target=None):
-        if MODULE_CACHE.get(self) is None:
-            if DatabaseFinder.driver.get_contract(self) is None:
-                return None
-        return ModuleSpec(self, DatabaseLoader(DatabaseFinder.driver))
-
-
-MODULE_CACHE = {}
+        runtime = current()
+        driver = runtime.driver if runtime.driver is not None else DatabaseFinder.driver
+
+        # Whatever the import costs from here on is charged to the module importing this one
+        start = runtime.tracer.get_stamp_used()
+
+        if not driver.is_contract(self):
+            return None
+        return ModuleSpec(self, DatabaseLoader(driver, start=start))
+
+
+class ModuleInstance:
+    # An executed contract module and what it takes to hand it to another transaction: the scope its functions use as
+    # globals, the stamps its own body cost and the contracts it imported by name. It lives in the CODE_CACHE entry of
+    # the code it was executed from, so it goes when that code does. Only the runtime that executed it hands it out.
+    def __init__(self, module, scope, cost, imports):
+        self.module = module
+        self.scope = scope
+        self.cost = cost
+        self.imports = imports
+        self.env_keys = set(rt.env)
+        self.runtime = current()
+
+    def usable(self):
+        # Bodies executed without metering have no known cost to charge a metered transaction
+        return self.runtime is current() and (self.cost is not None or not rt.tracer.is_started()) and \
+            unchanged(self.module)
+
+    def reuse(self):
+        namespace = vars(self.module)
+
+        # Rebind what belongs to the transaction: its environment and its driver
+        for key in self.env_keys - set(rt.env):
+            for d in (self.scope, namespace):
+                if key in env.SCOPE:
+                    d[key] = env.SCOPE[key]
+                else:
+                    d.pop(key, None)
+
+        self.scope.update(rt.env)
+        namespace.update(rt.env)
+        self.env_keys = set(rt.env)
+
+        driver = rt.env.get('__Driver')
+        if driver is not None:
+            for value in namespace.values():
+                if isinstance(value, Datum):
+                    value._driver = driver
+
+        # Charge what executing the body would have, and import what it would have imported
+        if self.cost and rt.tracer.is_started():
+            rt.tracer.add_cost(self.cost, 'import')
+
+        for name, fullname in self.imports:
+            self.scope[name] = namespace[name] = import_contract(fullname)
 
 
 class DatabaseLoader(Loader):
-    def __init__(self, d=ContractDriver()):
+    def __init__(self, d=ContractDriver(), start=0):
         self.d = d
+        self.start = start
 
     def create_module(self, spec):
+        name = getattr(spec, 'name', None)
+        entry = CODE_CACHE.peek(self.d.code_key(name)) if name is not None else None
+        if entry is not None and entry.instance is not None and entry.instance.usable():
+            return entry.instance.module
+
         return None
 
     def exec_module(self, module):
+        import_costs = rt.import_costs
+        import_costs.append(0)
+
+        try:
+            entry = CODE_CACHE.peek(self.d.code_key(module.__name__))
+            if entry is not None and entry.instance is not None and entry.instance.module is module:
+                STATS.incr('modules_reused')
+                entry.instance.reuse()
+            else:
+                STATS.incr('modules_executed')
+                self.execute(module)
+        finally:
+            import_costs.pop()
+
+        if import_costs:
+            import_costs[-1] += rt.tracer.get_stamp_used() - self.start
+
+        rt.loaded_modules.append(module.__name__)
+
+    def execute(self, module):
         # fetch the individual contract
-        code = MODULE_CACHE.get(module.__name__)
+        key = self.d.code_key(module.__name__)
+        entry = CODE_CACHE.get(key) if key is not None else None
+        STATS.incr('code_cache_misses' if entry is None else 'code_cache_hits')
 
-        if MODULE_CACHE.get(module.__name__) is None:
+        if entry is None:
             code = self.d.get_compiled(module.__name__)
             if code is None:
                 raise ImportError("Module {} not found".format(module.__name__))
@@ -106,16 +214,13 @@ class DatabaseLoader(Loader):
             if type(code) != bytes:
                 code = bytes.fromhex(code)
 
-            code = marshal.loads(code)
-            MODULE_CACHE[module.__name__] = code
+            entry = CODE_CACHE.set(key, code)
 
-        if code is None:
-            raise ImportError("Module {} not found".format(module.__name__))
+        code = entry.code
 
-        scope = env.gather()
-        scope.update(rt.env)
+        scope = {**env.SCOPE, **rt.env, '__contract__': True, '__name__': module.__name__}
 
-        scope.update({'__contract__': True})
+        body_start = rt.tracer.get_stamp_used()
 
         # execute the module with the std env and update the module to pass forward
         exec(code, scope)
@@ -124,7 +229,128 @@ class DatabaseLoader(Loader):
         vars(module).update(scope)
         del vars(module)['__builtins__']
 
-        rt.loaded_modules.append(module.__name__)
+        # Modules whose body reads the environment or contract state, or leaves mutable state behind, are executed for
+        # every transaction
+        entry.instance = None
+        if entry.reads_state is None:
+            entry.reads_state = reads_state(code, scope)
+        if entry.reads_state or set(code.co_names) & set(rt.env):
+            return
+
+        NAMESPACES[module] = namespace_state(module)
+        if holds_no_state(module):
+            cost = rt.tracer.get_stamp_used() - body_start - rt.import_costs[-1] if rt.tracer.is_started() else None
+            imports = [(name, value.__name__) for name, value in scope.items() if is_contract_module(value)]
+
+            entry.instance = ModuleInstance(module, scope, cost, imports)
 
     def module_repr(self, module):
         return '<module {!r} (smart contract)>'.format(module.__name__)
+
+
+# Values a contract module can hold at the top level without a transaction being able to change them in place
+IMMUTABLE_TYPES = (int, float, str, bytes, bool, type(None), ContractingDecimal, Datetime, Timedelta)
+
+
+def is_immutable(value):
+    if isinstance(value, (tuple, frozenset)):
+        return all(is_immutable(v) for v in value)
+    return isinstance(value, IMMUTABLE_TYPES)
+
+
+def is_contract_module(value):
+    return isinstance(value, ModuleType) and isinstance(getattr(value, '__loader__', None), DatabaseLoader)
+
+
+# Names a module body cannot use without its values depending on state or on the transaction running it
+STATE_NAMES = {'get', 'driver', 'ctx', 'random'}
+
+
+def reads_state(code, scope):
+    # Whether a module body touches a variable, calls a function or contract, or reaches the driver, the context or
+    # the random seed. Comprehensions run as code of their own, so they are looked into as well.
+    if set(code.co_names) & STATE_NAMES:
+        return True
+
+    for instruction in dis.get_instructions(code):
+        if instruction.opname in ('LOAD_NAME', 'LOAD_GLOBAL'):
+            value = scope.get(instruction.argval)
+            if isinstance(value, Datum) or is_contract_module(value) or \
+                    (isinstance(value, FunctionType) and value.__globals__ is scope):
+                return True
+
+    return any(isinstance(const, CodeType) and const.co_name.startswith('<') and reads_state(const, scope)
+               for const in code.co_consts)
+
+
+def holds_no_state(module):
+    for name, value in vars(module).items():
+        if name.startswith('__') and name.endswith('__'):
+            continue
+
+        # The stdlib and the runtime environment are shared with every freshly executed module anyway
+        if env.SCOPE.get(name) is value or rt.env.get(name) is value:
+            continue
+
+        if isinstance(value, FunctionType):
+            if not all(is_immutable(d) for d in value.__defaults__ or ()):
+                return False
+        elif isinstance(value, Datum):
+            if not is_immutable(getattr(value, '_default_value', None)):
+                return False
+        elif not isinstance(value, (type, ModuleType)) and not is_immutable(value):
+            return False
+
+    return True
+
+
+# What each executed contract module's namespace looked like right after its body ran
+NAMESPACES = weakref.WeakKeyDictionary()
+
+
+def namespace_state(module):
+    # Transactions cannot rebind a module's names, but they can set attributes on the variables and functions in it.
+    # The driver is rebound for every transaction, so it is left out.
+    state = {}
+    for name, value in vars(module).items():
+        if isinstance(value, (Datum, FunctionType)) and rt.env.get(name) is not value:
+            state[name] = (value, {k: v for k, v in vars(value).items() if k != '_driver'})
+    return state
+
+
+def unchanged(module):
+    # A module is only handed to another transaction if nothing run so far has added to or replaced what it held
+    state = NAMESPACES.get(module)
+    if state is None:
+        return False
+
+    namespace = vars(module)
+    for name, (value, attrs) in state.items():
+        if namespace.get(name) is not value:
+            return False
+
+        current_attrs = {k: v for k, v in vars(value).items() if k != '_driver'}
+        if current_attrs.keys() != attrs.keys() or any(current_attrs[k] is not v for k, v in attrs.items()):
+            return False
+
+    return True
+
+
+def reusable_modules(names):
+    # A loaded contract can serve the next transaction when executing it again would build the same namespace: it
+    # holds nothing a transaction could have changed, and every contract it imported is kept along with it
+    modules = rt.modules
+    kept = {name for name in names
+            if modules.get(name) is not None and holds_no_state(modules[name]) and unchanged(modules[name])}
+
+    changed = True
+    while changed:
+        changed = False
+        for name in list(kept):
+            for value in vars(modules[name]).values():
+                if is_contract_module(value) and (value.__name__ not in kept or modules.get(value.__name__) is not value):
+                    kept.discard(name)
+                    changed = True
+                    break
+
+    return [name for name in names if name in kept]
@@ -0,0 +1,149 @@
+import multiprocessing
+import os
+import pickle
+from logging import getLogger
+
+from contracting import config
+from contracting.db.driver import LMDBDriver
+from contracting.execution.executor import Executor
+from contracting.execution.stats import STATS
+
+log = getLogger('CONTRACTING')
+
+# The block being speculated on, inherited by forked workers instead of being pickled to them
+_block = None
+
+
+def _init_worker(block):
+    global _block
+    _block = block
+
+
+def _speculate(i):
+    return _block.speculate(i)
+
+
+class BlockExecutor:
+    # Optimistic parallel execution of a block. Every transaction first runs in a forked worker against the state at the
+    # start of the block, then results are committed in block order. A transaction that read nothing written earlier in
+    # the block saw exactly what it would have serially, so its result is kept; any other is executed again on top of
+    # the state committed so far. Outputs and driver state match executing the block one transaction at a time.
+    def __init__(self, executor=None, workers=None, min_parallel=config.PARALLEL_MIN_TXS):
+        self.executor = executor or Executor()
+        self.driver = self.executor.driver
+        self.workers = workers or os.cpu_count() or 1
+        self.min_parallel = min_parallel
+        self.transactions = []
+
+        self.speculated = 0
+        self.reexecuted = 0
+
+    def execute_block(self, transactions: list) -> list:
+        # Each transaction is a dict of Executor.execute arguments plus the 'hlc' it is soft applied under
+        self.transactions = transactions
+
+        try:
+            if not self.parallel():
+                return [self.execute_serial(tx) for tx in transactions]
+
+            with STATS.phase('speculate'):
+                results = self.speculate_all()
+
+            outputs = []
+            written = set()
+            for tx, result in zip(transactions, results):
+                if result is None or self.conflicts(result[0]['reads'], result[1], written):
+                    output = self.execute_serial(tx)
+                    self.reexecuted += 1
+                    STATS.incr('reexecuted')
+                else:
+                    output = self.apply(tx, result[0])
+                    self.speculated += 1
+                    STATS.incr('speculated')
+
+                written.update(output['writes'])
+                outputs.append(output)
+
+            return outputs
+        finally:
+            self.transactions = []
+
+    def parallel(self):
+        # Workers read the snapshot through memory inherited from this process, which needs fork, and they start
+        # from empty pending state
+        return self.workers > 1 and \
+            len(self.transactions) >= max(self.min_parallel, 2) and \
+            'fork' in multiprocessing.get_all_start_methods() and \
+            not self.driver.pending_writes and \
+            self.fork_safe()
+
+    def fork_safe(self):
+        # An LMDB environment must not be used in a forked child, and a transaction that commits on its own would
+        # commit from the worker, so blocks with either run serially
+        if isinstance(self.driver.driver, LMDBDriver):
+            return False
+
+        return not any(tx.get('auto_commit') for tx in self.transactions)
+
+    def speculate_all(self):
+        context = multiprocessing.get_context('fork')
+        processes = min(self.workers, len(self.transactions))
+        chunksize = max(1, len(self.transactions) // (processes * 4))
+
+        with context.Pool(processes, initializer=_init_worker, initargs=(self,)) as pool:
+            results = pool.map(_speculate, range(len(self.transactions)), chunksize=chunksize)
+
+        return [self.load(result) for result in results]
+
+    def speculate(self, i):
+        # Runs in a worker. The result goes back pickled, or as None to have the parent execute it instead.
+        kwargs = dict(self.transactions[i])
+        kwargs.pop('hlc', None)
+
+        try:
+            output = self.executor.execute(driver=self.driver, **kwargs)
+            return pickle.dumps((output, self.driver.pending_scans))
+        except Exception as e:
+            log.debug('Transaction {} not speculated: {}'.format(i, e))
+            return None
+        finally:
+            self.driver.pending_reads = {}
+            self.driver.pending_scans = set()
+            self.driver.pending_writes.clear()
+
+    @staticmethod
+    def load(result):
+        if result is None:
+            return None
+
+        try:
+            return pickle.loads(result)
+        except Exception:
+            return None
+
+    @staticmethod
+    def conflicts(reads, scans, written):
+        if any(key in written for key in reads):
+            return True
+
+        return any(key.startswith(prefix) for prefix in scans for key in written)
+
+    def apply(self, tx, output):
+        # Puts the speculative reads and writes in place as if the transaction had just run here
+        self.driver.pending_reads = output['reads']
+        self.driver.pending_writes.update(output['writes'])
+
+        # Contracts the transaction submitted in its worker are unknown to this process's caches
+        self.driver.forget_contracts(output['writes'])
+        self.driver.soft_apply(tx['hlc'])
+
+        return output
+
+    def execute_serial(self, tx):
+        kwargs = dict(tx)
+        hlc = kwargs.pop('hlc')
+
+        output = self.executor.execute(driver=self.driver, **kwargs)
+        self.driver.soft_apply(hlc)
+
+        return output
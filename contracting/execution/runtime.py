@@ -2,6 +2,8 @@ import sys
 from contracting import config
 import contracting
 import os
+import random
+from contextvars import ContextVar
 from contracting.execution.metering.tracer import Tracer
 
 
@@ -57,78 +59,148 @@ class Context:
         return self._get_state()['submission_name']
 
 
-_context = Context({
-        'this': None,
-        'caller': None,
-        'owner': None,
-        'signer': None,
-        'entry': None,
-        'submission_name': None
-    })
+BASE_STATE = {
+    'this': None,
+    'caller': None,
+    'owner': None,
+    'signer': None,
+    'entry': None,
+    'submission_name': None
+}
 
 WRITE_MAX = 1024 * 64
 
 class Runtime:
+    # Everything a transaction changes while it runs. Each thread has a Runtime of its own, so executors on different
+    # threads run transactions side by side.
     cu_path = contracting.__path__[0]
     cu_path = os.path.join(cu_path, 'execution', 'metering', 'cu_costs.const')
 
     os.environ['CU_COST_FNAME'] = cu_path
 
-    loaded_modules = []
+    def __init__(self):
+        self.loaded_modules = []
+        self.modules = {}                    # Contract modules imported here, kept out of sys.modules
+        self.import_costs = []               # Stamps spent importing other contracts, one entry per module executing
 
-    env = {}
-    stamps = 0
+        self.env = {}
+        self.stamps = 0
 
-    writes = 0
+        self.writes = 0
 
-    tracer = Tracer()
+        self.tracer = Tracer()
 
-    signer = None
+        self.signer = None
 
-    context = _context
+        self.context = Context(dict(BASE_STATE))
 
-    @classmethod
-    def set_up(cls, stmps, meter):
+        self.driver = None                   # Where contracts are imported from, once a loader is installed
+
+        self.random = random.Random()
+        self.seeded = False
+
+    def set_up(self, stmps, meter, profile=False):
         if meter:
-            cls.stamps = stmps
-            cls.tracer.set_stamp(stmps)
-            cls.tracer.start()
+            self.stamps = stmps
+            self.tracer.set_stamp(stmps)
+            self.tracer.set_mem_limit(config.TX_MEMORY_LIMIT)
+            if profile:
+                self.tracer.enable_profile()
+            self.tracer.start()
+
+        self.context._reset()
+
+    def clean_up(self, keep=()):
+        self.tracer.stop()
+        self.tracer.reset()
+        self.stamps = 0
+        self.writes = 0
+
+        self.signer = None
+
+        # Modules in keep stay imported for the next transaction. Those imported through sys.meta_path instead of by
+        # the runtime are in sys.modules.
+        for mod in self.loaded_modules:
+            if mod not in keep:
+                self.modules.pop(mod, None)
+                if sys.modules.get(mod) is not None:
+                    del sys.modules[mod]
+
+        self.loaded_modules = [mod for mod in self.loaded_modules if mod in keep]
+        self.env = {}
+
+    def deduct_read(self, key, value):
+        self.deduct_read_size(len(key) + len(value))
+
+    def deduct_read_size(self, size):
+        if self.tracer.is_started():
+            cost = size * config.READ_COST_PER_BYTE
+            self.tracer.add_cost(cost, 'read')
+
+    def deduct_write(self, key, value):
+        if key is not None and self.tracer.is_started():
+            cost = len(key) + len(value)
+            self.writes += cost
+
+            assert self.writes < WRITE_MAX, 'You have exceeded the maximum write capacity per transaction!'
 
-        cls.context._reset()
+            stamp_cost = cost * config.WRITE_COST_PER_BYTE
+            self.tracer.add_cost(stamp_cost, 'write')
 
-    @classmethod
-    def clean_up(cls):
-        cls.tracer.stop()
-        cls.tracer.reset()
-        cls.stamps = 0
-        cls.writes = 0
+    def profile(self):
+        # The cost of the transaction so far by contract, function and line, most expensive first. Costs are in tracer
+        # units, 1000 to a stamp: execution is opcodes run, read and write are state access, and import is the body of
+        # a contract module that was already loaded and charged again instead of run.
+        profile = self.tracer.get_profile()
+        if profile is None:
+            return None
 
-        cls.signer = None
+        lines = {}
+        for (contract, function, line, kind), cost in profile.items():
+            kind = kind or 'other'
+            entry = lines.setdefault((contract, function, line), {
+                'contract': contract, 'function': function, 'line': line,
+                'execution': 0, 'read': 0, 'write': 0, 'import': 0, 'total': 0
+            })
+            entry[kind] = entry.get(kind, 0) + cost
+            entry['total'] += cost
 
-        for mod in cls.loaded_modules:
-            if sys.modules.get(mod) is not None:
-                del sys.modules[mod]
+        return sorted(lines.values(), key=lambda e: (-e['total'], str(e['contract']), str(e['function']), e['line']))
 
-        cls.loaded_modules = []
-        cls.env = {}
 
-    @classmethod
-    def deduct_read(cls, key, value):
-        if cls.tracer.is_started():
-            cost = len(key) + len(value)
-            cost *= config.READ_COST_PER_BYTE
-            cls.tracer.add_cost(cost)
+_runtime = ContextVar('runtime', default=None)
 
-    @classmethod
-    def deduct_write(cls, key, value):
-        if key is not None and cls.tracer.is_started():
-            cost = len(key) + len(value)
-            cls.writes += cost
 
-            assert cls.writes < WRITE_MAX, 'You have exceeded the maximum write capacity per transaction!'
+def current():
+    # A thread starts with an empty context, so it gets its own Runtime the first time it asks for one
+    runtime = _runtime.get()
+    if runtime is None:
+        runtime = Runtime()
+        _runtime.set(runtime)
+    return runtime
+
+
+class CurrentRuntime:
+    # Stands for the Runtime of whichever thread uses it, so modules can share one rt
+    __slots__ = ()
+
+    def __getattr__(self, name):
+        return getattr(current(), name)
+
+    def __setattr__(self, name, value):
+        setattr(current(), name, value)
+
+
+class CurrentContext:
+    # ctx in the scope of every contract, standing for the context of the Runtime running it
+    __slots__ = ()
+
+    def __getattr__(self, name):
+        return getattr(current().context, name)
 
-            stamp_cost = cost * config.WRITE_COST_PER_BYTE
-            cls.tracer.add_cost(stamp_cost)
 
+rt = CurrentRuntime()
+ctx = CurrentContext()
 
-rt = Runtime()
+# Contexts copied from this one, as asyncio tasks are, share its Runtime
+current()
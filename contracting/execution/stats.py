@@ -0,0 +1,127 @@
+import os
+import threading
+import time
+
+
+class Phase:
+    # Times one pass through a block of code into its Stats
+    __slots__ = ('stats', 'name', 'wall', 'cpu')
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        return self
+
+    def __exit__(self, *args):
+        wall = time.perf_counter() - self.wall
+        cpu = time.process_time() - self.cpu
+
+        with self.stats.lock:
+            timer = self.stats.timers.get(self.name)
+            if timer is None:
+                timer = self.stats.timers[self.name] = [0, 0.0, 0.0]
+
+            timer[0] += 1
+            timer[1] += wall
+            timer[2] += cpu
+
+
+class NoPhase:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+NO_PHASE = NoPhase()
+
+
+class Stats:
+    # Wall clock and CPU time of each execution phase, and counters of cache and driver use. Disabled by default, so
+    # instrumented code pays only a flag check. Totals add up until collect() or reset(), so collecting after each block
+    # gives per block figures. Work done in forked workers is not included. Threads running contracts share one Stats,
+    # so totals are updated under a lock.
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.timers = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def phase(self, name):
+        return Phase(self, name) if self.enabled else NO_PHASE
+
+    def incr(self, name, n=1):
+        if self.enabled:
+            with self.lock:
+                self.counters[name] = self.counters.get(name, 0) + n
+
+    def reset(self):
+        with self.lock:
+            self.timers = {}
+            self.counters = {}
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'phases': {name: {'count': count, 'wall': wall, 'cpu': cpu}
+                           for name, (count, wall, cpu) in self.timers.items()},
+                'counters': dict(self.counters)
+            }
+
+    def collect(self):
+        # Taken in one go, so nothing counted in between is lost
+        with self.lock:
+            timers, counters = self.timers, self.counters
+            self.timers = {}
+            self.counters = {}
+
+        return {
+            'phases': {name: {'count': count, 'wall': wall, 'cpu': cpu}
+                       for name, (count, wall, cpu) in timers.items()},
+            'counters': counters
+        }
+
+    def prometheus(self, prefix='contracting'):
+        # Text exposition format, with phases as labels of three metric families
+        lines = []
+        snapshot = self.snapshot()
+
+        families = (
+            ('phase_count', 'counter', 'Times each execution phase ran', 'count'),
+            ('phase_wall_seconds', 'counter', 'Wall clock seconds spent in each execution phase', 'wall'),
+            ('phase_cpu_seconds', 'counter', 'CPU seconds spent in each execution phase', 'cpu'),
+        )
+        for metric, kind, help_text, field in families:
+            lines.append('# HELP {}_{} {}'.format(prefix, metric, help_text))
+            lines.append('# TYPE {}_{} {}'.format(prefix, metric, kind))
+            for name, phase in sorted(snapshot['phases'].items()):
+                lines.append('{}_{}{{phase="{}"}} {}'.format(prefix, metric, name, phase[field]))
+
+        for name, value in sorted(snapshot['counters'].items()):
+            lines.append('# TYPE {}_{}_total counter'.format(prefix, name))
+            lines.append('{}_{}_total {}'.format(prefix, name, value))
+
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path, prefix='contracting'):
+        # For the node exporter textfile collector, which must never see a half written file
+        tmp = '{}.tmp'.format(path)
+        with open(tmp, 'w') as f:
+            f.write(self.prometheus(prefix))
+        os.replace(tmp, path)
+
+
+STATS = Stats()
@@ -1,4 +1,4 @@
-from contracting.execution.runtime import rt
+from contracting.execution.runtime import rt, ctx
 from contextlib import ContextDecorator
 from contracting.db.driver import ContractDriver
 from typing import Any
@@ -33,7 +33,7 @@ class __export(ContextDecorator):
 
 exports = {
     '__export': __export,
-    'ctx': rt.context,
+    'ctx': ctx,
     'rt': rt,
     'Any': Any
 }
@@ -1,4 +1,3 @@
-import importlib
 from types import FunctionType, ModuleType
 from contracting.config import PRIVATE_METHOD_PREFIX
 from contracting.db.orm import Datum
@@ -56,10 +55,13 @@ def import_module(name):
     if name.startswith('_'):
         raise ImportError
 
-    if _driver.get_contract(name) is None:
+    # An unmetered lookup in the driver's contract index, like the one the import system makes
+    if not _driver.is_contract(name):
         raise ImportError
 
-    m = importlib.import_module(name, package=None)
+    # The module system imports this stdlib to build contract scopes, so it is only imported once a contract runs
+    from contracting.execution.module import import_contract
+    m = import_contract(name)
 
     return m
 
@@ -5,6 +5,7 @@ from contracting.stdlib.bridge.random import exports as random_exports
 from contracting.stdlib.bridge.imports import exports as imports_exports
 from contracting.stdlib.bridge.access import exports as access_exports
 from contracting.stdlib.bridge.decimal import exports as decimal_exports
+from types import MappingProxyType
 
 # TODO create a module instead and return it inside of a dictionary like:
 # {
@@ -14,7 +15,7 @@ from contracting.stdlib.bridge.decimal import exports as decimal_exports
 # Then stdlib.datetime becomes available, etc
 
 
-def gather():
+def build():
     env = {}
 
     env.update(orm_exports)
@@ -26,3 +27,11 @@ def gather():
     env.update(decimal_exports)
 
     return env
+
+
+# Every contract gets the same stdlib, so it is merged once and each exec starts from a copy
+SCOPE = MappingProxyType(build())
+
+
+def gather():
+    return dict(SCOPE)
@@ -16,6 +16,8 @@ requirements = [
     'autopep8==1.5.7',
     "stdlib_list==0.8.0",
     'motor==2.5.1',
+    'lmdb==1.3.0',
+    'msgpack==1.0.4',
     'iso8601'
 ]
 
@@ -0,0 +1,285 @@
+from unittest import TestCase
+from unittest import mock
+import threading
+from contracting.db.driver import ContractDriver
+from contracting.execution.executor import Executor
+from contracting.execution import module
+from contracting.execution.stats import STATS
+import contracting
+
+
+def submission_kwargs_for_file(f):
+    # Get the file name only by splitting off directories
+    split = f.split('/')
+    split = split[-1]
+
+    # Now split off the .s
+    split = split.split('.')
+    contract_name = split[0]
+
+    with open(f) as file:
+        contract_code = file.read()
+
+    return {
+        'name': contract_name,
+        'code': contract_code,
+    }
+
+
+TEST_SUBMISSION_KWARGS = {
+    'sender': 'stu',
+    'contract_name': 'submission',
+    'function_name': 'submit_contract'
+}
+
+STATEFUL = '''
+seen = []
+
+@export
+def add(x: int):
+    seen.append(x)
+    return len(seen)
+'''
+
+ATTRIBUTES = '''
+v = Variable()
+
+def helper():
+    pass
+
+@export
+def mark(first: bool):
+    if first:
+        v.seen = 1
+        helper.seen = 2
+    return [v.seen, helper.seen]
+'''
+
+SNAPSHOT = '''
+v = Variable()
+snapshot = v.get()
+
+@export
+def put(x: int):
+    v.set(x)
+
+@export
+def read():
+    return snapshot
+'''
+
+LISTS = '''
+items = Variable()
+
+@export
+def push(x: int):
+    l = items.get() or []
+    l.append(x)
+    items.set(l)
+'''
+
+
+def transfer(sender, to, amount):
+    return {
+        'sender': sender,
+        'contract_name': 'currency',
+        'function_name': 'transfer',
+        'kwargs': {'amount': amount, 'to': to},
+        'stamps': 1000
+    }
+
+
+class TestExecuteBatch(TestCase):
+    def setUp(self):
+        self.d = ContractDriver()
+        self.d.flush()
+
+        with open(contracting.__path__[0] + '/contracts/submission.s.py') as f:
+            contract = f.read()
+
+        self.d.set_contract(name='submission', code=contract)
+        self.d.commit()
+
+        self.e = Executor(driver=self.d)
+        self.e.execute(**TEST_SUBMISSION_KWARGS,
+                       kwargs=submission_kwargs_for_file('./test_contracts/currency.s.py'), metering=False, auto_commit=True)
+
+        self.d.set('currency.balances:colin', 1000)
+        self.d.commit()
+
+    def tearDown(self):
+        self.d.flush()
+
+    def txs(self):
+        return [
+            transfer('stu', 'colin', 10),
+            transfer('colin', 'raghu', 500),
+            transfer('raghu', 'stu', 5000),
+            transfer('colin', 'stu', 20),
+        ]
+
+    def test_batch_matches_sequential_execution(self):
+        # Load the compiled contract once so neither run pays for reading it
+        self.e.execute(**transfer('stu', 'colin', 1))
+        self.d.rollback()
+
+        sequential = [self.e.execute(**tx) for tx in self.txs()]
+        sequential_writes = dict(self.d.pending_writes)
+        self.d.rollback()
+
+        batch = self.e.execute_batch(self.txs())
+
+        self.assertEqual([(o['status_code'], str(o['result']), o['stamps_used']) for o in batch['outputs']],
+                         [(o['status_code'], str(o['result']), o['stamps_used']) for o in sequential])
+        self.assertEqual(batch['writes'], sequential_writes)
+        self.assertEqual(self.d.pending_writes, sequential_writes)
+
+    def test_outputs_hold_only_their_own_writes(self):
+        outputs = self.e.execute_batch(self.txs(), metering=False)['outputs']
+
+        self.assertEqual(outputs[0]['writes'], {'currency.balances:stu': 999990, 'currency.balances:colin': 1010})
+        self.assertEqual(outputs[1]['writes'], {'currency.balances:colin': 510, 'currency.balances:raghu': 500})
+        self.assertEqual(outputs[2]['writes'], {})
+
+    def test_outputs_hold_only_their_own_reads(self):
+        outputs = self.e.execute_batch(self.txs(), metering=False)['outputs']
+
+        self.assertEqual(outputs[0]['reads']['currency.balances:stu'], 1000000)
+        self.assertEqual(outputs[0]['reads']['currency.balances:colin'], 1000)
+
+        # Keys read by an earlier transaction are still reads of the later ones
+        self.assertEqual(outputs[1]['reads']['currency.balances:colin'], 1010)
+        self.assertEqual(outputs[1]['reads']['currency.balances:raghu'], None)
+        self.assertEqual(outputs[2]['reads']['currency.balances:raghu'], 500)
+        self.assertEqual(outputs[3]['reads']['currency.balances:colin'], 510)
+        self.assertEqual(outputs[3]['reads']['currency.balances:stu'], 999990)
+        self.assertNotIn('currency.balances:raghu', outputs[3]['reads'])
+
+        self.assertEqual(self.d.pending_reads['currency.balances:colin'], 1000)
+
+    def test_unmetered_batch_executes_module_once(self):
+        module.CODE_CACHE.clear()
+
+        with mock.patch.object(module, 'exec', create=True, side_effect=exec) as executed:
+            self.e.execute_batch(self.txs(), metering=False)
+
+        self.assertEqual(executed.call_count, 1)
+
+    def test_metered_batch_executes_module_once(self):
+        module.CODE_CACHE.clear()
+
+        with mock.patch.object(module, 'exec', create=True, side_effect=exec) as executed:
+            self.e.execute_batch(self.txs())
+
+        self.assertEqual(executed.call_count, 1)
+
+    def test_modules_with_mutable_state_are_not_kept(self):
+        self.e.execute(**TEST_SUBMISSION_KWARGS, kwargs={'name': 'stateful', 'code': STATEFUL}, metering=False)
+
+        tx = {'sender': 'stu', 'contract_name': 'stateful', 'function_name': 'add', 'kwargs': {'x': 1}}
+        outputs = self.e.execute_batch([tx, tx, tx], metering=False)['outputs']
+
+        self.assertEqual([o['result'] for o in outputs], [1, 1, 1])
+
+    def test_attributes_set_by_a_transaction_are_not_kept(self):
+        self.e.execute(**TEST_SUBMISSION_KWARGS, kwargs={'name': 'attributes', 'code': ATTRIBUTES}, metering=False)
+
+        first = {'sender': 'stu', 'contract_name': 'attributes', 'function_name': 'mark', 'kwargs': {'first': True}}
+        second = {'sender': 'stu', 'contract_name': 'attributes', 'function_name': 'mark', 'kwargs': {'first': False}}
+
+        outputs = self.e.execute_batch([first, second], metering=False)['outputs']
+        self.assertEqual(outputs[0]['result'], [1, 2])
+        self.assertEqual(outputs[1]['status_code'], 1)
+
+        self.assertEqual(self.e.execute(**first, metering=False)['result'], [1, 2])
+        self.assertEqual(self.e.execute(**second, metering=False)['status_code'], 1)
+
+    def test_state_read_by_module_body_is_read_again(self):
+        self.e.execute(**TEST_SUBMISSION_KWARGS, kwargs={'name': 'snapshot', 'code': SNAPSHOT}, metering=False,
+                       auto_commit=True)
+
+        read = {'sender': 'stu', 'contract_name': 'snapshot', 'function_name': 'read', 'kwargs': {}, 'metering': False}
+        self.assertIsNone(self.e.execute(**read)['result'])
+
+        self.e.execute('stu', 'snapshot', 'put', kwargs={'x': 5}, metering=False, auto_commit=True)
+
+        self.assertEqual(self.e.execute(**read)['result'], 5)
+        self.assertEqual(self.e.execute_batch([read, read], metering=False)['outputs'][1]['result'], 5)
+
+    def test_stats_cover_every_phase_of_a_batch(self):
+        STATS.reset()
+        STATS.enable()
+        try:
+            self.e.execute_batch(self.txs())
+            stats = STATS.collect()
+        finally:
+            STATS.disable()
+
+        for phase in ('balance', 'owner', 'import', 'run', 'deduct', 'writes'):
+            self.assertEqual(stats['phases'][phase]['count'], 4)
+        self.assertEqual(stats['counters']['transactions'], 4)
+        self.assertEqual(stats['counters']['modules_executed'] + stats['counters'].get('modules_reused', 0), 4)
+        self.assertGreater(stats['counters']['pending_hits'], 0)
+        self.assertEqual(STATS.snapshot(), {'phases': {}, 'counters': {}})
+
+    def test_later_transactions_do_not_change_earlier_writes(self):
+        self.e.execute(**TEST_SUBMISSION_KWARGS, kwargs={'name': 'lists', 'code': LISTS}, metering=False)
+
+        tx = {'sender': 'stu', 'contract_name': 'lists', 'function_name': 'push'}
+        first = self.e.execute(**tx, kwargs={'x': 1}, metering=False)
+        self.e.execute(**tx, kwargs={'x': 2}, metering=False)
+        batch = self.e.execute_batch([dict(tx, kwargs={'x': 3}), dict(tx, kwargs={'x': 4})], metering=False)
+
+        self.assertEqual(first['writes']['lists.items'], [1])
+        self.assertEqual([o['writes']['lists.items'] for o in batch['outputs']], [[1, 2, 3], [1, 2, 3, 4]])
+        self.assertEqual(self.d.get('lists.items'), [1, 2, 3, 4])
+
+    def test_batch_from_one_sender_matches_sequential_execution(self):
+        self.e.execute(**TEST_SUBMISSION_KWARGS, kwargs={'name': 'lists', 'code': LISTS}, metering=False)
+        self.d.commit()
+
+        txs = [{'sender': 'stu', 'contract_name': 'lists', 'function_name': 'push', 'kwargs': {'x': x}, 'stamps': 1000}
+               for x in range(3)]
+
+        # Load the compiled contract once so neither run pays for reading it
+        self.e.execute(**txs[0])
+        self.d.rollback()
+
+        sequential = [self.e.execute(**tx) for tx in txs]
+        sequential_writes = dict(self.d.pending_writes)
+        self.d.rollback()
+
+        batch = self.e.execute_batch(txs)
+
+        self.assertEqual([o['stamps_used'] for o in batch['outputs']], [o['stamps_used'] for o in sequential])
+        self.assertEqual([o['writes'] for o in batch['outputs']], [o['writes'] for o in sequential])
+        self.assertEqual(batch['writes'], sequential_writes)
+
+    def test_executors_on_separate_threads_run_side_by_side(self):
+        txs = self.txs() * 5
+
+        # Load the compiled contract once so no run pays for reading it
+        self.e.execute(**transfer('stu', 'colin', 1))
+        self.d.rollback()
+
+        expected = self.e.execute_batch(txs)
+        self.d.rollback()
+
+        barrier = threading.Barrier(2)
+        results = []
+
+        def run():
+            executor = Executor(driver=ContractDriver())
+            barrier.wait()
+            results.append(executor.execute_batch(txs))
+
+        threads = [threading.Thread(target=run) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for batch in results:
+            self.assertEqual([(o['status_code'], str(o['result']), o['stamps_used'], o['writes']) for o in batch['outputs']],
+                             [(o['status_code'], str(o['result']), o['stamps_used'], o['writes']) for o in expected['outputs']])
+            self.assertEqual(batch['writes'], expected['writes'])
@@ -0,0 +1,198 @@
+import shutil
+import tempfile
+from unittest import TestCase
+from contracting.db.driver import ContractDriver, LMDBDriver
+from contracting.execution.executor import Executor
+from contracting.execution.parallel import BlockExecutor
+import contracting
+
+
+def submission_kwargs_for_file(f):
+    # Get the file name only by splitting off directories
+    split = f.split('/')
+    split = split[-1]
+
+    # Now split off the .s
+    split = split.split('.')
+    contract_name = split[0]
+
+    with open(f) as file:
+        contract_code = file.read()
+
+    return {
+        'name': contract_name,
+        'code': contract_code,
+    }
+
+
+TEST_SUBMISSION_KWARGS = {
+    'sender': 'stu',
+    'contract_name': 'submission',
+    'function_name': 'submit_contract'
+}
+
+
+FRESH = '''
+@export
+def answer():
+    return 42
+'''
+
+
+IMPORTER = '''
+import fresh
+
+@export
+def call():
+    return fresh.answer()
+'''
+
+
+def transfer(i, sender, to, amount):
+    return {
+        'hlc': '{:04d}'.format(i),
+        'sender': sender,
+        'contract_name': 'currency',
+        'function_name': 'transfer',
+        'kwargs': {'amount': amount, 'to': to},
+        'stamps': 1000
+    }
+
+
+class TestBlockExecutor(TestCase):
+    def setUp(self):
+        self.d = ContractDriver()
+        self.d.flush()
+
+        with open(contracting.__path__[0] + '/contracts/submission.s.py') as f:
+            contract = f.read()
+
+        self.d.set_contract(name='submission', code=contract)
+        self.d.commit()
+
+        self.e = Executor(driver=self.d)
+        self.e.execute(**TEST_SUBMISSION_KWARGS,
+                       kwargs=submission_kwargs_for_file('./test_contracts/currency.s.py'), metering=False, auto_commit=True)
+
+        for i in range(8):
+            self.d.set('currency.balances:a{}'.format(i), 1000)
+        self.d.commit()
+
+    def tearDown(self):
+        self.d.flush()
+
+    def block(self):
+        return [
+            transfer(0, 'a0', 'b0', 10),
+            transfer(1, 'a1', 'b1', 10),
+            transfer(2, 'a2', 'a3', 500),   # a3 is sent to before it sends
+            transfer(3, 'a3', 'b3', 1200),  # only affordable after the transfer above
+            transfer(4, 'a4', 'b4', 5000),  # fails
+            transfer(5, 'a5', 'b5', 10),
+            transfer(6, 'a5', 'b6', 10),    # same sender twice
+            transfer(7, 'a7', 'b7', 10),
+            transfer(8, 'a6', 'b0', 10),    # same recipient as the first
+        ]
+
+    def run_block(self, workers):
+        block = BlockExecutor(self.e, workers=workers, min_parallel=2)
+        outputs = block.execute_block(self.block())
+
+        outputs = [(o['status_code'], str(o['result']), o['stamps_used'], o['writes'], o['reads']) for o in outputs]
+        deltas = self.d.pending_deltas.copy()
+        state = {key: self.d.get(key) for key in self.d.keys('currency.balances')}
+        self.d.rollback()
+
+        return block, outputs, deltas, state
+
+    def test_parallel_matches_serial(self):
+        # Load the compiled contract once so neither run pays for reading it
+        self.e.execute(**{k: v for k, v in transfer(0, 'a0', 'b0', 1).items() if k != 'hlc'})
+        self.d.rollback()
+
+        _, serial, serial_deltas, serial_state = self.run_block(workers=1)
+        block, parallel, parallel_deltas, parallel_state = self.run_block(workers=4)
+
+        self.assertEqual(parallel, serial)
+        self.assertEqual(parallel_deltas, serial_deltas)
+        self.assertEqual(parallel_state, serial_state)
+
+        self.assertEqual(serial_state['currency.balances:b3'], 1200)
+        self.assertEqual(serial[4][0], 1)
+
+    def test_only_conflicting_transactions_are_reexecuted(self):
+        block, _, _, _ = self.run_block(workers=4)
+
+        # a3 sending, a5 sending again and b0 receiving again
+        self.assertEqual(block.reexecuted, 3)
+        self.assertEqual(block.speculated, 6)
+
+    def test_contract_submitted_in_the_block_can_be_imported_after(self):
+        submit = {
+            'hlc': '0000',
+            'sender': 'stu',
+            'contract_name': 'submission',
+            'function_name': 'submit_contract',
+            'kwargs': {'name': 'fresh', 'code': FRESH},
+            'stamps': 1000
+        }
+        submit_importer = {
+            'hlc': '0001',
+            'sender': 'a0',
+            'contract_name': 'submission',
+            'function_name': 'submit_contract',
+            'kwargs': {'name': 'importer', 'code': IMPORTER},
+            'stamps': 1000
+        }
+
+        block = BlockExecutor(self.e, workers=4, min_parallel=2)
+        outputs = block.execute_block([submit, submit_importer])
+
+        self.assertEqual(outputs[1]['status_code'], 0)
+        self.assertEqual(block.reexecuted, 1)
+
+    def test_small_blocks_run_serially(self):
+        block = BlockExecutor(self.e, workers=4)
+        block.execute_block(self.block()[:2])
+
+        self.assertEqual(block.speculated, 0)
+        self.assertEqual(block.reexecuted, 0)
+        self.assertEqual(self.d.get('currency.balances:b1'), 10)
+
+    def test_prefix_listing_conflicts_with_new_keys(self):
+        self.assertTrue(BlockExecutor.conflicts({}, {'currency.balances'}, {'currency.balances:new'}))
+        self.assertFalse(BlockExecutor.conflicts({'currency.balances:a0': 1}, {'other.'}, {'currency.balances:new'}))
+
+    def test_auto_commit_blocks_run_serially(self):
+        transactions = self.block()[:4]
+        for tx in transactions:
+            tx['auto_commit'] = True
+
+        block = BlockExecutor(self.e, workers=4, min_parallel=2)
+        outputs = block.execute_block(transactions)
+
+        self.assertEqual(block.speculated, 0)
+        self.assertEqual(block.reexecuted, 0)
+        self.assertEqual(outputs[3]['status_code'], 0)
+
+        # Committed by this process, not by a worker
+        self.d.rollback()
+        self.assertEqual(self.d.get('currency.balances:b3'), 1200)
+
+    def test_lmdb_blocks_run_serially(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+
+        driver = ContractDriver(driver=LMDBDriver(root=root))
+        driver.set_contract(name='currency', code=self.d.get_contract('currency'))
+        for i in range(8):
+            driver.set('currency.balances:a{}'.format(i), 1000)
+        driver.commit()
+
+        block = BlockExecutor(Executor(driver=driver), workers=4, min_parallel=2)
+        outputs = block.execute_block(self.block())
+
+        self.assertEqual(block.speculated, 0)
+        self.assertEqual(block.reexecuted, 0)
+        self.assertEqual(outputs[3]['status_code'], 0)
+        self.assertEqual(driver.get('currency.balances:b3'), 1200)
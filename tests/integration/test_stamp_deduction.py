@@ -3,6 +3,7 @@ from contracting.db.driver import ContractDriver
 from contracting.execution.executor import Executor
 from contracting.config import STAMPS_PER_TAU
 from contracting.execution import runtime
+from contracting.execution import module
 import contracting
 
 def submission_kwargs_for_file(f):
@@ -60,6 +61,25 @@ class TestMetering(TestCase):
 
         self.assertEqual(float(prior_balance - new_balance - 100), output['stamps_used'] / STAMPS_PER_TAU)
 
+    def test_reused_module_costs_the_same_as_executing_it(self):
+        for name in ('import_this', 'importing_that'):
+            self.e.execute(**TEST_SUBMISSION_KWARGS,
+                           kwargs=submission_kwargs_for_file('./test_contracts/{}.s.py'.format(name)), metering=False,
+                           auto_commit=True)
+
+        # Compile and cache the code first, so only executing the modules differs between the runs
+        self.e.execute('stu', 'importing_that', 'test', kwargs={})
+        for name in ('import_this', 'importing_that'):
+            module.CODE_CACHE.peek(self.d.code_key(name)).instance = None
+
+        executed = self.e.execute('stu', 'importing_that', 'test', kwargs={})
+        self.assertIsNotNone(module.CODE_CACHE.peek(self.d.code_key('importing_that')).instance)
+
+        reused = self.e.execute('stu', 'importing_that', 'test', kwargs={})
+
+        self.assertEqual(reused['result'], 11345)
+        self.assertEqual(reused['stamps_used'], executed['stamps_used'])
+
     def test_too_few_stamps_fails_and_deducts_properly(self):
         prior_balance = self.d.get('currency.balances:stu')
 
@@ -127,3 +147,32 @@ class TestMetering(TestCase):
                                 )
         self.assertNotEquals(self.e.driver.pending_writes['currency.balances:stu'], prior_balance)
 
+
+    def test_profile_accounts_for_every_stamp(self):
+        output = self.e.execute('stu', 'currency', 'transfer', kwargs={'amount': 100, 'to': 'colin'}, profile=True)
+
+        profile = output['profile']
+        total = sum(line['total'] for line in profile)
+
+        self.assertEqual(total // 1000 + 1, output['stamps_used'])
+        self.assertEqual(profile, sorted(profile, key=lambda line: -line['total']))
+
+        transfer = [line for line in profile if line['contract'] == 'currency' and line['function'] == 'transfer']
+        self.assertGreater(sum(line['execution'] for line in transfer), 0)
+        self.assertGreater(sum(line['read'] for line in transfer), 0)
+        self.assertGreater(sum(line['write'] for line in transfer), 0)
+
+    def test_profile_does_not_change_stamps_used(self):
+        self.e.execute('stu', 'currency', 'transfer', kwargs={'amount': 100, 'to': 'colin'})
+
+        plain = self.e.execute('stu', 'currency', 'transfer', kwargs={'amount': 100, 'to': 'colin'})
+        profiled = self.e.execute('stu', 'currency', 'transfer', kwargs={'amount': 100, 'to': 'colin'}, profile=True)
+
+        self.assertNotIn('profile', plain)
+        self.assertEqual(plain['stamps_used'], profiled['stamps_used'])
+
+    def test_unmetered_profile_is_none(self):
+        output = self.e.execute('stu', 'currency', 'transfer', kwargs={'amount': 100, 'to': 'colin'}, metering=False,
+                                profile=True)
+
+        self.assertIsNone(output['profile'])
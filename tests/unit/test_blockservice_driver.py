@@ -47,6 +47,17 @@ class TestBlockserviceDriver(TestCase):
 
             self.assertEqual(v, b) if not isinstance(v, dict) else self.assertDictEqual(v, b)
 
+    def test_get_many(self):
+        for i, v in enumerate(TEST_DATA):
+            self.dbset(str(i), v)
+
+        values = self.d.get_many([str(i) for i in range(len(TEST_DATA))] + ['missing'])
+
+        for i, v in enumerate(TEST_DATA):
+            self.assertEqual(v, values[str(i)]) if not isinstance(v, dict) else self.assertDictEqual(v, values[str(i)])
+
+        self.assertIsNone(values['missing'])
+
     def test_iter(self):
 
         prefix_1_keys = [
@@ -1,5 +1,6 @@
 from unittest import TestCase
-from contracting.db.encoder import encode, decode, safe_repr, convert_dict, MONGO_MAX_INT, MONGO_MIN_INT
+from contracting.db.encoder import encode, decode, safe_repr, convert_dict, MONGO_MAX_INT, MONGO_MIN_INT, \
+    encode_binary, BINARY_PREFIX
 from contracting.stdlib.bridge.time import Datetime, Timedelta
 from datetime import datetime
 from contracting.stdlib.bridge.decimal import ContractingDecimal
@@ -340,3 +341,42 @@ class TestEncode(TestCase):
         d2 = convert_dict(d)
 
         self.assertEqual(expected, d2)
+
+
+class TestBinaryEncode(TestCase):
+    def assert_same_as_json(self, value):
+        decoded = decode(encode_binary(value))
+        # ContractingDecimal and friends compare by value but repr by address, so compare through the JSON encoding
+        self.assertEqual(encode(decoded), encode(decode(encode(value))))
+        self.assertEqual(type(decoded), type(decode(encode(value))))
+
+    def test_binary_has_versioned_prefix(self):
+        self.assertTrue(encode_binary(1).startswith(BINARY_PREFIX))
+
+    def test_scalars_round_trip(self):
+        for value in [0, -1, 1000, 'hello', '', None, True, False, 1.098409840984, b'\x00beef']:
+            self.assert_same_as_json(value)
+
+    def test_big_ints_round_trip(self):
+        for value in [MONGO_MAX_INT + 1, MONGO_MIN_INT - 1, 2 ** 200, [2 ** 100, {'a': -2 ** 100}]]:
+            self.assert_same_as_json(value)
+
+    def test_tagged_types_round_trip(self):
+        self.assert_same_as_json(ContractingDecimal('1.2345'))
+        self.assert_same_as_json(Datetime(2022, 1, 2, 3, 4, 5, 6))
+        self.assert_same_as_json(Timedelta(weeks=1, days=1, hours=1))
+        self.assert_same_as_json({'a': ContractingDecimal('0.1'), 'b': [Datetime(2022, 1, 1), b'ab']})
+
+    def test_dicts_decode_like_json(self):
+        self.assertDictEqual(decode(encode_binary({1: 'a', None: 'b', 2.5: 'c'})), {'1': 'a', 'null': 'b', '2.5': 'c'})
+        self.assertListEqual(decode(encode_binary((1, (2, 3)))), [1, [2, 3]])
+        self.assertIsInstance(decode(encode_binary({'__fixed__': '1.5'})), ContractingDecimal)
+
+    def test_unsupported_version_raises(self):
+        with self.assertRaises(ValueError):
+            decode(b'\x00\xff' + encode_binary(1)[2:])
+
+    def test_unserializable_raises_like_json(self):
+        with self.assertRaises(TypeError):
+            encode_binary({1, 2})
+
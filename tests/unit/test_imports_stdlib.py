@@ -2,6 +2,8 @@ from unittest import TestCase
 from contracting.stdlib.bridge import imports
 from types import ModuleType
 from contracting.db.orm import Hash, Variable
+from contracting.execution.runtime import rt
+from unittest import mock
 
 
 class TestImports(TestCase):
@@ -164,4 +166,17 @@ class TestImports(TestCase):
             imports.Var('balances', Hash)
         ]
 
-        self.assertTrue(imports.enforce_interface(self.module, interface))
\ No newline at end of file
+        self.assertTrue(imports.enforce_interface(self.module, interface))
+    def test_import_module_checks_the_contract_index(self):
+        driver = mock.Mock()
+        driver.is_contract.return_value = False
+        rt.env['__Driver'] = driver
+
+        try:
+            with self.assertRaises(ImportError):
+                imports.import_module('missing')
+        finally:
+            rt.env.pop('__Driver')
+
+        driver.is_contract.assert_called_once_with('missing')
+        driver.get_contract.assert_not_called()
@@ -1,6 +1,8 @@
 from unittest import TestCase
 from contracting.execution.module import *
 import types
+import marshal
+from contracting.db.driver import CodeCache
 import glob
 
 
@@ -67,6 +69,155 @@ class TestDatabaseLoader(TestCase):
         self.assertEqual(self.dl.module_repr(module), "<module 'howdy' (smart contract)>")
 
 
+class TestModuleInstances(TestCase):
+    def setUp(self):
+        self.d = ContractDriver()
+        self.d.flush()
+        CODE_CACHE.clear()
+        install_database_loader(driver=self.d)
+
+    def tearDown(self):
+        sys.modules.pop('warm', None)
+        rt.env = {}
+        self.d.flush()
+
+    def import_again(self):
+        sys.modules.pop('warm', None)
+        return importlib.import_module('warm')
+
+    def test_executed_module_is_reused(self):
+        self.d.set_contract('warm', 'b = 1337')
+
+        first = self.import_again()
+        second = self.import_again()
+
+        self.assertIs(first, second)
+        self.assertEqual(second.b, 1337)
+
+    def test_module_with_mutable_state_is_executed_again(self):
+        self.d.set_contract('warm', 'b = []')
+
+        first = self.import_again()
+        second = self.import_again()
+
+        self.assertIsNot(first, second)
+        self.assertIsNone(CODE_CACHE.peek(self.d.code_key('warm')).instance)
+
+    def test_changed_code_is_executed_again(self):
+        self.d.set_contract('warm', 'b = 1337')
+        first = self.import_again()
+
+        CODE_CACHE.set(self.d.code_key('warm'), marshal.dumps(compile('b = 7', '', 'exec')))
+        second = self.import_again()
+
+        self.assertIsNot(first, second)
+        self.assertEqual(second.b, 7)
+
+    def test_reused_module_sees_current_environment(self):
+        self.d.set_contract('warm', 'def f():\n    return now')
+
+        rt.env = {'now': 1}
+        self.assertEqual(self.import_again().f(), 1)
+
+        rt.env = {'now': 2}
+        self.assertEqual(self.import_again().f(), 2)
+
+    def test_module_reading_environment_at_top_level_is_executed_again(self):
+        self.d.set_contract('warm', 'b = now')
+
+        rt.env = {'now': 1}
+        self.import_again()
+
+        rt.env = {'now': 2}
+        self.assertEqual(self.import_again().b, 2)
+
+
+class TestCodeCache(TestCase):
+    def setUp(self):
+        self.d = ContractDriver()
+        self.d.flush()
+        install_database_loader(driver=self.d)
+
+    def tearDown(self):
+        sys.modules.pop('cached', None)
+        self.d.flush()
+
+    def import_again(self):
+        sys.modules.pop('cached', None)
+        return importlib.import_module('cached')
+
+    def test_code_is_compiled_once(self):
+        self.d.set_contract('cached', 'b = []')
+
+        hits, misses = CODE_CACHE.hits, CODE_CACHE.misses
+        self.import_again()
+        self.import_again()
+
+        self.assertEqual(CODE_CACHE.misses - misses, 1)
+        self.assertEqual(CODE_CACHE.hits - hits, 1)
+
+    def test_delete_contract_drops_code(self):
+        self.d.set_contract('cached', 'b = 1')
+        self.import_again()
+
+        self.d.delete_contract('cached')
+
+        self.assertNotIn('cached', CODE_CACHE)
+        with self.assertRaises(ImportError):
+            self.import_again()
+
+    def test_replaced_contract_is_executed_from_new_code(self):
+        self.d.set_contract('cached', 'b = 1')
+        self.d.commit()
+        self.import_again()
+
+        self.d.delete_contract('cached')
+        self.d.set_contract('cached', 'b = 2')
+
+        self.assertEqual(self.import_again().b, 2)
+
+    def test_rolled_back_submission_drops_code(self):
+        self.d.set_contract('cached', 'b = 1')
+        self.import_again()
+
+        self.d.rollback()
+
+        with self.assertRaises(ImportError):
+            self.import_again()
+
+    def test_drivers_with_different_code_do_not_share_it(self):
+        other = ContractDriver()
+        self.d.set_contract('cached', "b = 'A'")
+        other.set_contract('cached', "b = 'B'")
+
+        self.assertEqual(self.import_again().b, 'A')
+
+        install_database_loader(driver=other)
+        self.assertEqual(self.import_again().b, 'B')
+
+    def test_cache_is_bounded_by_code_size(self):
+        cache = CodeCache(size=100)
+        blob = marshal.dumps(compile('b = 1', '', 'exec'))
+
+        for i in range(100 // len(blob) + 1):
+            cache.set((str(i), 'hash'), blob)
+
+        self.assertLessEqual(cache.used, 100)
+        self.assertNotIn('0', cache)
+        self.assertEqual(cache.used, len(cache) * len(blob))
+
+    def test_setting_the_same_code_keeps_the_entry(self):
+        cache = CodeCache()
+        blob = marshal.dumps(compile('b = 1', '', 'exec'))
+        entry = cache.set(('x', 'hash'), blob)
+
+        cache.invalidate('x', blob)
+        self.assertIs(cache.get(('x', 'hash')), entry)
+
+        cache.invalidate('x', marshal.dumps(compile('b = 2', '', 'exec')))
+        self.assertIsNone(cache.get(('x', 'hash')))
+
+
 class TestInstallLoader(TestCase):
     def test_install_loader(self):
         uninstall_database_loader()
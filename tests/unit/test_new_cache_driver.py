@@ -1,5 +1,13 @@
 from unittest import TestCase
-from contracting.db.driver import CacheDriver, Driver
+from contracting.db.driver import CacheDriver, Driver, FSDriver, WriteAheadLog, ValueCache
+from contracting.hlcpy import HLC
+from contracting.db.encoder import Encoded, encode_kv
+from contracting.stdlib.bridge.decimal import ContractingDecimal
+from unittest import mock
+from copy import deepcopy
+from pathlib import Path
+import shutil
+import tempfile
 
 
 class TestCacheDriver(TestCase):
@@ -17,11 +25,51 @@ class TestCacheDriver(TestCase):
         self.c.set('thing', 1234)
         self.assertEqual(self.c.pending_writes['thing'], 1234)
 
+    def test_container_is_copied_once_per_transaction(self):
+        value = {'a': [1, 2]}
+        self.c.set('thing', value)
+
+        with mock.patch('contracting.db.driver.deepcopy', wraps=deepcopy) as copied:
+            first = self.c.get('thing')
+            first['a'].append(3)
+
+            self.assertIs(self.c.get('thing'), first)
+            self.assertIs(self.c.get_many(['thing'])['thing'], first)
+            self.assertEqual(copied.call_count, 1)
+
+            self.c.new_transaction()
+            self.assertEqual(self.c.get('thing'), {'a': [1, 2]})
+            self.assertEqual(copied.call_count, 2)
+
+    def test_set_containers_are_copied_for_readers(self):
+        value = {'a': [1, 2]}
+        self.c.set('thing', value)
+
+        self.c.get('thing')['a'].append(3)
+        self.c.get_many(['thing'])['thing']['a'].append(4)
+
+        self.assertIs(self.c.pending_writes['thing'], value)
+        self.assertEqual(value, {'a': [1, 2]})
+
     def test_object_in_cache_returns_from_cache(self):
         self.d.set('thing', 8999)
         self.c.get('thing')
         self.assertEqual(self.c.get('thing'), 8999)
 
+    def test_get_many_prefers_pending_writes_and_cache(self):
+        self.d.set('thing1', 1)
+        self.d.set('thing2', 2)
+        self.d.set('thing3', 3)
+
+        self.c.cache['thing2'] = 20
+        self.c.set('thing3', 30)
+
+        values = self.c.get_many(['thing1', 'thing2', 'thing3', 'thing4'])
+
+        self.assertDictEqual(values, {'thing1': 1, 'thing2': 20, 'thing3': 30, 'thing4': None})
+        self.assertEqual(self.c.pending_reads['thing1'], 1)
+        self.assertTrue('thing4' in self.c.pending_reads)
+
     def test_commit_puts_all_objects_in_pending_writes_to_db(self):
         self.c.set('thing1', 1234)
         self.c.set('thing2', 1235)
@@ -267,3 +315,307 @@ class TestCacheDriver(TestCase):
         x = self.c.find('none')
         
         self.assertEqual(x, 5555)
+
+
+class TestCacheDriverReadCache(TestCase):
+    def setUp(self):
+        self.d = Driver()
+        self.d.flush()
+
+        self.c = CacheDriver(self.d)
+
+        self.driver_reads = []
+        get = self.d.get
+
+        def counting_get(key):
+            self.driver_reads.append(key)
+            return get(key)
+
+        self.d.get = counting_get
+
+    def test_repeated_reads_hit_driver_once_across_transactions(self):
+        self.d.set('currency.balances:stu', 100)
+
+        self.assertEqual(self.c.get('currency.balances:stu'), 100)
+        self.c.soft_apply('0')
+        self.assertEqual(self.c.get('currency.balances:stu'), 100)
+        self.assertEqual(self.c.get('currency.balances:nobody'), None)
+        self.assertEqual(self.c.get('currency.balances:nobody'), None)
+
+        self.assertListEqual(self.driver_reads, ['currency.balances:stu', 'currency.balances:nobody'])
+
+    def test_get_many_fills_and_uses_read_cache(self):
+        self.d.set('currency.balances:stu', 100)
+
+        self.c.get_many(['currency.balances:stu', 'currency.balances:raghu'])
+        self.assertEqual(self.c.get('currency.balances:stu'), 100)
+        self.assertIsNone(self.c.get('currency.balances:raghu'))
+
+        self.assertListEqual(self.driver_reads, [])
+
+    def test_hard_apply_invalidates(self):
+        self.d.set('currency.balances:stu', 100)
+        self.c.get('currency.balances:stu')
+
+        self.c.set('currency.balances:stu', 90)
+        self.c.soft_apply('0')
+        self.c.hard_apply('0')
+        self.c.bust_cache({'currency.balances:stu': 90})
+
+        self.assertEqual(self.c.get('currency.balances:stu'), 90)
+
+    def test_commit_invalidates(self):
+        self.c.get('currency.balances:stu')
+
+        self.c.set('currency.balances:stu', 90)
+        self.c.commit()
+
+        self.assertEqual(self.c.get('currency.balances:stu'), 90)
+
+    def test_values_are_read_again_in_the_next_block(self):
+        self.d.set('currency.balances:stu', 100)
+        self.c.get('currency.balances:stu')
+
+        self.c.set('currency.balances:raghu', 1)
+        self.c.soft_apply('0')
+        self.c.hard_apply('0')
+
+        # Written behind the cache's back, as another process would
+        self.d.set('currency.balances:stu', 50)
+
+        self.assertEqual(self.c.get('currency.balances:stu'), 50)
+
+    def test_commit_and_clear_pending_state_clear(self):
+        self.c.get('currency.balances:stu')
+        self.c.commit()
+        self.assertEqual(len(self.c.read_cache), 0)
+
+        self.c.get('currency.balances:stu')
+        self.c.clear_pending_state()
+        self.assertEqual(len(self.c.read_cache), 0)
+
+    def test_rollback_clears(self):
+        self.c.get('currency.balances:stu')
+        self.c.rollback()
+
+        self.assertEqual(len(self.c.read_cache), 0)
+
+    def test_mutable_values_are_copied(self):
+        self.d.set('con.data', {'a': [1, 2]})
+
+        value = self.c.get('con.data')
+        value['a'].append(3)
+
+        self.assertDictEqual(self.c.get('con.data'), {'a': [1, 2]})
+
+
+class TestCacheDriverEncodesOnce(TestCase):
+    def setUp(self):
+        self.d = Driver()
+        self.d.flush()
+
+        self.c = CacheDriver(self.d)
+
+        self.written = {}
+        set_many = self.d.set_many
+
+        def capturing_set_many(items, block_num=None):
+            self.written.update(items)
+            set_many(items, block_num=block_num)
+
+        self.d.set_many = capturing_set_many
+
+    def test_hard_apply_reuses_encoding_of_scalars(self):
+        self.c.set('currency.balances:stu', ContractingDecimal('1.5'))
+        self.c.set('con.data', {'a': 1})
+        self.c.set('con.float', 1.5)
+        self.c.soft_apply('0')
+        self.c.hard_apply('0')
+
+        self.assertIsInstance(self.written['currency.balances:stu'], Encoded)
+        self.assertNotIsInstance(self.written['con.data'], Encoded)
+        self.assertNotIsInstance(self.written['con.float'], Encoded)
+        self.assertEqual(self.d.get('currency.balances:stu'), ContractingDecimal('1.5'))
+        self.assertEqual(self.d.get('con.float'), ContractingDecimal('1.5'))
+        self.assertDictEqual(self.c.encoded, {})
+
+    def test_commit_reuses_encoding_and_still_deletes(self):
+        self.d.set('con.gone', 1)
+
+        self.c.set('con.x', 'value')
+        self.c.set('con.gone', None)
+        self.c.commit()
+
+        self.assertIsInstance(self.written['con.x'], Encoded)
+        self.assertIsNone(self.written['con.gone'])
+        self.assertEqual(self.d.get('con.x'), 'value')
+        self.assertIsNone(self.d.get('con.gone'))
+
+    def test_reads_are_metered_with_known_sizes(self):
+        self.d.set('con.cold', {'a': [1, 2]})
+        self.c.set('con.hot', 'value')
+
+        with mock.patch('contracting.db.driver.rt') as rt:
+            rt.tracer.is_started.return_value = True
+
+            self.c.get('con.cold')
+            self.c.get('con.cold')
+            self.c.get('con.hot')
+            self.c.get_many(['con.cold', 'con.hot'])
+
+        expected = [sum(map(len, encode_kv(key, self.c.find(key)))) for key in ['con.cold', 'con.cold', 'con.hot', 'con.cold', 'con.hot']]
+        self.assertListEqual([call[0][0] for call in rt.deduct_read_size.call_args_list], expected)
+
+class TestValueCache(TestCase):
+    def test_evicts_least_recently_used_over_budget(self):
+        cache = ValueCache(size=20)
+        cache.set('a', 'x' * 5)
+        cache.set('b', 'x' * 5)
+        cache.get('a')
+        cache.set('c', 'x' * 5)
+
+        self.assertEqual(cache.get('a'), 'xxxxx')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 'xxxxx')
+        self.assertTrue(cache.used <= 20)
+
+    def test_value_larger_than_budget_is_not_kept(self):
+        cache = ValueCache(size=10)
+        cache.set('a', 'x' * 20)
+
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.used, 0)
+
+class TestCacheDriverWithFSDriver(TestCase):
+    def setUp(self):
+        self.d = FSDriver()
+        self.d.flush()
+
+        self.c = CacheDriver(self.d)
+
+    def tearDown(self):
+        self.d.flush()
+
+    def test_commit_writes_and_deletes(self):
+        self.d.set('currency.balances:raghu', 1)
+
+        self.c.set('currency.balances:stu', 100)
+        self.c.set('currency.balances:raghu', None)
+        self.c.set('con_token.balances:stu', 5)
+        self.c.commit()
+
+        self.assertEqual(self.d.get('currency.balances:stu'), 100)
+        self.assertIsNone(self.d.get('currency.balances:raghu'))
+        self.assertEqual(self.d.get('con_token.balances:stu'), 5)
+
+    def test_hard_apply_writes_deltas_with_block_num(self):
+        hlc = str(HLC.from_now())
+
+        self.c.set('currency.balances:stu', 100)
+        self.c.set('con_token.balances:stu', 5)
+        self.c.soft_apply(hlc)
+        self.c.hard_apply(hlc)
+
+        self.assertEqual(self.d.get('currency.balances:stu'), 100)
+        self.assertEqual(self.d.get('con_token.balances:stu'), 5)
+        self.assertEqual(self.d.get_block('currency.balances:stu'), self.c.get_nanos(hlc))
+
+    def test_hard_apply_does_not_overwrite_later_block(self):
+        earlier, later = str(HLC(nanos=1000)), str(HLC(nanos=2000))
+
+        self.d.set('currency.balances:stu', 'later', str(self.c.get_nanos(later)))
+
+        self.c.set('currency.balances:stu', 'earlier')
+        self.c.set('currency.balances:raghu', 'earlier')
+        self.c.soft_apply(earlier)
+        self.c.hard_apply(earlier)
+
+        self.assertEqual(self.d.get('currency.balances:stu'), 'later')
+        self.assertEqual(self.d.get('currency.balances:raghu'), 'earlier')
+
+
+class TestCacheDriverWriteAheadLog(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.wal_path = Path(self.root).joinpath('wal')
+
+        self.d = FSDriver(root=self.root)
+        self.c = CacheDriver(self.d, wal_path=self.wal_path)
+
+    def tearDown(self):
+        self.d.flush()
+        shutil.rmtree(self.root)
+
+    def test_hard_apply_writes_through_and_clears_log(self):
+        hlc = str(HLC.from_now())
+
+        self.c.set('currency.balances:stu', 100)
+        self.c.soft_apply(hlc)
+        self.c.hard_apply(hlc)
+
+        self.assertEqual(self.d.get('currency.balances:stu'), 100)
+        self.assertListEqual(list(self.c.wal.records()), [])
+
+    def test_log_is_kept_until_driver_has_synced(self):
+        hlc = str(HLC.from_now())
+        logged = []
+
+        def sync():
+            logged.append(len(list(self.c.wal.records())))
+
+        self.c.set('currency.balances:stu', 100)
+        self.c.soft_apply(hlc)
+
+        with mock.patch.object(self.d, 'sync', side_effect=sync) as synced:
+            self.c.hard_apply(hlc)
+
+        synced.assert_called_once()
+        self.assertEqual(logged, [1])
+        self.assertListEqual(list(self.c.wal.records()), [])
+
+    def test_sync_covers_files_written_since_last_sync(self):
+        self.d.set_many({'currency.balances:stu': 100, 'con_other.x': 1})
+
+        with mock.patch('os.fsync') as fsync:
+            self.d.sync()
+            self.assertEqual(fsync.call_count, 2)
+
+            self.d.sync()
+            self.assertEqual(fsync.call_count, 2)
+
+    def test_failed_apply_is_replayed_on_startup(self):
+        earlier, later = str(HLC(nanos=1000)), str(HLC(nanos=2000))
+
+        self.c.set('currency.balances:stu', 100)
+        self.c.soft_apply(earlier)
+        self.c.set('currency.balances:stu', 90)
+        self.c.set('currency.balances:raghu', 10)
+        self.c.soft_apply(later)
+
+        def crash(*args, **kwargs):
+            raise OSError('crashed')
+
+        self.d.set_many = crash
+        with self.assertRaises(OSError):
+            self.c.hard_apply(later)
+
+        self.assertEqual(len(list(self.c.wal.records())), 2)
+        self.assertIsNone(self.d.get('currency.balances:stu'))
+
+        c = CacheDriver(FSDriver(root=self.root), wal_path=self.wal_path)
+
+        self.assertEqual(c.driver.get('currency.balances:stu'), 90)
+        self.assertEqual(c.driver.get('currency.balances:raghu'), 10)
+        self.assertEqual(c.driver.get_block('currency.balances:stu'), c.get_nanos(later))
+        self.assertListEqual(list(c.wal.records()), [])
+
+    def test_replay_ignores_torn_last_record(self):
+        WriteAheadLog(self.wal_path).append([(str(HLC(nanos=1000)), {'currency.balances:stu': 100})])
+        with open(self.wal_path, 'ab') as f:
+            f.write(b'{"hlc":"2000","writes":{"currency.bal')
+
+        CacheDriver(self.d, wal_path=self.wal_path)
+
+        self.assertEqual(self.d.get('currency.balances:stu'), 100)
+        self.assertEqual(self.wal_path.stat().st_size, 0)
+
@@ -1,5 +1,5 @@
 from unittest import TestCase
-from contracting.db.driver import ContractDriver, Driver
+from contracting.db.driver import ContractDriver, Driver, CODE_CACHE
 from contracting.stdlib.bridge.time import Datetime
 
 import marshal
@@ -48,6 +48,15 @@ class TestContractDriver(TestCase):
 
         self.assertListEqual(vs, expected)
 
+    def test_items_copies_set_containers(self):
+        value = {'a': [1, 2]}
+        self.c.set('thing', value)
+
+        self.c.items('thing')['thing']['a'].append(3)
+
+        self.assertIs(self.c.pending_writes['thing'], value)
+        self.assertEqual(value, {'a': [1, 2]})
+
     def test_items_only_in_cache_works(self):
         kvs = {'899af0b15aa0f227e658c96a24fa890e': 'ece22e0f19e822908b136e391d488ba5',
                'fd556e848073c754c48f07c96b460f42': '09af42359ef2be582203259e4919ce46',
@@ -384,3 +393,124 @@ print('hello, world!')
         self.assertEqual(self.c.get_owner('test'), 'something')
         self.assertEqual(self.c.get_time_submitted('test'), time)
 
+    def test_is_contract(self):
+        self.c.set_contract(name='test', code='a = 1', owner='stu')
+
+        self.assertTrue(self.c.is_contract('test'))
+        self.assertFalse(self.c.is_contract('nope'))
+        self.assertEqual(self.c.contract_index.get('test')['__owner__'], 'stu')
+
+    def test_is_contract_reads_nothing_once_indexed(self):
+        self.c.set_contract(name='test', code='a = 1')
+        self.c.commit()
+        self.c.contract_index.clear()
+
+        self.assertTrue(self.c.is_contract('test'))
+
+        self.c.get = None
+        self.assertTrue(self.c.is_contract('test'))
+
+    def test_is_contract_is_a_dependency_not_a_read(self):
+        self.c.set_contract(name='test', code='a = 1')
+        self.c.commit()
+
+        self.c.is_contract('test')
+
+        self.assertNotIn('test.__code__', self.c.pending_reads)
+        self.assertIn('test.__code__', self.c.pending_scans)
+
+    def test_metadata_reads_nothing_once_cached(self):
+        self.c.set_contract(name='test', code='a = 1', owner='stu', developer='dev')
+        self.c.commit()
+        self.c.contract_index.clear()
+
+        self.assertEqual(self.c.get_owner('test'), 'stu')
+        self.assertEqual(self.c.get_developer('test'), 'dev')
+
+        self.c.get = None
+        self.assertEqual(self.c.get_owner('test'), 'stu')
+        self.assertEqual(self.c.get_developer('test'), 'dev')
+
+    def test_metadata_is_a_dependency_not_a_read(self):
+        self.c.set_contract(name='test', code='a = 1', owner='stu')
+        self.c.commit()
+
+        self.c.get_owner('test')
+
+        self.assertNotIn('test.__owner__', self.c.pending_reads)
+        self.assertIn('test.__owner__', self.c.pending_scans)
+
+    def test_owner_change_updates_cached_owner(self):
+        self.c.set_contract(name='test', code='a = 1', owner='stu')
+        self.assertEqual(self.c.get_owner('test'), 'stu')
+
+        self.c.set_var('test', '__owner__', value='jeff')
+
+        self.assertEqual(self.c.get_owner('test'), 'jeff')
+
+    def test_rolled_back_owner_change_restores_cached_owner(self):
+        self.c.set_contract(name='test', code='a = 1', owner='stu')
+        self.c.commit()
+        self.assertEqual(self.c.get_owner('test'), 'stu')
+
+        self.c.set_var('test', '__owner__', value='jeff')
+        self.assertEqual(self.c.get_owner('test'), 'jeff')
+
+        self.c.rollback()
+
+        self.assertEqual(self.c.get_owner('test'), 'stu')
+
+    def test_contract_applied_from_another_node_is_found(self):
+        code = 'a = 1'
+        blob = marshal.dumps(compile(code, '', 'exec'))
+
+        self.assertFalse(self.c.is_contract('synced'))
+
+        self.c.apply_writes({'synced.__code__': code, 'synced.__compiled__': blob, 'synced.__owner__': 'stu'}, '0')
+
+        self.assertTrue(self.c.is_contract('synced'))
+        self.assertEqual(self.c.get_owner('synced'), 'stu')
+
+    def test_contract_set_key_by_key_is_found(self):
+        self.assertFalse(self.c.is_contract('synced'))
+
+        self.c.set('synced.__code__', 'a = 1')
+        self.c.soft_apply('0')
+        self.c.hard_apply('0')
+
+        self.assertTrue(self.c.is_contract('synced'))
+
+    def test_applied_compiled_code_replaces_cached_code(self):
+        CODE_CACHE.set(('test', 'hash'), marshal.dumps(compile('a = 1', '', 'exec')))
+
+        self.c.apply_writes({'test.__compiled__': marshal.dumps(compile('a = 2', '', 'exec'))}, '0')
+
+        self.assertNotIn('test', CODE_CACHE)
+
+    def test_contract_index_belongs_to_its_driver(self):
+        self.c.set_contract(name='test', code='a = 1')
+        other = ContractDriver(self.d)
+
+        self.assertTrue(self.c.is_contract('test'))
+        self.assertFalse(other.is_contract('test'))
+
+    def test_owner_of_missing_contract_is_none(self):
+        self.assertIsNone(self.c.get_owner('nope'))
+
+    def test_rolled_back_contract_is_not_a_contract(self):
+        self.c.set_contract(name='test', code='a = 1')
+        self.assertTrue(self.c.is_contract('test'))
+
+        self.c.rollback()
+
+        self.assertFalse(self.c.is_contract('test'))
+
+    def test_deleted_contract_is_not_a_contract(self):
+        self.c.set_contract(name='test', code='a = 1')
+        self.c.commit()
+        self.assertTrue(self.c.is_contract('test'))
+
+        self.c.delete_contract('test')
+
+        self.assertFalse(self.c.is_contract('test'))
+
@@ -1,11 +1,20 @@
 from contracting import config
-from contracting.db.driver import Driver, InMemDriver, FSDriver
+from contracting.db.driver import Driver, InMemDriver, FSDriver, LMDBDriver, CacheDriver
+from contracting.db import migrate
+from contracting.hlcpy import HLC
+from pathlib import Path
 from contracting.db.encoder import MONGO_MAX_INT
 from contracting.stdlib.bridge.decimal import ContractingDecimal
 from contracting.stdlib.bridge.time import Datetime, Timedelta
 from decimal import Decimal
+from contracting.db.hdf5 import h5c
 from unittest import TestCase
+import multiprocessing
+import threading
+import fcntl
 import random
+import shutil
+import tempfile
 
 SAMPLE_STRING = 'beef'
 SAMPLE_INT = 123
@@ -279,6 +288,18 @@ class TestDriver(TestCase):
         self.assertListEqual(keys, got_keys)
 
 
+    def test_get_many(self):
+        for i, v in enumerate(TEST_DATA):
+            self.d.set(str(i), v)
+
+        values = self.d.get_many([str(i) for i in range(len(TEST_DATA))] + ['missing'])
+
+        for i, v in enumerate(TEST_DATA):
+            self.assertEqual(v, values[str(i)]) if not isinstance(v, dict) else self.assertDictEqual(v, values[str(i)])
+
+        self.assertIsNone(values['missing'])
+
+
 class TestInMemDriver(TestCase):
     # Flush this sucker every test
     def setUp(self):
@@ -645,6 +666,36 @@ class TestInMemDriver(TestCase):
         self.assertEqual(thing_2, value_result_2)
 
 
+    def test_get_many(self):
+        for i, v in enumerate(TEST_DATA):
+            self.d.set(str(i), v)
+
+        values = self.d.get_many([str(i) for i in range(len(TEST_DATA))] + ['missing'])
+
+        for i, v in enumerate(TEST_DATA):
+            self.assertEqual(v, values[str(i)]) if not isinstance(v, dict) else self.assertDictEqual(v, values[str(i)])
+
+        self.assertIsNone(values['missing'])
+
+    def test_set_many_sets_and_deletes(self):
+        self.d.set('b', 1)
+
+        self.d.set_many({'a': 1, 'b': None, 'c': SAMPLE_DICT})
+
+        self.assertEqual(self.d.get('a'), 1)
+        self.assertIsNone(self.d.get('b'))
+        self.assertDictEqual(self.d.get('c'), SAMPLE_DICT)
+
+    def test_set_many_respects_block_num(self):
+        self.d.set('a', 'A', 100)
+
+        self.d.set_many({'a': 'B', 'b': 'B'}, 99)
+
+        self.assertEqual(self.d.get('a'), 'A')
+        self.assertEqual(self.d.get('b'), 'B')
+        self.assertEqual(self.d.get_block('b'), 99)
+
+
 class TestFSDriver(TestCase):
     # Flush this sucker every test
     def setUp(self):
@@ -784,6 +835,53 @@ class TestFSDriver(TestCase):
         self.assertListEqual([sample_key], self.d.keys())
         self.assertEqual(0, len(self.d.keys(prefix='invalid')))
 
+    def test_iter_returns_keys_in_python_sort_order(self):
+        keys = ['stu.balances:1', 'stu.balances:1:x', 'stu.balances:10', 'stu.balances:1-a', 'stu.balances:2',
+                'stu.balances', 'stu.balancesx', 'stu.owner']
+        for k in keys:
+            self.d.set(k, 1)
+
+        self.assertListEqual(self.d.iter('stu.'), sorted(keys))
+        self.assertListEqual(self.d.iter('stu.balances:'), sorted(k for k in keys if k.startswith('stu.balances:')))
+        self.assertListEqual(self.d.iter('stu.balances:1'), sorted(k for k in keys if k.startswith('stu.balances:1')))
+        self.assertListEqual(self.d.iter('stu.bal'), sorted(k for k in keys if k.startswith('stu.bal')))
+
+    def test_iter_with_length_returns_first_keys(self):
+        keys = ['stu.balances:{}'.format(i) for i in range(100)] + \
+               ['stu.balances:{}:{}'.format(i, j) for i in range(10) for j in range(10)]
+        random.shuffle(keys)
+        for k in keys:
+            self.d.set(k, 1)
+
+        for length in (1, 5, 17, 150, 500):
+            self.assertListEqual(self.d.iter('stu.balances:', length=length), sorted(keys)[:length])
+            self.assertListEqual(self.d.iter('stu.balances:5', length=length),
+                                 sorted(k for k in keys if k.startswith('stu.balances:5'))[:length])
+
+    def test_iter_skips_deleted_keys_and_missing_prefixes(self):
+        self.d.set('stu.balances:a', 1)
+        self.d.set('stu.balances:b', 1)
+        self.d.delete('stu.balances:a')
+
+        self.assertListEqual(self.d.iter('stu.balances:'), ['stu.balances:b'])
+        self.assertListEqual(self.d.iter('stu.nothing:'), [])
+        self.assertListEqual(self.d.iter('nothing.balances:'), [])
+
+    def test_binary_codec_round_trips_and_reads_json(self):
+        self.d.set('b.json', SAMPLE_DICT)
+
+        d = FSDriver(codec='binary')
+        for v in TEST_DATA:
+            d.set('b.b', v)
+            b = d.get('b.b')
+            self.assertEqual(v, b) if not isinstance(v, dict) else self.assertDictEqual(v, b)
+
+        d.set_many({'b.x': SAMPLE_BYTES, 'b.y': SAMPLE_INT})
+
+        self.assertDictEqual(d.get_many(['b.x', 'b.y', 'b.json']), {'b.x': SAMPLE_BYTES, 'b.y': SAMPLE_INT, 'b.json': SAMPLE_DICT})
+        self.assertEqual(self.d.get('b.b'), SAMPLE_DICT)
+        self.assertListEqual(d.iter('b.'), ['b.b', 'b.json', 'b.x', 'b.y'])
+
     def test_set_object_returns_properly(self):
         thing = {
             'a': 123,
@@ -970,3 +1068,364 @@ class TestFSDriver(TestCase):
             self.d.set(f'{c}.something', SAMPLE_INT)
 
         self.assertListEqual(sample_contracts, self.d.get_contracts())
+
+    def test_pool_reuses_open_handle(self):
+        self.d.set('currency.balances:stu', 100)
+        self.d.set('currency.balances:raghu', 200)
+
+        self.assertEqual(len(self.d.pool), 1)
+
+        self.assertEqual(self.d.get('currency.balances:stu'), 100)
+        self.assertEqual(self.d.get('currency.balances:raghu'), 200)
+
+        self.assertEqual(len(self.d.pool), 1)
+
+    def test_pool_evicts_least_recently_used(self):
+        self.d.pool.size = 2
+
+        self.d.set('a.x', 1)
+        self.d.set('b.x', 2)
+        self.d.get('a.x')
+        self.d.set('c.x', 3)
+
+        self.assertEqual(len(self.d.pool), 2)
+        self.assertListEqual(sorted(self.d.pool.handles.keys()), sorted([
+            str(self.d.contract_state.joinpath('a')),
+            str(self.d.contract_state.joinpath('c'))
+        ]))
+
+        self.assertEqual(self.d.get('a.x'), 1)
+        self.assertEqual(self.d.get('b.x'), 2)
+        self.assertEqual(self.d.get('c.x'), 3)
+
+    def test_pool_sees_writes_from_other_driver(self):
+        other = FSDriver()
+
+        self.d.set('currency.balances:stu', 100)
+        self.assertEqual(other.get('currency.balances:stu'), 100)
+
+        other.set('currency.balances:stu', 50)
+        self.assertEqual(self.d.get('currency.balances:stu'), 50)
+
+    def test_get_does_not_create_file(self):
+        self.assertIsNone(self.d.get('currency.balances:stu'))
+        self.assertFalse(self.d.is_file('currency'))
+        self.assertEqual(len(self.d.pool), 0)
+
+    def test_flush_closes_pool(self):
+        self.d.set('currency.balances:stu', 100)
+        self.d.flush()
+
+        self.assertEqual(len(self.d.pool), 0)
+        self.assertIsNone(self.d.get('currency.balances:stu'))
+
+    def test_set_many_sets_across_files(self):
+        items = {
+            'currency.balances:stu': 100,
+            'currency.balances:raghu': 200,
+            'con_token.balances:stu': SAMPLE_CONTRACTING_DECIMAL,
+            'con_token.metadata': SAMPLE_DICT,
+            '__misc': 'x',
+        }
+
+        self.d.set_many(items)
+
+        for k, v in items.items():
+            self.assertEqual(self.d.get(k), v)
+            self.assertEqual(self.d.get_block(k), config.BLOCK_NUM_DEFAULT)
+
+    def test_set_many_none_deletes(self):
+        self.d.set('currency.balances:stu', 100)
+
+        self.d.set_many({'currency.balances:stu': None, 'currency.balances:raghu': 1})
+
+        self.assertIsNone(self.d.get('currency.balances:stu'))
+        self.assertListEqual(self.d.iter('currency.balances'), ['currency.balances:raghu'])
+
+    def test_set_many_respects_block_num(self):
+        self.d.set('currency.balances:stu', 'A', '100')
+
+        self.d.set_many({'currency.balances:stu': 'B', 'currency.balances:raghu': 'B'}, '99')
+
+        self.assertEqual(self.d.get('currency.balances:stu'), 'A')
+        self.assertEqual(self.d.get('currency.balances:raghu'), 'B')
+        self.assertEqual(self.d.get_block('currency.balances:raghu'), 99)
+
+        self.d.set_many({'currency.balances:stu': 'C'}, '100')
+
+        self.assertEqual(self.d.get('currency.balances:stu'), 'C')
+
+    def test_set_many_contract_name_too_long(self):
+        contract = 'b' * 256
+        self.d.set_many({contract + '.b': 1, 'b.b': 2})
+
+        self.assertIsNone(self.d.get(contract + '.b'))
+        self.assertEqual(self.d.get('b.b'), 2)
+
+    def test_get_many_across_files(self):
+        items = {
+            'currency.balances:stu': 100,
+            'currency.balances:raghu': SAMPLE_DICT,
+            'con_token.balances:stu': SAMPLE_CONTRACTING_DECIMAL,
+            '__misc': 'x',
+        }
+
+        self.d.set_many(items)
+
+        values = self.d.get_many(list(items) + ['currency.balances:missing', 'missing.key', 'b' * 256 + '.b'])
+
+        for k, v in items.items():
+            self.assertEqual(values[k], v)
+
+        self.assertIsNone(values['currency.balances:missing'])
+        self.assertIsNone(values['missing.key'])
+        self.assertIsNone(values['b' * 256 + '.b'])
+
+
+def write_in_other_process(key, value):
+    FSDriver().set(key, value)
+
+
+def read_in_other_process(key, queue):
+    queue.put(FSDriver().get(key))
+
+
+class TestFSDriverLocking(TestCase):
+    def setUp(self):
+        self.d = FSDriver()
+        self.d.set('currency.balances:stu', 100)
+        self.lock_path = str(self.d.contract_state.joinpath('currency')) + '-lock'
+        h5c.set_lock_timeout(0.2)
+
+    def tearDown(self):
+        h5c.set_lock_timeout(10)
+        self.d.flush()
+
+    def hold_lock(self, mode):
+        f = open(self.lock_path, 'r+')
+        fcntl.flock(f, mode)
+        return f
+
+    def test_reads_share_lock(self):
+        with self.hold_lock(fcntl.LOCK_SH):
+            self.assertEqual(self.d.get('currency.balances:stu'), 100)
+            self.assertListEqual(self.d.iter('currency.balances'), ['currency.balances:stu'])
+
+    def test_write_times_out_while_read_locked(self):
+        with self.hold_lock(fcntl.LOCK_SH):
+            with self.assertRaises(TimeoutError):
+                self.d.set('currency.balances:stu', 200)
+
+        self.d.set('currency.balances:stu', 200)
+        self.assertEqual(self.d.get('currency.balances:stu'), 200)
+
+    def test_read_times_out_while_write_locked(self):
+        with self.hold_lock(fcntl.LOCK_EX):
+            with self.assertRaises(TimeoutError):
+                self.d.get('currency.balances:stu')
+
+    def test_stale_mkdir_lock_is_recovered(self):
+        path = str(self.d.contract_state.joinpath('con_token'))
+        Path(path + '-lock').mkdir()
+
+        self.d.set('con_token.balances:stu', 1)
+
+        self.assertEqual(self.d.get('con_token.balances:stu'), 1)
+
+    def test_lock_files_are_not_contracts(self):
+        self.assertListEqual(self.d.get_contracts(), ['currency'])
+        self.assertListEqual(self.d.keys(), ['currency.balances:stu'])
+
+    def test_pooled_handle_sees_writes_from_other_process(self):
+        self.assertEqual(self.d.get('currency.balances:stu'), 100)
+
+        p = multiprocessing.Process(target=write_in_other_process, args=('currency.balances:stu', 300))
+        p.start()
+        p.join()
+
+        self.assertEqual(self.d.get('currency.balances:stu'), 300)
+
+    def test_pooled_handle_keeps_new_keys_from_other_process(self):
+        self.assertEqual(self.d.get('currency.balances:stu'), 100)
+
+        p = multiprocessing.Process(target=write_in_other_process, args=('currency.balances:b', 3))
+        p.start()
+        p.join()
+
+        # Reopening the handle must not write its old view of the file back over the new key
+        self.assertEqual(self.d.get('currency.balances:b'), 3)
+        self.d.pool.close_all()
+
+        queue = multiprocessing.Queue()
+        p = multiprocessing.Process(target=read_in_other_process, args=('currency.balances:b', queue))
+        p.start()
+        value = queue.get(timeout=10)
+        p.join()
+
+        self.assertEqual(value, 3)
+
+    def test_threads_share_pooled_handles(self):
+        def run(i):
+            for j in range(20):
+                self.d.set('currency.balances:t{}'.format(i), j)
+                self.assertEqual(self.d.get('currency.balances:t{}'.format(i)), j)
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.d.get_many(['currency.balances:t{}'.format(i) for i in range(4)]),
+                         {'currency.balances:t{}'.format(i): 19 for i in range(4)})
+
+        # No thread is left holding the lock
+        with self.hold_lock(fcntl.LOCK_EX | fcntl.LOCK_NB):
+            pass
+
+    def test_flush_file_is_seen_by_other_driver(self):
+        other = FSDriver()
+        self.assertEqual(other.get('currency.balances:stu'), 100)
+
+        self.d.flush_file('currency')
+
+        self.assertIsNone(other.get('currency.balances:stu'))
+        self.assertFalse(self.d.is_file('currency'))
+
+
+class TestLMDBDriver(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.d = LMDBDriver(root=self.root)
+
+    def tearDown(self):
+        self.d.env.close()
+        shutil.rmtree(self.root)
+
+    def test_get_set(self):
+        for v in TEST_DATA:
+            self.d.set('b.b', v)
+
+            b = self.d.get('b.b')
+            self.assertEqual(v, b) if not isinstance(v, dict) else self.assertDictEqual(v, b)
+            self.assertEqual(self.d.get_block('b.b'), config.BLOCK_NUM_DEFAULT)
+
+    def test_safe_set(self):
+        self.d.set('b.b', "A", "100")
+        self.assertEqual("A", self.d.get('b.b'))
+        self.assertEqual(100, self.d.get_block('b.b'))
+
+        self.d.set('b.b', "B", "99")
+        self.assertEqual("A", self.d.get('b.b'))
+
+        self.d.set('b.b', "C", "101")
+        self.assertEqual("C", self.d.get('b.b'))
+
+        self.d.set('b.b', "D", "101")
+        self.assertEqual("D", self.d.get('b.b'))
+
+    def test_set_without_block_clears_block(self):
+        self.d.set('b.b', 1, "100")
+        self.d.set('b.b', 2)
+
+        self.assertEqual(2, self.d.get('b.b'))
+        self.assertEqual(self.d.get_block('b.b'), config.BLOCK_NUM_DEFAULT)
+
+    def test_delete(self):
+        self.d.set('b.b', 1, "100")
+        self.d.delete('b.b')
+
+        self.assertIsNone(self.d.get('b.b'))
+        self.assertEqual(self.d.get_block('b.b'), config.BLOCK_NUM_DEFAULT)
+        self.assertListEqual(self.d.keys(), [])
+
+    def test_binary_codec(self):
+        self.d.set('b.json', SAMPLE_DICT)
+        self.d.env.close()
+
+        self.d = LMDBDriver(root=self.root, codec='binary')
+        for v in TEST_DATA:
+            self.d.set('b.b', v)
+            b = self.d.get('b.b')
+            self.assertEqual(v, b) if not isinstance(v, dict) else self.assertDictEqual(v, b)
+
+        self.assertDictEqual(self.d.get('b.json'), SAMPLE_DICT)
+
+    def test_key_too_long_is_ignored(self):
+        key = 'b.' + 'b' * self.d.max_key_size
+
+        self.d.set(key, 1)
+        self.d.set_many({key: 1}, block_num="100")
+
+        self.assertIsNone(self.d.get(key))
+        self.assertDictEqual(self.d.get_many([key]), {key: None})
+        self.assertEqual(self.d.get_block(key), config.BLOCK_NUM_DEFAULT)
+
+    def test_set_many_get_many(self):
+        self.d.set('b.x', 'later', "200")
+
+        self.d.set_many({'b.x': 'earlier', 'b.y': 'earlier', 'c.z': None}, block_num="100")
+
+        self.assertDictEqual(self.d.get_many(['b.x', 'b.y', 'c.z']), {'b.x': 'later', 'b.y': 'earlier', 'c.z': None})
+        self.assertEqual(self.d.get_block('b.y'), 100)
+
+    def test_iter_and_keys(self):
+        keys = ['stu.balances:1', 'stu.balances:1:x', 'stu.balances:10', 'stu.balances:2', 'stu.owner', 'stux.a']
+        random.shuffle(keys)
+        for k in keys:
+            self.d.set(k, 1)
+
+        self.assertListEqual(self.d.iter('stu.'), sorted(k for k in keys if k.startswith('stu.')))
+        self.assertListEqual(self.d.iter('stu.balances:1'), sorted(k for k in keys if k.startswith('stu.balances:1')))
+        self.assertListEqual(self.d.iter('stu.balances:', length=2), sorted(keys)[:2])
+        self.assertListEqual(self.d.iter('nothing.'), [])
+        self.assertListEqual(self.d.keys(), sorted(keys))
+        self.assertListEqual(self.d.keys(prefix='stu', length=3), sorted(keys)[:3])
+
+    def test_get_contracts(self):
+        for k in ['con_b.x', 'con_a.x', 'con_a.y:z', 'con_a-b.x', '__run.x', 'misc']:
+            self.d.set(k, 1)
+
+        self.assertListEqual(self.d.get_contracts(), ['con_a', 'con_a-b', 'con_b'])
+
+    def test_flush_and_flush_file(self):
+        self.d.set('con_a.x', 1)
+        self.d.set('con_b.x', 1, "100")
+
+        self.d.flush_file('con_b')
+        self.assertListEqual(self.d.keys(), ['con_a.x'])
+        self.assertEqual(self.d.get_block('con_b.x'), config.BLOCK_NUM_DEFAULT)
+
+        self.d.flush()
+        self.assertListEqual(self.d.keys(), [])
+
+    def test_cache_driver_hard_apply_writes_through(self):
+        c = CacheDriver(self.d)
+        hlc = str(HLC.from_now())
+
+        c.set('currency.balances:stu', 100)
+        c.soft_apply(hlc)
+        c.hard_apply(hlc)
+
+        self.assertEqual(self.d.get('currency.balances:stu'), 100)
+        self.assertEqual(self.d.get_block('currency.balances:stu'), c.get_nanos(hlc))
+
+    def test_fs_to_lmdb_copies_values_and_blocks(self):
+        fs = FSDriver(root=self.root)
+        fs.set('currency.balances:stu', 100, "100")
+        fs.set('currency.balances:raghu', 5)
+        fs.set('__latest_block.hash', 'beef', "200")
+        fs.set('thing', 1)
+
+        self.d.env.close()
+        self.assertEqual(migrate.fs_to_lmdb(source=self.root), 4)
+        self.d = LMDBDriver(root=self.root)
+
+        self.assertEqual(self.d.get('currency.balances:stu'), 100)
+        self.assertEqual(self.d.get_block('currency.balances:stu'), 100)
+        self.assertEqual(self.d.get('currency.balances:raghu'), 5)
+        self.assertEqual(self.d.get_block('currency.balances:raghu'), config.BLOCK_NUM_DEFAULT)
+        self.assertEqual(self.d.get('__latest_block.hash'), 'beef')
+        self.assertEqual(self.d.get('thing'), 1)
+        self.assertListEqual(self.d.get_contracts(), fs.get_contracts())
+
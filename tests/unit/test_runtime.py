@@ -1,8 +1,10 @@
 from unittest import TestCase
 from contracting.execution import runtime
+from contracting import config
 import sys
 import psutil
 import os
+import threading
 
 
 class TestRuntime(TestCase):
@@ -139,4 +141,169 @@ class TestRuntime(TestCase):
         with self.assertRaises(AssertionError):
             runtime.rt.deduct_write('a', 'b' * 32 * 1024)
 
-        runtime.rt.clean_up()
\ No newline at end of file
+        runtime.rt.clean_up()
+
+    def metered_cost(self, code, scope):
+        globals().pop('__contract__', None)
+
+        runtime.rt.set_up(stmps=10000, meter=True)
+        exec(code, scope)
+        runtime.rt.tracer.stop()
+        used = runtime.rt.tracer.get_stamp_used()
+        runtime.rt.clean_up()
+
+        return used
+
+    def test_every_instruction_is_charged(self):
+        short = self.metered_cost('x = y', {'__contract__': True, 'y': 3})
+        long = self.metered_cost('x = y * 2 + y - 1', {'__contract__': True, 'y': 3})
+
+        self.assertGreater(short, 0)
+        self.assertGreater(long, short)
+
+    def test_non_contract_code_is_not_charged(self):
+        self.assertEqual(self.metered_cost('x = y * 2 + y - 1', {'y': 3}), 0)
+
+    def metered_memory(self, code, scope):
+        globals().pop('__contract__', None)
+
+        runtime.rt.set_up(stmps=1000000, meter=True)
+        exec(code, scope)
+        runtime.rt.tracer.stop()
+        used = runtime.rt.tracer.get_total_mem_usage()
+        runtime.rt.clean_up()
+
+        return used
+
+    def test_contract_allocations_are_counted(self):
+        used = self.metered_memory("x = 'a' * 1000000", {'__contract__': True})
+
+        self.assertGreaterEqual(used, 1000000)
+        self.assertLess(used, 1100000)
+
+    def test_non_contract_allocations_are_not_counted(self):
+        self.assertEqual(self.metered_memory("x = 'a' * 1000000", {}), 0)
+
+    def test_small_allocations_are_not_counted(self):
+        used = self.metered_memory("x = [0] * 10000\nfor i in range(10000):\n    x[i] = str(i)", {'__contract__': True})
+
+        # Only the list's storage, not the strings put in it
+        self.assertGreaterEqual(used, 10000 * 8)
+        self.assertLess(used, 10000 * sys.getsizeof('0'))
+
+    def test_reallocated_blocks_are_charged_for_growth(self):
+        used = self.metered_memory("x = []\nfor c in 'a' * 20000:\n    x.append(c)", {'__contract__': True})
+
+        self.assertGreaterEqual(used, 20000 * 8)
+        self.assertLess(used, 2 * 20000 * 8)
+
+    def test_memory_usage_is_the_same_each_time(self):
+        names = ['v{}'.format(i) for i in range(100)]
+        code = '''
+def f(n):
+    {} = 0
+    return [str(i) * 100 for i in range(n)]
+x = f(100)
+y = {{i: 'a' * i for i in range(200)}}
+'''.format(' = '.join(names))
+        code = compile(code, '', 'exec')
+        used = self.metered_memory(code, {'__contract__': True})
+
+        self.assertGreater(used, 0)
+
+        # The second run reuses the frames left over from the first
+        self.assertEqual(self.metered_memory(code, {'__contract__': True}), used)
+
+    def test_memory_of_small_objects_is_the_same_each_time(self):
+        code = compile("x = [(i, str(i), i * 0.5) for i in range(300)]\ny = {i: [i] for i in range(300)}", '', 'exec')
+
+        used = self.metered_memory(code, {'__contract__': True})
+        self.assertEqual(self.metered_memory(code, {'__contract__': True}), used)
+
+    def test_memory_limit_comes_from_config(self):
+        limit = config.TX_MEMORY_LIMIT
+        config.TX_MEMORY_LIMIT = 100000
+
+        try:
+            with self.assertRaises(AssertionError):
+                self.metered_memory("x = 'a' * 200000\ny = 1", {'__contract__': True})
+        finally:
+            config.TX_MEMORY_LIMIT = limit
+
+    def test_profile_attributes_costs_to_lines(self):
+        globals().pop('__contract__', None)
+        code = compile('x = 1\ny = x * 2 + x', 'con_test', 'exec')
+
+        runtime.rt.set_up(stmps=10000, meter=True, profile=True)
+        exec(code, {'__contract__': True, '__name__': 'con_test'})
+        runtime.rt.deduct_write('con_test.y', '3')
+        runtime.rt.tracer.stop()
+        used = runtime.rt.tracer.get_stamp_used()
+        profile = runtime.rt.profile()
+        runtime.rt.clean_up()
+
+        self.assertEqual(sum(line['total'] for line in profile), used)
+        self.assertEqual({(line['contract'], line['line']) for line in profile if line['execution']},
+                         {('con_test', 1), ('con_test', 2)})
+        self.assertEqual([line['write'] for line in profile if line['write']], [11 * config.WRITE_COST_PER_BYTE])
+
+    def test_profile_is_off_by_default(self):
+        runtime.rt.set_up(stmps=10000, meter=True)
+        runtime.rt.tracer.stop()
+
+        self.assertIsNone(runtime.rt.profile())
+
+    def test_each_thread_has_its_own_runtime(self):
+        runtime.rt.env = {'thread': 'main'}
+        seen = []
+
+        def run():
+            seen.append((runtime.current(), dict(runtime.rt.env)))
+            runtime.rt.env = {'thread': 'other'}
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+
+        self.assertIsNot(seen[0][0], runtime.current())
+        self.assertEqual(seen[0][1], {})
+        self.assertEqual(runtime.rt.env, {'thread': 'main'})
+
+    def metered(self, code, barrier=None):
+        runtime.rt.set_up(stmps=1000000, meter=True)
+        if barrier is not None:
+            barrier.wait()
+        exec(code, {'__contract__': True})
+        runtime.rt.tracer.stop()
+        used = runtime.rt.tracer.get_stamp_used(), runtime.rt.tracer.get_total_mem_usage()
+        runtime.rt.clean_up()
+
+        return used
+
+    def test_threads_are_metered_separately(self):
+        # Only the executed code is contract code, so what the threads themselves run costs nothing
+        marked = globals().pop('__contract__', None)
+        code = compile("for i in range(2000):\n    x = str(i) * 1000", '', 'exec')
+        alone = self.metered(code)
+
+        barrier = threading.Barrier(2)
+        results = []
+
+        def run():
+            # Both tracers are running before either thread runs the code
+            results.append(self.metered(code, barrier))
+
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            threads = [threading.Thread(target=run) for _ in range(2)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setswitchinterval(interval)
+            if marked is not None:
+                globals()['__contract__'] = marked
+
+        self.assertEqual(results, [alone, alone])
@@ -0,0 +1,86 @@
+import os
+import tempfile
+import threading
+from unittest import TestCase
+from contracting.execution.stats import Stats
+
+
+class TestStats(TestCase):
+    def test_disabled_stats_record_nothing(self):
+        stats = Stats()
+
+        with stats.phase('run'):
+            stats.incr('transactions')
+
+        self.assertEqual(stats.snapshot(), {'phases': {}, 'counters': {}})
+
+    def test_phases_are_counted_and_timed(self):
+        stats = Stats(enabled=True)
+
+        for _ in range(3):
+            with stats.phase('run'):
+                sum(range(1000))
+
+        run = stats.snapshot()['phases']['run']
+        self.assertEqual(run['count'], 3)
+        self.assertGreater(run['wall'], 0)
+        self.assertGreaterEqual(run['cpu'], 0)
+
+    def test_phase_is_recorded_when_it_raises(self):
+        stats = Stats(enabled=True)
+
+        with self.assertRaises(ValueError):
+            with stats.phase('run'):
+                raise ValueError
+
+        self.assertEqual(stats.snapshot()['phases']['run']['count'], 1)
+
+    def test_counts_from_threads_add_up(self):
+        stats = Stats(enabled=True)
+
+        def count():
+            for _ in range(10000):
+                stats.incr('transactions')
+                with stats.phase('run'):
+                    pass
+
+        threads = [threading.Thread(target=count) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        snapshot = stats.snapshot()
+        self.assertEqual(snapshot['counters']['transactions'], 40000)
+        self.assertEqual(snapshot['phases']['run']['count'], 40000)
+
+    def test_collect_resets(self):
+        stats = Stats(enabled=True)
+        stats.incr('transactions', 2)
+
+        self.assertEqual(stats.collect()['counters'], {'transactions': 2})
+        self.assertEqual(stats.snapshot()['counters'], {})
+
+    def test_prometheus_text(self):
+        stats = Stats(enabled=True)
+        stats.incr('transactions', 2)
+        with stats.phase('run'):
+            pass
+
+        text = stats.prometheus()
+
+        self.assertIn('# TYPE contracting_phase_wall_seconds counter\n', text)
+        self.assertIn('contracting_phase_count{phase="run"} 1\n', text)
+        self.assertIn('contracting_transactions_total 2\n', text)
+
+    def test_write_prometheus(self):
+        stats = Stats(enabled=True)
+        stats.incr('transactions')
+
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'contracting.prom')
+            stats.write_prometheus(path)
+
+            with open(path) as f:
+                self.assertEqual(f.read(), stats.prometheus())
+            self.assertEqual(os.listdir(d), ['contracting.prom'])
@@ -0,0 +1,22 @@
+from unittest import TestCase
+from contracting.stdlib import env
+from contracting.stdlib.bridge.orm import exports as orm_exports
+
+
+class TestGather(TestCase):
+    def test_gather_holds_every_export(self):
+        scope = env.gather()
+
+        for name, value in orm_exports.items():
+            self.assertIs(scope[name], value)
+
+    def test_gather_returns_a_fresh_scope(self):
+        scope = env.gather()
+        scope['Hash'] = None
+
+        self.assertIsNot(env.gather(), scope)
+        self.assertIsNotNone(env.gather()['Hash'])
+
+    def test_base_scope_is_read_only(self):
+        with self.assertRaises(TypeError):
+            env.SCOPE['Hash'] = None